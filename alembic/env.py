@@ -1,10 +1,13 @@
 import asyncio
 from logging.config import fileConfig
 
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 from sqlalchemy.sql import text
 
 from alembic import context
-from database.session import Base, engine
+from config import DATABASE_URL
+from database.session import Base, get_engine_options
 from models import admin, file, system  # noqa: F401
 
 # this is the Alembic Config object, which provides
@@ -46,9 +49,15 @@ def do_run_migrations_online(connection) -> None:
 
 
 async def main():
-    async with engine.begin() as conn:
-        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
-        await conn.run_sync(do_run_migrations_online)
+    # 迁移运行在独立的事件循环中，不能复用应用连接池里的连接
+    connect_args = get_engine_options().get("connect_args", {})
+    engine = create_async_engine(DATABASE_URL, poolclass=NullPool, connect_args=connect_args)
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            await conn.run_sync(do_run_migrations_online)
+    finally:
+        await engine.dispose()
 
 
 try:
@@ -0,0 +1,46 @@
+"""cursor_pagination_index
+
+Revision ID: 5b1c7e2a9d40
+Revises: 937fa48179af
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+from config import DATABASE_TABLE_PREFIX
+
+# revision identifiers, used by Alembic.
+revision: str = "5b1c7e2a9d40"
+down_revision: Union[str, None] = "937fa48179af"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        "idx_admin_user__created_at_id",
+        f"{DATABASE_TABLE_PREFIX}admin_user",
+        ["created_at", "id"],
+        unique=False,
+        schema="public",
+    )
+    op.create_index(
+        "idx_admin_role__created_at_id",
+        f"{DATABASE_TABLE_PREFIX}admin_role",
+        ["created_at", "id"],
+        unique=False,
+        schema="public",
+    )
+    op.create_index(
+        "idx_api__created_at_id", f"{DATABASE_TABLE_PREFIX}api", ["created_at", "id"], unique=False, schema="public"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("idx_api__created_at_id", table_name=f"{DATABASE_TABLE_PREFIX}api", schema="public")
+    op.drop_index("idx_admin_role__created_at_id", table_name=f"{DATABASE_TABLE_PREFIX}admin_role", schema="public")
+    op.drop_index("idx_admin_user__created_at_id", table_name=f"{DATABASE_TABLE_PREFIX}admin_user", schema="public")
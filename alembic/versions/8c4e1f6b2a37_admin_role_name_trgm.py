@@ -0,0 +1,36 @@
+"""admin_role_name_trgm
+
+Revision ID: 8c4e1f6b2a37
+Revises: 5b1c7e2a9d40
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+from config import DATABASE_TABLE_PREFIX
+
+# revision identifiers, used by Alembic.
+revision: str = "8c4e1f6b2a37"
+down_revision: Union[str, None] = "5b1c7e2a9d40"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        "idx_admin_role__name_trgm",
+        f"{DATABASE_TABLE_PREFIX}admin_role",
+        ["name"],
+        unique=False,
+        schema="public",
+        postgresql_using="gin",
+        postgresql_ops={"name": "gin_trgm_ops"},
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("idx_admin_role__name_trgm", table_name=f"{DATABASE_TABLE_PREFIX}admin_role", schema="public")
@@ -0,0 +1,75 @@
+"""admin_user_token_reaper
+
+Revision ID: a7d3e5f91c28
+Revises: 8c4e1f6b2a37
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+from config import DATABASE_TABLE_PREFIX
+
+# revision identifiers, used by Alembic.
+revision: str = "a7d3e5f91c28"
+down_revision: Union[str, None] = "8c4e1f6b2a37"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    admin_user_token_table = f"{DATABASE_TABLE_PREFIX}admin_user_token"
+    op.create_index(
+        op.f(f"ix_public_{admin_user_token_table}_expired_at"),
+        admin_user_token_table,
+        ["expired_at"],
+        unique=False,
+        schema="public",
+    )
+
+    archive_table = f"{DATABASE_TABLE_PREFIX}admin_user_token_archive"
+    op.create_table(
+        archive_table,
+        sa.Column("id", sa.String(), nullable=False),
+        sa.Column("admin_user_id", sa.Integer(), nullable=False),
+        sa.Column("status", sa.String(length=32), nullable=False),
+        sa.Column("expired_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("ip", sa.String(length=128), nullable=False),
+        sa.Column("user_agent", sa.String(length=512), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("deleted", sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        schema="public",
+    )
+    op.create_index(
+        op.f(f"ix_public_{archive_table}_admin_user_id"),
+        archive_table,
+        ["admin_user_id"],
+        unique=False,
+        schema="public",
+    )
+    op.create_index(
+        op.f(f"ix_public_{archive_table}_created_at"), archive_table, ["created_at"], unique=False, schema="public"
+    )
+    op.create_index(
+        op.f(f"ix_public_{archive_table}_deleted"), archive_table, ["deleted"], unique=False, schema="public"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    archive_table = f"{DATABASE_TABLE_PREFIX}admin_user_token_archive"
+    op.drop_index(op.f(f"ix_public_{archive_table}_deleted"), table_name=archive_table, schema="public")
+    op.drop_index(op.f(f"ix_public_{archive_table}_created_at"), table_name=archive_table, schema="public")
+    op.drop_index(op.f(f"ix_public_{archive_table}_admin_user_id"), table_name=archive_table, schema="public")
+    op.drop_table(archive_table, schema="public")
+
+    admin_user_token_table = f"{DATABASE_TABLE_PREFIX}admin_user_token"
+    op.drop_index(
+        op.f(f"ix_public_{admin_user_token_table}_expired_at"), table_name=admin_user_token_table, schema="public"
+    )
@@ -0,0 +1,119 @@
+"""admin_user_token_partition
+
+Revision ID: d4f8a2c6e913
+Revises: a7d3e5f91c28
+Create Date: 2026-10-18 14:30:00.000000
+
+只有设置了 ADMIN_TOKEN_PARTITIONED 才会将token表转换为按 created_at 按月分区的表，
+已经执行过这个版本之后再修改配置，需要先 downgrade 到 a7d3e5f91c28 再重新 upgrade
+
+"""
+
+from datetime import date, datetime, timezone
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+from config import ADMIN_TOKEN_PARTITIONED, DATABASE_SCHEMA, DATABASE_TABLE_PREFIX
+
+# revision identifiers, used by Alembic.
+revision: str = "d4f8a2c6e913"
+down_revision: Union[str, None] = "a7d3e5f91c28"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITION_AHEAD = 2
+
+admin_user_token_table = f"{DATABASE_TABLE_PREFIX}admin_user_token"
+old_table = f"{admin_user_token_table}_unpartitioned"
+index_columns = ["admin_user_id", "created_at", "deleted", "status", "expired_at"]
+
+
+def qualified(name: str) -> str:
+    return f'"{DATABASE_SCHEMA}"."{name}"'
+
+
+table = qualified(admin_user_token_table)
+old = qualified(old_table)
+
+
+def index_name(column: str) -> str:
+    return op.f(f"ix_{DATABASE_SCHEMA}_{admin_user_token_table}_{column}")
+
+
+def add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def is_partitioned() -> bool:
+    r = op.get_bind().execute(
+        sa.text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name))"),
+        {"name": qualified(admin_user_token_table)},
+    )
+    return r.scalar()
+
+
+def rename_old_table():
+    op.rename_table(admin_user_token_table, old_table, schema=DATABASE_SCHEMA)
+    op.execute(f'ALTER TABLE {old} RENAME CONSTRAINT "{admin_user_token_table}_pkey" TO "{old_table}_pkey"')
+    for column in index_columns:
+        op.drop_index(index_name(column), table_name=old_table, schema=DATABASE_SCHEMA)
+
+
+def create_indexes():
+    for column in index_columns:
+        op.create_index(
+            index_name(column),
+            admin_user_token_table,
+            [column],
+            unique=False,
+            schema=DATABASE_SCHEMA,
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not ADMIN_TOKEN_PARTITIONED or is_partitioned():
+        return
+    rename_old_table()
+    # 分区键必须包含在主键中，并且不能为空
+    op.execute(f"UPDATE {old} SET created_at = COALESCE(updated_at, now()) WHERE created_at IS NULL")
+    op.execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+    op.execute(f"ALTER TABLE {table} ALTER COLUMN created_at SET NOT NULL")
+    op.execute(f'ALTER TABLE {table} ADD CONSTRAINT "{admin_user_token_table}_pkey" PRIMARY KEY (id, created_at)')
+
+    first = op.get_bind().exec_driver_sql(f"SELECT min(created_at) FROM {old}").scalar()
+    current = datetime.now(timezone.utc).date().replace(day=1)
+    month = first.astimezone(timezone.utc).date().replace(day=1) if first else current
+    last = add_months(current, PARTITION_AHEAD)
+    while month <= last:
+        end = add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE {qualified(f'{admin_user_token_table}_p{month:%Y%m}')} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month.isoformat()}+00') TO ('{end.isoformat()}+00')"
+        )
+        month = end
+    op.execute(f"CREATE TABLE {qualified(f'{admin_user_token_table}_default')} PARTITION OF {table} DEFAULT")
+
+    op.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    op.drop_table(old_table, schema=DATABASE_SCHEMA)
+    create_indexes()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not is_partitioned():
+        return
+    # 原来的分区和分区上的索引随着表一起删除
+    op.rename_table(admin_user_token_table, old_table, schema=DATABASE_SCHEMA)
+    op.execute(f'ALTER TABLE {old} RENAME CONSTRAINT "{admin_user_token_table}_pkey" TO "{old_table}_pkey"')
+    for column in index_columns:
+        op.execute(f"DROP INDEX IF EXISTS {qualified(index_name(column))}")
+    op.execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS)")
+    op.execute(f"ALTER TABLE {table} ALTER COLUMN created_at DROP NOT NULL")
+    op.execute(f'ALTER TABLE {table} ADD CONSTRAINT "{admin_user_token_table}_pkey" PRIMARY KEY (id)')
+    op.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    op.execute(f"DROP TABLE {old} CASCADE")
+    create_indexes()
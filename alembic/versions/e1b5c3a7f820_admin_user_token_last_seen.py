@@ -0,0 +1,32 @@
+"""admin_user_token_last_seen
+
+Revision ID: e1b5c3a7f820
+Revises: d4f8a2c6e913
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+from config import DATABASE_TABLE_PREFIX
+
+# revision identifiers, used by Alembic.
+revision: str = "e1b5c3a7f820"
+down_revision: Union[str, None] = "d4f8a2c6e913"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in (f"{DATABASE_TABLE_PREFIX}admin_user_token", f"{DATABASE_TABLE_PREFIX}admin_user_token_archive"):
+        op.add_column(table, sa.Column("last_seen_at", sa.DateTime(timezone=True), nullable=True), schema="public")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in (f"{DATABASE_TABLE_PREFIX}admin_user_token", f"{DATABASE_TABLE_PREFIX}admin_user_token_archive"):
+        op.drop_column(table, "last_seen_at", schema="public")
@@ -14,18 +14,89 @@ DEBUG = os.getenv("DEBUG", "True") == "True"
 CORS_ALLOW_ORIGIN = os.getenv("CORS_ALLOW_ORIGIN", "*")
 SESSION_SECRET_KEY = os.getenv("SESSION_SECRET_KEY", "CMDMwjPd1lfWpmqPpTlqyk9GFVJhW1PG")
 SESSION_SECRET_NONCE = os.getenv("SESSION_SECRET_NONCE", "8Iz6FnZxeHH7")
+SESSION_DECRYPT_CACHE_SIZE = int(os.getenv("SESSION_DECRYPT_CACHE_SIZE", "10000"))  # 进程内缓存的token解密结果数量
+SESSION_SIGN_KEY = os.getenv("SESSION_SIGN_KEY", SESSION_SECRET_KEY)  # 签名token使用的HMAC密钥
 
 # Database
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql+asyncpg://postgres@127.0.0.1:5432/fastapi")
 DATABASE_SCHEMA = os.getenv("DATABASE_SCHEMA", "public")
 DATABASE_TABLE_PREFIX = os.getenv("DATABASE_TABLE_PREFIX", "t_")  # 数据库前缀
 DATABASE_AUTO_UPGRADE = os.getenv("DATABASE_AUTO_UPGRADE", "True") == "True"
+# queue: 使用连接池, null: 不使用连接池, pgbouncer: 兼容PgBouncer的事务池模式
+DATABASE_POOL_MODE = os.getenv("DATABASE_POOL_MODE", "queue")
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "10"))  # 每个worker常驻的连接数
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))  # 每个worker允许临时超出的连接数
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))  # 连接最长复用时间，单位秒
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "10"))  # 获取连接的超时时间，单位秒
+DATABASE_POOL_PRE_PING = os.getenv("DATABASE_POOL_PRE_PING", "True") == "True"
+DATABASE_MAX_CONNECTIONS = int(os.getenv("DATABASE_MAX_CONNECTIONS", "0"))  # 所有worker的连接总数上限，0表示不限制
+DATABASE_EXPORT_POOL_SIZE = int(os.getenv("DATABASE_EXPORT_POOL_SIZE", "2"))  # 每个worker用于数据导出的连接数
+DATABASE_COUNT_CACHE_TTL = int(os.getenv("DATABASE_COUNT_CACHE_TTL", "30"))  # 分页总数的Redis缓存时间，单位秒
+DATABASE_COUNT_ESTIMATE_MIN = int(os.getenv("DATABASE_COUNT_ESTIMATE_MIN", "100000"))  # 估算的行数小于该值时精确统计
+DATABASE_CACHE_ENABLED = os.getenv("DATABASE_CACHE_ENABLED", "True") == "True"  # 是否缓存Repo中标记了@cached的查询
+DATABASE_CACHE_SIZE = int(os.getenv("DATABASE_CACHE_SIZE", "10000"))  # 进程内缓存的查询结果数量
+DATABASE_CACHE_TTL = int(os.getenv("DATABASE_CACHE_TTL", "300"))  # 查询结果的默认Redis缓存时间，单位秒
+DATABASE_CACHE_LOCAL_TTL = int(
+    os.getenv("DATABASE_CACHE_LOCAL_TTL", "60")
+)  # 进程内缓存的兜底过期时间，正常情况下由广播消息清除
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))  # worker进程数，和uvicorn保持一致
 
 # Redis
 REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+REDIS_CLIENT_CACHE = os.getenv("REDIS_CLIENT_CACHE", "False") == "True"  # 是否开启客户端缓存，需要Redis 6以上
+REDIS_PROTOCOL = int(
+    os.getenv("REDIS_PROTOCOL", "3" if REDIS_CLIENT_CACHE else "2")
+)  # RESP协议版本，默认RESP2，开启客户端缓存时默认RESP3
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))  # 连接池的最大连接数
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))  # 连接池满时等待空闲连接的时间，单位秒
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))  # 读写超时，单位秒
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", "5"))  # 建立连接超时，单位秒
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))  # 空闲连接使用前的检查间隔，单位秒
+REDIS_CLIENT_CACHE_PREFIXES = os.getenv(
+    "REDIS_CLIENT_CACHE_PREFIXES", "count.,search.,repo_cache.tag."
+)  # 客户端缓存的前缀，逗号分隔
+REDIS_CLIENT_CACHE_SIZE = int(os.getenv("REDIS_CLIENT_CACHE_SIZE", "10000"))  # 客户端缓存的key数量
 
 # Admin
 ADMIN_USERNAME_PATTERN = r"^[a-zA-Z][a-zA-Z0-9_-]*$"
+ADMIN_API_AUTO_SYNC = os.getenv("ADMIN_API_AUTO_SYNC", "False") == "True"  # 启动时自动将管理后台的路由同步到Api表
+# dense: 排序值连续，移动时需要更新中间的所有权限; gap: 排序值之间留有间隔，移动时只更新被移动的权限
+PERMISSION_SORT_MODE = os.getenv("PERMISSION_SORT_MODE", "dense")
+PERMISSION_SORT_GAP = int(os.getenv("PERMISSION_SORT_GAP", "1024"))  # gap模式下相邻排序值的间隔
+ADMIN_SEARCH_SIMILARITY = float(os.getenv("ADMIN_SEARCH_SIMILARITY", "0.3"))  # 模糊搜索的相似度阈值，0~1
+ADMIN_SEARCH_CACHE_TTL = int(os.getenv("ADMIN_SEARCH_CACHE_TTL", "30"))  # 搜索结果的Redis缓存时间，单位秒
+# 批量导入用户的最大行数，每行都要在请求中计算一次密码哈希，scrypt每次约80ms，
+# 1000行在 ADMIN_PASSWORD_BULK_WORKERS=1 时约需要80秒，调大时需要相应增加线程数和请求的超时时间
+ADMIN_IMPORT_MAX_ROWS = int(os.getenv("ADMIN_IMPORT_MAX_ROWS", "1000"))
+ADMIN_TOKEN_CACHE_ENABLED = os.getenv("ADMIN_TOKEN_CACHE_ENABLED", "True") == "True"  # 是否缓存登录token的校验结果
+ADMIN_TOKEN_CACHE_SIZE = int(os.getenv("ADMIN_TOKEN_CACHE_SIZE", "10000"))  # 进程内缓存的token数量
+ADMIN_TOKEN_CACHE_LOCAL_TTL = int(os.getenv("ADMIN_TOKEN_CACHE_LOCAL_TTL", "30"))  # 进程内缓存时间，单位秒
+ADMIN_TOKEN_CACHE_TTL = int(os.getenv("ADMIN_TOKEN_CACHE_TTL", "300"))  # Redis缓存时间，单位秒
+ADMIN_TOKEN_SIGNED = os.getenv("ADMIN_TOKEN_SIGNED", "False") == "True"  # 登录时签发无状态的签名token
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "True") == "True"  # 是否对登录等接口限流
+# 限流的格式是 次数/秒数，例如 10/60 表示60秒内最多10次
+RATE_LIMIT_CAPTCHA = os.getenv("RATE_LIMIT_CAPTCHA", "30/60")  # 每个IP获取验证码
+RATE_LIMIT_LOGIN = os.getenv("RATE_LIMIT_LOGIN", "10/60")  # 每个IP登录
+RATE_LIMIT_LOGIN_USERNAME = os.getenv("RATE_LIMIT_LOGIN_USERNAME", "10/300")  # 每个用户名通过验证码之后密码错误的次数
+RATE_LIMIT_PASSWORD = os.getenv("RATE_LIMIT_PASSWORD", "5/60")  # 每个IP修改密码
+CAPTCHA_RENDER_WORKERS = int(os.getenv("CAPTCHA_RENDER_WORKERS", "1"))  # 生成验证码图片的进程数
+CAPTCHA_POOL_SIZE = int(os.getenv("CAPTCHA_POOL_SIZE", "32"))  # 预先生成的验证码图片数量，0表示不预先生成
+ADMIN_PASSWORD_TYPE = os.getenv("ADMIN_PASSWORD_TYPE", "scrypt")  # 新密码的加密方式，登录时旧的加密方式自动升级
+ADMIN_PASSWORD_HASH_WORKERS = int(os.getenv("ADMIN_PASSWORD_HASH_WORKERS", "4"))  # 密码加密线程池的大小
+ADMIN_PASSWORD_HASH_QUEUE = int(os.getenv("ADMIN_PASSWORD_HASH_QUEUE", "64"))  # 排队等待加密的最大任务数
+ADMIN_PASSWORD_BULK_WORKERS = int(os.getenv("ADMIN_PASSWORD_BULK_WORKERS", "1"))  # 批量导入用户时加密密码的线程数
+ADMIN_SESSION_STORE = os.getenv("ADMIN_SESSION_STORE", "database")  # 登录会话的存储：database 或 redis
+ADMIN_SESSION_FLUSH_INTERVAL = int(os.getenv("ADMIN_SESSION_FLUSH_INTERVAL", "5"))  # 会话写回数据库的间隔，单位秒
+ADMIN_SESSION_FLUSH_BATCH = int(os.getenv("ADMIN_SESSION_FLUSH_BATCH", "500"))  # 每次写回数据库的会话数量
+ADMIN_SESSION_TOUCH_INTERVAL = int(os.getenv("ADMIN_SESSION_TOUCH_INTERVAL", "60"))  # 最后访问时间的更新间隔，单位秒
+ADMIN_TOKEN_REAPER_ENABLED = os.getenv("ADMIN_TOKEN_REAPER_ENABLED", "True") == "True"  # 是否定期清理过期的token
+ADMIN_TOKEN_REAPER_INTERVAL = int(os.getenv("ADMIN_TOKEN_REAPER_INTERVAL", "600"))  # 清理的间隔，单位秒
+ADMIN_TOKEN_REAPER_BATCH = int(os.getenv("ADMIN_TOKEN_REAPER_BATCH", "1000"))  # 每个事务最多删除的token数量
+ADMIN_TOKEN_RETENTION_DAYS = int(os.getenv("ADMIN_TOKEN_RETENTION_DAYS", "30"))  # 过期token保留天数，需大于有效期
+ADMIN_TOKEN_ARCHIVE = os.getenv("ADMIN_TOKEN_ARCHIVE", "False") == "True"  # 清理时是否将token归档到归档表
+ADMIN_TOKEN_PARTITIONED = os.getenv("ADMIN_TOKEN_PARTITIONED", "False") == "True"  # token表是否按创建时间按月分区
+ADMIN_PERMISSION_CACHE_SIZE = int(os.getenv("ADMIN_PERMISSION_CACHE_SIZE", "10000"))  # 进程内缓存的用户权限数量
+ADMIN_PERMISSION_CACHE_TTL = int(os.getenv("ADMIN_PERMISSION_CACHE_TTL", "3600"))  # 用户权限的Redis缓存时间，单位秒
 
 
 S3_ACCESS_KEY = os.getenv("S3_ACCESS_KEY", "")
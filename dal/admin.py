@@ -1,25 +1,88 @@
 import random
-from datetime import datetime
+from datetime import date, datetime
+from typing import AsyncIterator
 
-from sqlalchemy import delete, select
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    all_,
+    and_,
+    any_,
+    bindparam,
+    delete,
+    exists,
+    func,
+    literal,
+    or_,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, insert
 from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 
-from dal.base import BaseRepo
+from config import ADMIN_PASSWORD_TYPE, ADMIN_SEARCH_SIMILARITY
+from dal.base import BaseRepo, CountMode, cached, like_prefix, load_model
 from models.admin import (
     AdminRole,
     AdminUser,
     AdminUserRole,
     AdminUserStatus,
     AdminUserToken,
+    AdminUserTokenArchive,
     AdminUserTokenStatus,
     PasswordType,
 )
+from services.password import password_hasher
 from utils.string import random_str
 
+# 批量导入用户时的临时表，事务结束后自动删除
+admin_user_import_table = Table(
+    "admin_user_import",
+    MetaData(),
+    Column("line", Integer, nullable=False),
+    Column("username", String, nullable=False),
+    Column("name", String, nullable=False),
+    Column("email", String, nullable=False),
+    Column("phone", String, nullable=False),
+    Column("password", String, nullable=False),
+    Column("salt", String, nullable=False),
+    Column("ptype", String, nullable=False),
+    Column("status", String, nullable=False),
+    Column("role_ids", ARRAY(Integer), nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+def admin_user_token_partition_name(month: date) -> str:
+    return f"{AdminUserToken.__tablename__}_p{month:%Y%m}"
+
+
+def admin_user_token_partition_table(name: str) -> str:
+    """分区和token表在同一个schema中"""
+    schema = AdminUserToken.__table__.schema
+    return f'"{schema}"."{name}"' if schema else f'"{name}"'
+
+
+def month_range(month: date) -> tuple[date, date]:
+    """返回月份的第一天和下个月的第一天"""
+    start = month.replace(day=1)
+    if start.month == 12:
+        return start, start.replace(year=start.year + 1, month=1)
+    return start, start.replace(month=start.month + 1)
+
 
 class AdminRepo(BaseRepo):
     @classmethod
     def random_ptype(cls) -> str:
+        """没有配置加密方式时随机选择一种"""
+        if ADMIN_PASSWORD_TYPE:
+            return ADMIN_PASSWORD_TYPE
         return random.choice([PasswordType.MD5.value, PasswordType.SHA256.value, PasswordType.SHA512.value])
 
     async def get_admin_user(self, id: int) -> AdminUser | None:
@@ -31,10 +94,11 @@ class AdminRepo(BaseRepo):
         r = await self.db.execute(select(AdminUser).where(AdminUser.username == username))
         return r.scalars().first()
 
-    async def check_super_admin_user_exists(self) -> bool:
-        """检查是否存在超级管理员用户"""
-        r = await self.db.execute(select(AdminUser).where(AdminUser.is_superuser))
-        return r.scalars().first()
+    @cached("admin_user.superuser")
+    async def check_super_admin_user_exists(self, uncached: bool = False) -> bool:
+        """检查是否存在超级管理员用户，uncached为True时直接查询数据库"""
+        r = await self.db.execute(select(exists().where(AdminUser.is_superuser)))
+        return r.scalar()
 
     async def create_admin_user(
         self,
@@ -49,7 +113,7 @@ class AdminRepo(BaseRepo):
     ) -> AdminUser:
         salt = random_str(13)
         ptype = self.random_ptype()
-        password = AdminUser.encrypt_password(password, salt, ptype)
+        password = await password_hasher.hash(password, salt, ptype)
         admin_user = AdminUser(
             username=username,
             name=name,
@@ -64,6 +128,9 @@ class AdminRepo(BaseRepo):
         )
         self.db.add(admin_user)
         await self.db.flush()
+        self.invalidate_count(AdminUser)
+        if is_superuser:
+            self.invalidate_cache("admin_user.superuser")
         return admin_user
 
     async def create_admin_user_token(
@@ -84,48 +151,348 @@ class AdminRepo(BaseRepo):
         await self.db.flush()
         return admin_user_token
 
+    async def save_admin_user_tokens(self, records: list[dict]):
+        """批量写入会话存储中的token，已经存在的token只更新状态"""
+        if not records:
+            return
+        table = AdminUserToken.__table__
+        await self.db.execute(insert(table).values(records).on_conflict_do_nothing())
+        await self.db.execute(
+            update(table)
+            .where(table.c.id == bindparam("b_id"), table.c.status != bindparam("b_status"))
+            .values(status=bindparam("b_status"), updated_at=func.now()),
+            [{"b_id": record["id"], "b_status": record["status"]} for record in records],
+        )
+
+    async def update_admin_user_token_last_seen(self, last_seen: list[tuple[str, datetime]]):
+        """批量更新token的最后访问时间"""
+        if not last_seen:
+            return
+        table = AdminUserToken.__table__
+        await self.db.execute(
+            update(table).where(table.c.id == bindparam("b_id")).values(last_seen_at=bindparam("b_last_seen_at")),
+            [{"b_id": id, "b_last_seen_at": last_seen_at} for id, last_seen_at in last_seen],
+        )
+
+    async def import_admin_users(self, records: list[tuple], created_by: int = 0) -> tuple[int, list[tuple[int, str]]]:
+        """
+        批量导入用户，records的字段顺序和 admin_user_import_table 一致，密码需要提前加密
+        数据先通过COPY写入临时表，再用集合操作校验并合并到用户表和用户角色表
+        返回 (导入的用户数, [(行号, 错误原因)])，有错误的行会被跳过，不影响其他行
+        """
+        staging = admin_user_import_table
+        conn = await self.db.connection()
+        await conn.run_sync(staging.create)
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            staging.name, records=records, columns=[c.name for c in staging.columns]
+        )
+
+        # 校验：用户名已存在、文件中用户名重复、角色不存在
+        ranked = select(
+            staging.c.line, func.row_number().over(partition_by=staging.c.username, order_by=staging.c.line).label("rn")
+        ).subquery()
+        role_id = func.unnest(staging.c.role_ids).table_valued("id").render_derived()
+        checks = [
+            (
+                "用户名已存在",
+                select(staging.c.line).where(exists().where(AdminUser.username == staging.c.username)),
+            ),
+            ("用户名重复", select(ranked.c.line).where(ranked.c.rn > 1)),
+            (
+                "角色不存在",
+                select(staging.c.line).where(
+                    exists(select(role_id.c.id).where(~exists().where(AdminRole.id == role_id.c.id)))
+                ),
+            ),
+        ]
+        errors: dict[int, str] = {}
+        for reason, q in checks:
+            r = await self.db.execute(q)
+            for line in r.scalars().all():
+                errors.setdefault(line, reason)
+        if errors:
+            await self.db.execute(delete(staging).where(staging.c.line == any_(literal(list(errors), ARRAY(Integer)))))
+
+        columns = ["username", "name", "email", "phone", "password", "salt", "ptype", "status"]
+        r = await self.db.execute(
+            insert(AdminUser)
+            .from_select(
+                columns + ["created_by"],
+                select(*[staging.c[c] for c in columns], literal(created_by)).order_by(staging.c.line),
+            )
+            .on_conflict_do_nothing(index_elements=["username"])  # 并发创建的同名用户
+            .returning(AdminUser.username)
+        )
+        usernames = r.scalars().all()
+
+        r = await self.db.execute(
+            select(staging.c.line).where(staging.c.username != all_(literal(usernames, ARRAY(String))))
+        )
+        for line in r.scalars().all():
+            errors[line] = "用户名已存在"
+
+        role_id = func.unnest(staging.c.role_ids).table_valued("id").render_derived()
+        await self.db.execute(
+            insert(AdminUserRole)
+            .from_select(
+                ["admin_user_id", "admin_role_id"],
+                select(AdminUser.id, role_id.c.id)
+                .select_from(staging)
+                .join(AdminUser, AdminUser.username == staging.c.username)
+                .join(role_id, literal(True))
+                .where(staging.c.username == any_(literal(usernames, ARRAY(String)))),
+            )
+            .on_conflict_do_nothing(index_elements=["admin_user_id", "admin_role_id"])
+        )
+        if usernames:
+            self.invalidate_count(AdminUser)
+        return len(usernames), sorted(errors.items())
+
     async def get_admin_user_token(self, token: str) -> AdminUserToken | None:
         r = await self.db.execute(
             select(AdminUserToken).options(joinedload(AdminUserToken.admin_user)).where(AdminUserToken.id == token)
         )
         return r.scalars().first()
 
-    async def find_admin_users(
-        self, query: str = "", status: str = "", page: int = 1, page_size: int = 10
-    ) -> tuple[list[AdminUser], int]:
-        q = select(AdminUser).order_by(AdminUser.created_at.desc())
+    async def merge_admin_user_token(self, principal: dict) -> AdminUserToken:
+        """将缓存的token和用户信息合并到当前会话中，不查询数据库"""
+        admin_user_token = await self.db.merge(load_model(AdminUserToken, principal["token"]), load=False)
+        admin_user = None
+        if principal["admin_user"]:
+            admin_user = await self.db.merge(load_model(AdminUser, principal["admin_user"]), load=False)
+        set_committed_value(admin_user_token, "admin_user", admin_user)
+        return admin_user_token
+
+    async def reap_admin_user_tokens(self, before: datetime, limit: int, archive: bool = False) -> int:
+        """
+        删除在before之前过期或者注销的token，一次最多删除limit条，返回删除的数量
+        已被其他事务锁定的token直接跳过，多个worker同时清理时不会互相等待
+        """
+        ids = (
+            select(AdminUserToken.id)
+            .where(
+                or_(
+                    AdminUserToken.expired_at < before,
+                    and_(
+                        AdminUserToken.status != AdminUserTokenStatus.ACTIVE.value,
+                        AdminUserToken.updated_at < before,
+                    ),
+                )
+            )
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        table = AdminUserToken.__table__
+        deleted = delete(table).where(table.c.id.in_(ids)).returning(*table.c).cte("deleted")
+        query = select(func.count()).select_from(deleted)
+        if archive:
+            archived = (
+                insert(AdminUserTokenArchive)
+                .from_select([c.name for c in table.c], select(*deleted.c))
+                .on_conflict_do_nothing()
+                .cte("archived")
+            )
+            query = query.add_cte(archived)
+        r = await self.db.execute(query)
+        return r.scalar()
+
+    async def is_admin_user_token_partitioned(self) -> bool:
+        r = await self.db.execute(
+            text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = CAST(:name AS regclass))"),
+            {"name": AdminUserToken.__table__.fullname},
+        )
+        return r.scalar()
+
+    async def find_admin_user_token_partitions(self) -> dict[date, str]:
+        """返回按月划分的分区 月份 -> 分区表名，不包括默认分区"""
+        r = await self.db.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = CAST(:name AS regclass)"
+            ),
+            {"name": AdminUserToken.__table__.fullname},
+        )
+        prefix = AdminUserToken.__tablename__ + "_p"
+        partitions = {}
+        for (name,) in r.fetchall():
+            suffix = name.removeprefix(prefix)
+            if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+                partitions[date(int(suffix[:4]), int(suffix[4:]), 1)] = name
+        return partitions
+
+    async def create_admin_user_token_partition(self, month: date) -> str:
+        """创建某个月的分区"""
+        name = admin_user_token_partition_name(month)
+        start, end = month_range(month)
+        await self.db.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {admin_user_token_partition_table(name)} "
+                f"PARTITION OF {AdminUserToken.__table__.fullname} "
+                f"FOR VALUES FROM ('{start.isoformat()}+00') TO ('{end.isoformat()}+00')"
+            )
+        )
+        return name
+
+    async def drop_admin_user_token_partition(self, name: str, archive: bool = False):
+        """分离并删除分区，archive为True时先将数据复制到归档表"""
+        partition = admin_user_token_partition_table(name)
+        await self.db.execute(text(f"ALTER TABLE {AdminUserToken.__table__.fullname} DETACH PARTITION {partition}"))
+        if archive:
+            columns = ", ".join(c.name for c in AdminUserToken.__table__.c)
+            await self.db.execute(
+                text(
+                    f"INSERT INTO {AdminUserTokenArchive.__table__.fullname} ({columns}) "
+                    f"SELECT {columns} FROM {partition} ON CONFLICT DO NOTHING"
+                )
+            )
+        await self.db.execute(text(f"DROP TABLE {partition}"))
+
+    def _admin_users_query(self, query: str = "", status: str = ""):
+        q = select(AdminUser).order_by(AdminUser.created_at.desc(), AdminUser.id.desc())
         if query:
             q = q.where((AdminUser.name.contains(query)) | (AdminUser.username.contains(query)))
         if status:
             q = q.where(AdminUser.status == status)
+        return q
+
+    async def find_admin_users(
+        self, query: str = "", status: str = "", page: int = 1, page_size: int = 10, count: CountMode = CountMode.EXACT
+    ) -> tuple[list[AdminUser], int | None, bool]:
+        return await self._query_pagination(self._admin_users_query(query, status), page, page_size, count=count)
 
-        return await self._query_pagination(q, page, page_size)
+    async def find_admin_users_by_cursor(
+        self, query: str = "", status: str = "", cursor: tuple | None = None, page_size: int = 10
+    ) -> tuple[list[AdminUser], str | None, str | None]:
+        q = self._admin_users_query(query, status)
+        return await self._query_cursor_pagination(q, AdminUser, cursor, page_size)
+
+    async def search_admin_users(
+        self, query: str, status: str = "", page: int = 1, page_size: int = 10
+    ) -> tuple[list[AdminUser], int | None, bool]:
+        """按用户名和姓名的相似度搜索用户，相似度越高越靠前，过滤可以使用 gin_trgm_ops 索引"""
+        await self._set_similarity_threshold(ADMIN_SEARCH_SIMILARITY)
+        q = select(AdminUser).where(
+            literal(query).op("<%")(AdminUser.username) | literal(query).op("<%")(AdminUser.name)
+        )
+        if status:
+            q = q.where(AdminUser.status == status)
+        similarity = func.greatest(
+            func.word_similarity(query, AdminUser.username), func.word_similarity(query, AdminUser.name)
+        )
+        q = q.order_by(similarity.desc(), AdminUser.id.desc())
+        return await self._query_pagination(q, page, page_size, count=CountMode.WINDOW)
 
-    async def get_admin_role(self, id: int) -> AdminRole | None:
-        r = await self.db.execute(select(AdminRole).where(AdminRole.id == id))
+    async def suggest_admin_users(self, prefix: str, limit: int = 10) -> list[AdminUser]:
+        """用户名或姓名的前缀匹配，用于输入框的自动补全"""
+        pattern = like_prefix(prefix)
+        r = await self.db.execute(
+            select(AdminUser)
+            .where(AdminUser.username.ilike(pattern, escape="\\") | AdminUser.name.ilike(pattern, escape="\\"))
+            .order_by(func.length(AdminUser.username), AdminUser.username)
+            .limit(limit)
+        )
+        return r.scalars().all()
+
+    def stream_admin_users(self, query: str = "", status: str = "") -> AsyncIterator[AdminUser]:
+        return self._stream(self._admin_users_query(query, status))
+
+    @cached("admin_role", model=AdminRole)
+    async def get_admin_role(self, id: int, with_for_update: bool = False) -> AdminRole | None:
+        q = select(AdminRole).where(AdminRole.id == id)
+        if with_for_update:
+            q = q.with_for_update()
+        r = await self.db.execute(q)
         return r.scalars().first()
 
     async def create_admin_role(self, name: str, remark: str, permission_ids: list[int], created_by: int):
         role = AdminRole(name=name, remark=remark, permission_ids=permission_ids, created_by=created_by)
         self.db.add(role)
         await self.db.flush()
+        self.invalidate_count(AdminRole)
+        self.invalidate_cache("admin_role")
         return role
 
-    async def find_admin_roles(self, query: str = "", page: int = 1, page_size: int = 10):
-        q = select(AdminRole).order_by(AdminRole.created_at.desc())
+    async def update_admin_role(self, admin_role: AdminRole, name: str, remark: str, permission_ids: list[int]):
+        admin_role.name = name
+        admin_role.remark = remark
+        admin_role.permission_ids = permission_ids
+        await self.db.flush()
+        self.invalidate_cache("admin_role")
+        return admin_role
+
+    def _admin_roles_query(self, query: str = ""):
+        q = select(AdminRole).order_by(AdminRole.created_at.desc(), AdminRole.id.desc())
         if query:
             q = q.where(AdminRole.name.contains(query))
+        return q
 
-        return await self._query_pagination(q, page, page_size)
+    async def find_admin_roles(
+        self, query: str = "", page: int = 1, page_size: int = 10, count: CountMode = CountMode.EXACT
+    ) -> tuple[list[AdminRole], int | None, bool]:
+        return await self._query_pagination(self._admin_roles_query(query), page, page_size, count=count)
 
-    async def create_admin_user_role(self, admin_user_id: int, admin_role_id: int) -> AdminUserRole:
-        admin_user_role = AdminUserRole(admin_user_id=admin_user_id, admin_role_id=admin_role_id)
-        self.db.add(admin_user_role)
-        await self.db.flush()
-        return admin_user_role
+    async def find_admin_roles_by_cursor(
+        self, query: str = "", cursor: tuple | None = None, page_size: int = 10
+    ) -> tuple[list[AdminRole], str | None, str | None]:
+        return await self._query_cursor_pagination(self._admin_roles_query(query), AdminRole, cursor, page_size)
+
+    async def search_admin_roles(
+        self, query: str, page: int = 1, page_size: int = 10
+    ) -> tuple[list[AdminRole], int | None, bool]:
+        """按角色名称的相似度搜索角色"""
+        await self._set_similarity_threshold(ADMIN_SEARCH_SIMILARITY)
+        q = (
+            select(AdminRole)
+            .where(literal(query).op("<%")(AdminRole.name))
+            .order_by(func.word_similarity(query, AdminRole.name).desc(), AdminRole.id.desc())
+        )
+        return await self._query_pagination(q, page, page_size, count=CountMode.WINDOW)
+
+    async def suggest_admin_roles(self, prefix: str, limit: int = 10) -> list[AdminRole]:
+        r = await self.db.execute(
+            select(AdminRole)
+            .where(AdminRole.name.ilike(like_prefix(prefix), escape="\\"))
+            .order_by(func.length(AdminRole.name), AdminRole.name)
+            .limit(limit)
+        )
+        return r.scalars().all()
 
-    async def delete_admin_user_role_by_user_id(self, admin_user_id: int):
-        await self.db.execute(delete(AdminUserRole).where(AdminUserRole.admin_user_id == admin_user_id))
+    def stream_admin_roles(self, query: str = "") -> AsyncIterator[AdminRole]:
+        return self._stream(self._admin_roles_query(query))
+
+    async def check_admin_roles_exist(self, admin_role_ids: list[int]) -> bool:
+        """一次查询检查所有角色是否都存在"""
+        admin_role_ids = set(admin_role_ids)
+        if not admin_role_ids:
+            return True
+        r = await self.db.execute(
+            select(func.count())
+            .select_from(AdminRole)
+            .where(AdminRole.id == any_(literal(list(admin_role_ids), ARRAY(Integer))))
+        )
+        return r.scalar() == len(admin_role_ids)
+
+    async def sync_admin_user_roles(self, admin_user_id: int, admin_role_ids: list[int]):
+        """将用户的角色设置为 admin_role_ids，只删除不再拥有的角色，只插入新增的角色"""
+        admin_role_ids = list(dict.fromkeys(admin_role_ids))
+        q = delete(AdminUserRole).where(AdminUserRole.admin_user_id == admin_user_id)
+        if admin_role_ids:
+            q = q.where(AdminUserRole.admin_role_id != all_(literal(admin_role_ids, ARRAY(Integer))))
+        await self.db.execute(q)
+        if admin_role_ids:
+            await self.db.execute(
+                insert(AdminUserRole)
+                .values([{"admin_user_id": admin_user_id, "admin_role_id": id} for id in admin_role_ids])
+                .on_conflict_do_nothing(index_elements=["admin_user_id", "admin_role_id"])
+            )
+
+    async def find_admin_role_user_ids(self, admin_role_id: int) -> list[int]:
+        """获取拥有该角色的所有用户ID"""
+        r = await self.db.execute(
+            select(AdminUserRole.admin_user_id).where(AdminUserRole.admin_role_id == admin_role_id)
+        )
+        return r.scalars().all()
 
     async def find_admin_user_roles(self, admin_user_id: int) -> list[AdminRole]:
         r = await self.db.execute(
@@ -136,6 +503,15 @@ class AdminRepo(BaseRepo):
         )
         return r.scalars().all()
 
+    async def find_admin_user_permission_ids(self, admin_user_id: int) -> list[int]:
+        """获取用户通过角色拥有的所有权限ID"""
+        r = await self.db.execute(
+            select(AdminRole.permission_ids)
+            .join(AdminUserRole, AdminUserRole.admin_role_id == AdminRole.id)
+            .where(AdminUserRole.admin_user_id == admin_user_id)
+        )
+        return sorted({id for permission_ids in r.scalars().all() for id in permission_ids})
+
     async def check_admin_user_permission(self, admin_user_id: int, *permission_ids: int) -> bool:
         """判断用户是否拥有权限"""
         if not permission_ids:
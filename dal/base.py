@@ -1,8 +1,241 @@
+import asyncio
+import base64
+import binascii
+import functools
+import hashlib
+import json
+import traceback
+from datetime import datetime
+from enum import Enum
+from inspect import signature
+from typing import Any, AsyncIterator, Awaitable, Callable
+
 from fastapi import Depends
+from redis import asyncio as aioredis
+from sqlalchemy import DateTime, Table, inspect, text, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 from sqlalchemy.sql import Select, func, select
 
-from database.session import get_db
+from config import (
+    DATABASE_CACHE_ENABLED,
+    DATABASE_CACHE_LOCAL_TTL,
+    DATABASE_CACHE_SIZE,
+    DATABASE_CACHE_TTL,
+    DATABASE_COUNT_CACHE_TTL,
+    DATABASE_COUNT_ESTIMATE_MIN,
+)
+from database.redis import client_cache, publish, redis, subscribe
+from database.session import after_commit, get_db, has_writes
+from utils.cache import TTLCache
+from utils.metrics import register_metrics
+
+
+def dump_model(obj: Any, exclude: tuple[str, ...] = ()) -> dict[str, Any]:
+    """将ORM对象的列导出为可以JSON序列化的字典"""
+    data = {}
+    for attr in inspect(obj).mapper.column_attrs:
+        if attr.key in exclude:
+            continue
+        value = getattr(obj, attr.key)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        data[attr.key] = value
+    return data
+
+
+def load_model[T](model: type[T], data: dict[str, Any]) -> T:
+    """从 dump_model 导出的字典还原ORM对象，对象处于detached状态，未导出的列在访问时才会加载"""
+    values = {}
+    for attr in inspect(model).column_attrs:
+        if attr.key not in data:
+            continue
+        value = data[attr.key]
+        if value is not None and isinstance(attr.columns[0].type, DateTime):
+            value = datetime.fromisoformat(value)
+        values[attr.key] = value
+    obj = model(**values)
+    make_transient_to_detached(obj)
+    return obj
+
+
+def encode_cursor(created_at: datetime, id: Any, direction: str) -> str:
+    """将 (created_at, id) 和翻页方向编码为不透明的游标"""
+    data = json.dumps([created_at.isoformat(), id, direction], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, id_type: type = int) -> tuple[datetime, Any, str] | None:
+    """解析游标，游标无效时返回None，id_type是分页表主键的类型"""
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, id, direction = json.loads(data)
+        if direction not in ("next", "prev") or not isinstance(created_at, str):
+            return None
+        if not isinstance(id, id_type) or isinstance(id, bool):  # JSON中的true/false也是int
+            return None
+        return datetime.fromisoformat(created_at), id, direction
+    except (binascii.Error, ValueError, TypeError):
+        return None
+
+
+def like_prefix(prefix: str) -> str:
+    """转义LIKE的特殊字符，生成前缀匹配的模式"""
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+class CountMode(Enum):
+    """分页查询统计总数的方式"""
+
+    EXACT = "exact"  # 单独执行 count(*) 查询
+    WINDOW = "window"  # 在分页查询中使用 count(*) over() 一起返回总数
+    ESTIMATE = "estimate"  # 没有筛选条件时使用 pg_class.reltuples 估算，数据较少或有筛选条件时精确统计
+    CACHED = "cached"  # 精确统计的结果缓存在Redis，表有新增或删除时失效
+    NONE = "none"  # 不统计总数，只返回是否还有下一页
+
+
+def count_version_key(table: Table) -> str:
+    return f"count.{table.name}.version"
+
+
+async def bump_count_version(table: Table):
+    """表的数据新增或删除并提交之后调用，使缓存的总数失效"""
+    await redis.incr(count_version_key(table))
+
+
+REPO_CACHE_CHANNEL = "repo_cache.invalidate"
+MISSING = object()
+
+
+class RepoCache:
+    """
+    Repo查询结果的两级缓存：进程内LRU + Redis，缓存的是可以JSON序列化的数据
+    缓存的数据带有计算时标签的版本号，写操作提交后增加标签的版本号并广播，所有worker中带有该标签的缓存失效
+    同一个key同时未命中时只有第一个协程查询数据库，其他协程等待它的结果
+    """
+
+    def __init__(self, redis: aioredis.Redis, enabled: bool, maxsize: int, local_ttl: int):
+        self.redis = redis
+        self.enabled = enabled
+        self.local = TTLCache(maxsize)
+        self.local_ttl = local_ttl
+        self.inflight: dict[str, asyncio.Future] = {}
+        self.invalidations = 0  # 本地缓存失效的次数，查询期间有失效时不写入本地缓存
+        self.loads = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def tag_key(tag: str) -> str:
+        return f"repo_cache.tag.{tag}"
+
+    async def get_or_load(self, key: str, tags: tuple[str, ...], ttl: int, load: Callable[[], Awaitable[Any]]) -> Any:
+        item = self.local.get(key)
+        if item is not None:
+            return item[0]
+        future = self.inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            data = await asyncio.shield(future)
+            return await load() if data is MISSING else data  # 第一个协程查询失败时自己查询
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        data = MISSING
+        try:
+            data = await self._load(key, tags, ttl, load)
+            return data
+        finally:
+            del self.inflight[key]
+            future.set_result(data)
+
+    async def _load(self, key: str, tags: tuple[str, ...], ttl: int, load: Callable[[], Awaitable[Any]]) -> Any:
+        invalidations = self.invalidations
+        try:
+            value, *versions = await client_cache.mget(key, *[self.tag_key(tag) for tag in tags])
+        except Exception:
+            traceback.print_exc()
+            return await load()
+        versions = [int(v or 0) for v in versions]
+        cached = json.loads(value) if value else None
+        if cached and cached["versions"] == versions:
+            data = cached["data"]
+        else:
+            self.loads += 1
+            data = await load()
+            try:
+                await self.redis.set(key, json.dumps({"versions": versions, "data": data}), ex=ttl)
+            except Exception:
+                traceback.print_exc()
+        if self.invalidations == invalidations:
+            self.local.set(key, (data, frozenset(tags)), min(ttl, self.local_ttl))
+        return data
+
+    async def invalidate(self, *tags: str):
+        """写操作提交之后调用，使带有这些标签的缓存失效"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for tag in tags:
+                pipe.incr(self.tag_key(tag))
+            await pipe.execute()
+        self.drop(tags)
+        await publish(REPO_CACHE_CHANNEL, {"tags": list(tags)})
+
+    def drop(self, tags: tuple[str, ...] | list[str]):
+        """清除本地缓存中带有这些标签的数据"""
+        self.invalidations += 1
+        self.local.pop_if(lambda key, item: not item[1].isdisjoint(tags))
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            **self.local.stats(),
+            "enabled": self.enabled,
+            "loads": self.loads,
+            "coalesced": self.coalesced,
+            "inflight": len(self.inflight),
+        }
+
+
+repo_cache = RepoCache(redis, DATABASE_CACHE_ENABLED, DATABASE_CACHE_SIZE, DATABASE_CACHE_LOCAL_TTL)
+register_metrics("repo_cache", repo_cache.metrics)
+
+
+@subscribe(REPO_CACHE_CHANNEL)
+async def on_repo_cache_invalidate(message: dict[str, Any]):
+    repo_cache.drop(message["tags"])
+
+
+def cached(*tags: str, model: type | None = None, ttl: int = DATABASE_CACHE_TTL):
+    """
+    缓存Repo方法的结果，除self之外的参数组成缓存的key
+    参数 with_for_update 或 uncached 为True，或者当前事务中有未提交的修改时不使用缓存
+    model 不为空时方法返回该模型的对象或None，缓存导出的列，读取时合并到当前会话，否则结果需要可以JSON序列化
+    写操作通过 BaseRepo.invalidate_cache 使相同标签的缓存失效
+    """
+
+    def decorator(fn):
+        sig = signature(fn)
+
+        @functools.wraps(fn)
+        async def wrapper(self: "BaseRepo", *args, **kwargs):
+            bound = sig.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            params = {k: v for k, v in bound.arguments.items() if k != "self"}
+            # 当前事务有未提交的修改时查询结果可能包含这些修改，不能写入缓存，也不应该读取缓存
+            if not repo_cache.enabled or params.get("with_for_update") or params.get("uncached") or has_writes(self.db):
+                return await fn(self, *args, **kwargs)
+
+            async def load():
+                result = await fn(self, *args, **kwargs)
+                return dump_model(result) if model is not None and result is not None else result
+
+            key = f"repo_cache.{fn.__qualname__}:{json.dumps(params, sort_keys=True, default=str)}"
+            data = await repo_cache.get_or_load(key, tags, ttl, load)
+            if model is not None and data is not None:
+                return await self.db.merge(load_model(model, data), load=False)
+            return data
+
+        return wrapper
+
+    return decorator
 
 
 class BaseRepo:
@@ -18,20 +251,145 @@ class BaseRepo:
     async def flush(self):
         await self.db.flush()
 
+    def after_commit(self, fn: Callable[[], Awaitable[Any]]):
+        """注册在事务提交成功之后执行的回调"""
+        after_commit(self.db, fn)
+
+    async def _stream[T](self, query: Select, yield_per: int = 500) -> AsyncIterator[T]:
+        """使用服务端游标逐批读取数据，用于导出等需要遍历整张表的场景"""
+        result = await self.db.stream_scalars(query.execution_options(yield_per=yield_per))
+        async for obj in result:
+            yield obj
+
+    async def _set_similarity_threshold(self, threshold: float):
+        """设置当前事务中 pg_trgm 的 <% 和 % 运算符的相似度阈值"""
+        await self.db.execute(
+            text(
+                "SELECT set_config('pg_trgm.word_similarity_threshold', :t, true), "
+                "set_config('pg_trgm.similarity_threshold', :t, true)"
+            ),
+            {"t": str(threshold)},
+        )
+
+    def invalidate_count(self, model: type):
+        """事务提交后使该表缓存的分页总数失效"""
+        self.after_commit(lambda: bump_count_version(model.__table__))
+
+    def invalidate_cache(self, *tags: str):
+        """事务提交后使带有这些标签的 @cached 查询结果失效"""
+        self.after_commit(lambda: repo_cache.invalidate(*tags))
+
     async def _query_pagination[T](
-        self, query: Select, page: int, page_size: int, fetch_all: bool = False
-    ) -> tuple[list[T], int]:
-        # 分页查询
-        paginated_query = query.limit(page_size).offset((page - 1) * page_size)
-        r = await self.db.execute(paginated_query)
-        if fetch_all:
-            items = r.fetchall()
+        self,
+        query: Select,
+        page: int,
+        page_size: int,
+        fetch_all: bool = False,
+        count: CountMode = CountMode.EXACT,
+    ) -> tuple[list[T], int | None, bool]:
+        """分页查询，返回 (数据, 总数, 是否还有下一页)，CountMode.NONE 时总数为None"""
+        offset = (page - 1) * page_size
+        if count == CountMode.NONE:  # 多查一条用来判断是否还有下一页
+            items = await self._fetch_page(query.limit(page_size + 1).offset(offset), fetch_all)
+            return items[:page_size], None, len(items) > page_size
+
+        if count == CountMode.WINDOW:
+            r = await self.db.execute(query.add_columns(func.count().over()).limit(page_size).offset(offset))
+            rows = r.fetchall()
+            items = [row[:-1] if fetch_all else row[0] for row in rows]
+            if rows:
+                total_count = rows[0][-1]
+            else:  # 超出最后一页时查询不到总数
+                total_count = await self._count(query) if offset else 0
         else:
-            items = r.scalars().all()
+            items = await self._fetch_page(query.limit(page_size).offset(offset), fetch_all)
+            if count == CountMode.ESTIMATE:
+                total_count = await self._estimate_count(query)
+            elif count == CountMode.CACHED:
+                total_count = await self._cached_count(query)
+            else:
+                total_count = await self._count(query)
+        return items, total_count, offset + len(items) < total_count
+
+    async def _fetch_page(self, query: Select, fetch_all: bool) -> list:
+        r = await self.db.execute(query)
+        if fetch_all:
+            return r.fetchall()
+        return r.scalars().all()
 
-        # 总数查询
-        count_query = select(func.count()).select_from(query.subquery())
+    async def _count(self, query: Select) -> int:
+        count_query = select(func.count()).select_from(query.order_by(None).subquery())
         r_count = await self.db.execute(count_query)
-        total_count = r_count.scalar()
+        return r_count.scalar()
+
+    async def _estimate_count(self, query: Select) -> int:
+        """没有筛选条件时直接读取统计信息中的行数，不扫描表"""
+        froms = query.get_final_froms()
+        if query.whereclause is not None or len(froms) != 1 or not isinstance(froms[0], Table):
+            return await self._count(query)
+        r = await self.db.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:name AS regclass)"),
+            {"name": froms[0].fullname},
+        )
+        estimate = r.scalar()
+        if estimate is None or estimate < DATABASE_COUNT_ESTIMATE_MIN:  # 没有统计信息(-1)或者数据较少
+            return await self._count(query)
+        return estimate
+
+    async def _cached_count(self, query: Select) -> int:
+        """精确统计的结果以 表的版本号+查询语句 为key缓存在Redis"""
+        froms = query.get_final_froms()
+        if len(froms) != 1 or not isinstance(froms[0], Table):
+            return await self._count(query)
+        table = froms[0]
+        compiled = query.order_by(None).compile()
+        digest = hashlib.sha1(f"{compiled}|{sorted(compiled.params.items())}".encode()).hexdigest()
+        key = f"count.{table.name}.{digest}"
+        try:
+            version, data = await client_cache.mget(count_version_key(table), key)
+        except Exception:
+            traceback.print_exc()
+            return await self._count(query)
+        version = int(version or 0)
+        if data:
+            cached = json.loads(data)
+            if cached["version"] == version:
+                return cached["count"]
+
+        total_count = await self._count(query)
+        try:
+            await redis.set(key, json.dumps({"version": version, "count": total_count}), ex=DATABASE_COUNT_CACHE_TTL)
+        except Exception:
+            traceback.print_exc()
+        return total_count
 
-        return (items, total_count)
+    async def _query_cursor_pagination[T](
+        self, query: Select, model: type[T], cursor: tuple[datetime, Any, str] | tuple[()] | None, page_size: int
+    ) -> tuple[list[T], str | None, str | None]:
+        """
+        游标分页，按 (created_at, id) 倒序，通过联合索引直接定位到游标的位置，不需要扫描前面的数据
+        返回 (数据, 下一页游标, 上一页游标)，没有下一页或上一页时游标为None
+        """
+        key = tuple_(model.created_at, model.id)
+        if cursor and cursor[2] == "prev":  # 向前翻页时正序查询，再把结果反转
+            query = query.where(key > tuple_(*cursor[:2])).order_by(None).order_by(model.created_at, model.id)
+        else:
+            if cursor:
+                query = query.where(key < tuple_(*cursor[:2]))
+            query = query.order_by(None).order_by(model.created_at.desc(), model.id.desc())
+        r = await self.db.execute(query.limit(page_size + 1))  # 多查一条用来判断是否还有数据
+        items = list(r.scalars().all())
+        has_more = len(items) > page_size
+        items = items[:page_size]
+
+        if cursor and cursor[2] == "prev":
+            items.reverse()
+            has_next, has_prev = True, has_more
+        else:
+            has_next, has_prev = has_more, bool(cursor)
+        next_cursor = prev_cursor = None
+        if items and has_next:
+            next_cursor = encode_cursor(items[-1].created_at, items[-1].id, "next")
+        if items and has_prev:
+            prev_cursor = encode_cursor(items[0].created_at, items[0].id, "prev")
+        return items, next_cursor, prev_cursor
@@ -1,3 +1,7 @@
+from typing import AsyncIterator
+
+from sqlalchemy import select
+
 from dal.base import BaseRepo
 from models.file import File
 
@@ -13,3 +17,6 @@ class FileRepo(BaseRepo):
 
     async def get_file(self, id: str) -> File | None:
         return await self.db.get(File, id)
+
+    def stream_files(self) -> AsyncIterator[File]:
+        return self._stream(select(File).order_by(File.created_at.desc(), File.id.desc()))
@@ -1,14 +1,33 @@
-from sqlalchemy import func, select, update
+from typing import AsyncIterator
 
-from dal.base import BaseRepo
+from sqlalchemy import Integer, Text, any_, cast, delete, exists, func, literal, select, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.orm import aliased
+
+from config import PERMISSION_SORT_GAP, PERMISSION_SORT_MODE
+from dal.base import BaseRepo, CountMode, cached
 from models.system import Api, Permission
 
 
+def build_permission_tree(permissions: list[Permission], parent_id: int = 0) -> list[Permission]:
+    """将按 parent_id, sort 排序的权限列表组装成树，返回 parent_id 的子权限"""
+    children_map: dict[int, list[Permission]] = {}
+    for permission in permissions:
+        children_map.setdefault(permission.parent_id, []).append(permission)
+    for permission in permissions:
+        permission.children = children_map.get(permission.id, [])
+    return children_map.get(parent_id, [])
+
+
+MAX_PERMISSION_DEPTH = 64  # 防止数据异常出现环时无限递归
+
+
 class SystemRepo(BaseRepo):
     async def create_api(self, method: str, path: str, created_by: int = 0, permission_ids: list[int] = []):
         api = Api(method=method, path=path, permission_ids=permission_ids, created_by=created_by)
         self.db.add(api)
         await self.db.flush()
+        self.invalidate_cache("api")
         return api
 
     async def get_api_by_method_and_path(self, method: str, path: str):
@@ -20,6 +39,31 @@ class SystemRepo(BaseRepo):
         )
         return r.scalars().first()
 
+    async def sync_apis(
+        self, routes: list[tuple[str, str]], created_by: int = 0
+    ) -> tuple[list[tuple[str, str]], list[Api]]:
+        """
+        一条语句批量创建缺少的Api，已存在的Api保持不变
+        返回 (新创建的 (method, path), 所有的Api)
+        """
+        created = []
+        if routes:
+            r = await self.db.execute(
+                insert(Api)
+                .values([{"method": m, "path": p, "permission_ids": [], "created_by": created_by} for m, p in routes])
+                .on_conflict_do_nothing(index_elements=["method", "path"])
+                .returning(Api.method, Api.path)
+            )
+            created = [tuple(row) for row in r.fetchall()]
+        if created:
+            self.invalidate_cache("api")
+        return created, await self.find_all_apis()
+
+    async def find_all_apis(self) -> list[Api]:
+        r = await self.db.execute(select(Api))
+        return r.scalars().all()
+
+    @cached("api", model=Api)
     async def get_api(self, id: int, with_for_update: bool = False) -> Api | None:
         q = select(Api).where(Api.id == id)
         if with_for_update:
@@ -27,22 +71,56 @@ class SystemRepo(BaseRepo):
         r = await self.db.execute(q)
         return r.scalars().first()
 
+    async def update_api(self, api: Api, method: str, path: str, permission_ids: list[int]) -> Api:
+        api.method = method
+        api.path = path
+        api.permission_ids = permission_ids
+        await self.db.flush()
+        self.invalidate_cache("api")
+        return api
+
     async def delete_api(self, id: int):
-        api = await self.get_api(id)
+        api = await self.get_api(id, with_for_update=True)
         if not api:
             return None
         await self.db.delete(api)
         await self.db.flush()
+        self.invalidate_cache("api")
 
-    async def find_apis(self, method: str, path: str, page: int = 1, page_size: int = 10) -> tuple[list[Api], int]:
-        q = select(Api).order_by(Api.created_at.desc())
+    def _apis_query(self, method: str, path: str):
+        q = select(Api).order_by(Api.created_at.desc(), Api.id.desc())
         if method:
             q = q.where(Api.method == method)
         if path:
             q = q.where(Api.path == path)
+        return q
 
-        return await self._query_pagination(q, page, page_size)
+    async def find_apis(
+        self, method: str, path: str, page: int = 1, page_size: int = 10, count: CountMode = CountMode.EXACT
+    ) -> tuple[list[Api], int | None, bool]:
+        return await self._query_pagination(self._apis_query(method, path), page, page_size, count=count)
 
+    async def find_apis_by_cursor(
+        self, method: str, path: str, cursor: tuple | None = None, page_size: int = 10
+    ) -> tuple[list[Api], str | None, str | None]:
+        return await self._query_cursor_pagination(self._apis_query(method, path), Api, cursor, page_size)
+
+    def stream_apis(self, method: str = "", path: str = "") -> AsyncIterator[Api]:
+        return self._stream(self._apis_query(method, path))
+
+    async def check_permissions_exist(self, permission_ids: list[int]) -> bool:
+        """一次查询检查所有权限是否都存在"""
+        permission_ids = set(permission_ids)
+        if not permission_ids:
+            return True
+        r = await self.db.execute(
+            select(func.count())
+            .select_from(Permission)
+            .where(Permission.id == any_(literal(list(permission_ids), ARRAY(Integer))))
+        )
+        return r.scalar() == len(permission_ids)
+
+    @cached("permission", model=Permission)
     async def get_permission(self, id: int, with_for_update: bool = False) -> Permission | None:
         query = select(Permission).where(Permission.id == id)
         if with_for_update:
@@ -51,15 +129,30 @@ class SystemRepo(BaseRepo):
         return r.scalars().first()
 
     async def get_permission_by_fullcode(self, code: str) -> Permission | None:
-        codes = code.split(".")
-        parent_id = 0
-        permission = None
-        for code in codes:
-            permission = await self.get_permission_by_code_and_parent(code, parent_id)
-            if not permission:
-                return None
-            parent_id = permission.id
-        return permission
+        permissions = await self.find_permissions_by_fullcodes([code])
+        return permissions.get(code)
+
+    async def find_permissions_by_fullcodes(self, codes: list[str]) -> dict[str, Permission]:
+        """根据完整权限代码（如 admin.user.create）批量查找权限，只需要一次查询"""
+        if not codes:
+            return {}
+        paths = (
+            select(Permission.id, cast(Permission.code, Text).label("fullcode"), literal(1).label("depth"))
+            .where(Permission.parent_id == 0)
+            .cte("paths", recursive=True)
+        )
+        child = aliased(Permission)
+        paths = paths.union_all(
+            select(child.id, paths.c.fullcode + "." + cast(child.code, Text), paths.c.depth + 1).where(
+                child.parent_id == paths.c.id, paths.c.depth < MAX_PERMISSION_DEPTH
+            )
+        )
+        r = await self.db.execute(
+            select(paths.c.fullcode, Permission)
+            .join(Permission, Permission.id == paths.c.id)
+            .where(paths.c.fullcode.in_(codes))
+        )
+        return {fullcode: permission for fullcode, permission in r.all()}
 
     async def get_permission_by_code_and_parent(self, code: str, parent_id: int) -> Permission | None:
         q = select(Permission).where(Permission.code == code, Permission.parent_id == parent_id)
@@ -68,16 +161,22 @@ class SystemRepo(BaseRepo):
 
     async def find_chilren_permissions_by_parent(self, parent_id: int) -> list[Permission]:
         r = await self.db.execute(
-            select(Permission).order_by(Permission.sort.asc()).where(Permission.parent_id == parent_id)
+            select(Permission)
+            .order_by(Permission.sort.asc(), Permission.id.asc())
+            .where(Permission.parent_id == parent_id)
+        )
+        return r.scalars().all()
+
+    async def find_all_permissions(self) -> list[Permission]:
+        r = await self.db.execute(
+            select(Permission).order_by(Permission.parent_id.asc(), Permission.sort.asc(), Permission.id.asc())
         )
         return r.scalars().all()
 
     async def find_chilren_permissions_by_parent_r(self, parent_id: int) -> list[Permission]:
-        """递归获取子权限"""
-        children = await self.find_chilren_permissions_by_parent(parent_id)
-        for child in children:
-            child.children = await self.find_chilren_permissions_by_parent_r(child.id)
-        return children
+        """递归获取子权限，一次查询所有权限后在内存中组装成树"""
+        permissions = await self.find_all_permissions()
+        return build_permission_tree(permissions, parent_id)
 
     async def create_permission(
         self,
@@ -87,36 +186,86 @@ class SystemRepo(BaseRepo):
         parent_id: int = 0,
         created_by: int = 0,
     ) -> Permission:
-        r = await self.db.execute(
-            select(Permission).order_by(Permission.sort.desc()).where(Permission.parent_id == parent_id)
-        )
-        last = r.scalars().first()
+        r = await self.db.execute(select(func.max(Permission.sort)).where(Permission.parent_id == parent_id))
+        last = r.scalar()
         sort = 0
-        if last:
-            sort = last.sort + 1
+        if last is not None:
+            sort = last + (PERMISSION_SORT_GAP if PERMISSION_SORT_MODE == "gap" else 1)
 
         permission = Permission(
             name=name, code=code, remark=remark, parent_id=parent_id, sort=sort, created_by=created_by
         )
         self.db.add(permission)
         await self.db.flush()
+        self.invalidate_cache("permission")
+        return permission
+
+    async def update_permission(
+        self, permission: Permission, name: str, code: str, parent_id: int, remark: str
+    ) -> Permission:
+        permission.name = name
+        permission.code = code
+        permission.parent_id = parent_id
+        permission.remark = remark
+        await self.db.flush()
+        self.invalidate_cache("permission")
         return permission
 
     async def delete_permission(self, id: int):
-        permission = await self.get_permission(id, with_for_update=True)
-        if not permission:
+        """删除权限以及所有子权限，并且从Api中移除这些权限"""
+        ids = await self.find_permission_descendant_ids(id, with_for_update=True)
+        if not ids:
             return
-        children = await self.find_chilren_permissions_by_parent(id)
-        for child in children:
-            await self.delete_permission(child.id)
 
-        await self.db.delete(permission)
+        await self.db.execute(delete(Permission).where(Permission.id.in_(ids)))
 
+        removed = func.unnest(Api.permission_ids).table_valued("x").render_derived()
         await self.db.execute(
             update(Api)
-            .where(Api.permission_ids.contains([id]))
-            .values(permission_ids=func.array_remove(Api.permission_ids, id))
+            .where(Api.permission_ids.overlap(ids))
+            .values(permission_ids=func.array(select(removed.c.x).where(removed.c.x.not_in(ids)).scalar_subquery()))
         )
+        self.invalidate_cache("permission", "api")
+
+    def _permission_descendants_cte(self, id: int):
+        """包含自身在内的所有子孙权限ID"""
+        descendants = select(Permission.id).where(Permission.id == id).cte("descendants", recursive=True)
+        child = aliased(Permission)
+        # 使用 UNION 去重，即使数据中出现环也能结束递归
+        return descendants.union(select(child.id).where(child.parent_id == descendants.c.id))
+
+    async def find_permission_descendant_ids(self, id: int, with_for_update: bool = False) -> list[int]:
+        """获取权限以及所有子孙权限的ID"""
+        descendants = self._permission_descendants_cte(id)
+        q = select(Permission.id).where(Permission.id.in_(select(descendants.c.id)))
+        if with_for_update:
+            q = q.with_for_update()
+        r = await self.db.execute(q)
+        return r.scalars().all()
+
+    async def check_permission_descendant(self, id: int, child_id: int) -> bool:
+        """检查child_id是不是id本身或者id的子孙权限"""
+        descendants = self._permission_descendants_cte(id)
+        r = await self.db.execute(select(exists().where(descendants.c.id == child_id)))
+        return r.scalar()
+
+    async def find_permission_ancestors(self, id: int) -> list[Permission]:
+        """获取权限以及所有祖先权限，从根权限开始排列"""
+        ancestors = (
+            select(Permission.id, Permission.parent_id, literal(0).label("depth"))
+            .where(Permission.id == id)
+            .cte("ancestors", recursive=True)
+        )
+        parent = aliased(Permission)
+        ancestors = ancestors.union_all(
+            select(parent.id, parent.parent_id, ancestors.c.depth + 1).where(
+                parent.id == ancestors.c.parent_id, ancestors.c.depth < MAX_PERMISSION_DEPTH
+            )
+        )
+        r = await self.db.execute(
+            select(Permission).join(ancestors, Permission.id == ancestors.c.id).order_by(ancestors.c.depth.desc())
+        )
+        return r.scalars().all()
 
     async def update_permission_sort(self, id: int, sort: int) -> Permission | None:
         permission = await self.get_permission(id, with_for_update=True)
@@ -140,4 +289,71 @@ class SystemRepo(BaseRepo):
             )
         permission.sort = sort
         await self.db.flush()
+        self.invalidate_cache("permission")
         return permission
+
+    async def move_permission(self, id: int, position: int) -> tuple[Permission | None, bool]:
+        """
+        gap模式的排序：将权限移动到同级权限中的第 position 位，只更新被移动的权限
+        新的排序值取前后两个权限的中间值，没有空隙时先重新分配同级权限的排序值
+        返回 (权限, 是否需要重新分配排序值)
+        """
+        permission = await self.get_permission(id, with_for_update=True)
+        if not permission:
+            return None, False
+        for _ in range(2):
+            r = await self.db.execute(
+                select(Permission.sort)
+                .where(Permission.parent_id == permission.parent_id, Permission.id != permission.id)
+                .order_by(Permission.sort.asc(), Permission.id.asc())
+            )
+            sorts = r.scalars().all()
+            position = max(0, min(position, len(sorts)))
+            prev = sorts[position - 1] if position > 0 else None
+            next = sorts[position] if position < len(sorts) else None
+            if prev is None and next is None:
+                sort = 0
+            elif prev is None:
+                sort = next - PERMISSION_SORT_GAP
+            elif next is None:
+                sort = prev + PERMISSION_SORT_GAP
+            elif next - prev > 1:
+                sort = (prev + next) // 2
+            else:  # 没有空隙
+                await self.rebalance_permission_sort(permission.parent_id)
+                continue
+            permission.sort = sort
+            await self.db.flush()
+            self.invalidate_cache("permission")
+            crowded = (prev is not None and sort - prev < 2) or (next is not None and next - sort < 2)
+            return permission, crowded
+        return permission, False
+
+    async def permission_sort_exhausted(self, parent_id: int) -> bool:
+        """同级权限中是否有相邻的两个排序值之间没有空隙"""
+        r = await self.db.execute(
+            select(Permission.sort).where(Permission.parent_id == parent_id).order_by(Permission.sort.asc())
+        )
+        sorts = r.scalars().all()
+        return any(next - prev < 2 for prev, next in zip(sorts, sorts[1:], strict=False))
+
+    async def rebalance_permission_sort(self, parent_id: int):
+        """按当前顺序重新分配同级权限的排序值，相邻排序值间隔 PERMISSION_SORT_GAP"""
+        ranked = (
+            select(
+                Permission.id,
+                (
+                    (func.row_number().over(order_by=(Permission.sort.asc(), Permission.id.asc())) - 1)
+                    * PERMISSION_SORT_GAP
+                ).label("sort"),
+            )
+            .where(Permission.parent_id == parent_id)
+            .subquery()
+        )
+        await self.db.execute(
+            update(Permission)
+            .where(Permission.id == ranked.c.id, Permission.sort != ranked.c.sort)
+            .values(sort=ranked.c.sort)
+            .execution_options(synchronize_session=False)
+        )
+        self.invalidate_cache("permission")
@@ -1,10 +1,196 @@
+import asyncio
+import json
+import traceback
+from typing import Any, Awaitable, Callable
+
 from redis import asyncio as aioredis
 
-from config import REDIS_URL
+from config import (
+    REDIS_CLIENT_CACHE,
+    REDIS_CLIENT_CACHE_PREFIXES,
+    REDIS_CLIENT_CACHE_SIZE,
+    REDIS_HEALTH_CHECK_INTERVAL,
+    REDIS_MAX_CONNECTIONS,
+    REDIS_POOL_TIMEOUT,
+    REDIS_PROTOCOL,
+    REDIS_SOCKET_CONNECT_TIMEOUT,
+    REDIS_SOCKET_TIMEOUT,
+    REDIS_URL,
+)
+from utils.cache import TTLCache
+from utils.metrics import register_metrics
+
+# 连接池满时等待空闲连接，而不是直接报错
+pool = aioredis.BlockingConnectionPool.from_url(
+    REDIS_URL,
+    encoding="utf-8",
+    decode_responses=True,
+    protocol=REDIS_PROTOCOL,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_POOL_TIMEOUT,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+    health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+)
+redis = aioredis.Redis.from_pool(pool)
+
+
+def get_pool_metrics() -> dict[str, Any]:
+    return {
+        "max_connections": pool.max_connections,
+        "in_use": len(getattr(pool, "_in_use_connections", ())),
+        "idle": len([c for c in getattr(pool, "_available_connections", ()) if c is not None]),
+    }
 
-redis = aioredis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
+
+register_metrics("redis", get_pool_metrics)
 
 
 async def get_redis() -> aioredis.Redis:
     global redis
     return redis
+
+
+_subscribers: dict[str, list[Callable[[dict[str, Any]], Awaitable[None]]]] = {}
+
+
+def subscribe(channel: str):
+    """注册广播消息的处理函数，用于在多个worker之间同步进程内的缓存"""
+
+    def decorator(fn: Callable[[dict[str, Any]], Awaitable[None]]):
+        _subscribers.setdefault(channel, []).append(fn)
+        return fn
+
+    return decorator
+
+
+async def publish(channel: str, message: dict[str, Any]):
+    """向所有worker广播消息"""
+    await redis.publish(channel, json.dumps(message))
+
+
+async def run_subscriber():
+    """持续接收广播消息并分发给处理函数，连接断开后自动重连"""
+    if not _subscribers:
+        return
+    while True:
+        try:
+            async with redis.pubsub(ignore_subscribe_messages=True) as pubsub:
+                await pubsub.subscribe(*_subscribers)
+                async for message in pubsub.listen():
+                    data = json.loads(message["data"])
+                    for handler in _subscribers.get(message["channel"], []):
+                        try:
+                            await handler(data)
+                        except Exception:
+                            traceback.print_exc()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            traceback.print_exc()
+            await asyncio.sleep(1)
+
+
+class ClientCache:
+    """
+    Redis客户端缓存：指定前缀的key缓存在进程内，key被修改、删除或过期时由Redis推送失效通知
+    使用RESP3连接的 CLIENT TRACKING BCAST 模式，失效通知推送到开启tracking的专用连接
+    专用连接断开期间不使用本地缓存，直接读取Redis
+    """
+
+    def __init__(self, redis: aioredis.Redis, enabled: bool, prefixes: list[str], maxsize: int, ping_interval: int):
+        if enabled and redis.connection_pool.connection_kwargs.get("protocol") != 3:
+            raise ValueError("REDIS_CLIENT_CACHE requires REDIS_PROTOCOL=3")
+        self.redis = redis
+        self.enabled = enabled
+        self.prefixes = tuple(prefixes)
+        self.local = TTLCache(maxsize)
+        self.ping_interval = ping_interval
+        self.ready = False
+        self.invalidations = 0  # 收到失效通知的次数，读取期间有失效通知时不缓存读取的结果
+
+    def tracked(self, key: str) -> bool:
+        return self.ready and key.startswith(self.prefixes)
+
+    async def mget(self, *keys: str) -> list[str | None]:
+        values: dict[str, str | None] = {}
+        missing = []
+        for key in keys:
+            if self.tracked(key) and (item := self.local.get(key)) is not None:
+                values[key] = item[0]
+            else:
+                missing.append(key)
+        if missing:
+            invalidations = self.invalidations
+            for key, value in zip(missing, await self.redis.mget(*missing), strict=True):
+                values[key] = value
+                if self.tracked(key) and self.invalidations == invalidations:
+                    self.local.set(key, (value,))
+        return [values[key] for key in keys]
+
+    async def invalidate(self, response: list) -> bool:
+        """处理失效通知 ["invalidate", [key, ...]]，FLUSHDB等操作清除所有的key时列表为None"""
+        self.invalidations += 1
+        if response[1] is None:
+            self.local.clear()
+        else:
+            for key in response[1]:
+                self.local.pop(key)
+        return True
+
+    async def run(self):
+        """开启tracking并接收失效通知，连接断开后自动重连"""
+        if not self.enabled:
+            return
+        while True:
+            # 使用连接池之外的专用连接，tracking在连接关闭时失效
+            conn = self.redis.connection_pool.make_connection()
+            try:
+                await conn.connect()
+                await self.track(conn)
+            except asyncio.CancelledError:
+                raise
+            except NotImplementedError:
+                # 当前版本的redis-py不支持处理失效通知，关闭客户端缓存
+                traceback.print_exc()
+                self.enabled = False
+                return
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self.ready = False
+                self.local.clear()
+                await conn.disconnect()
+            await asyncio.sleep(1)
+
+    async def track(self, conn: aioredis.connection.AbstractConnection):
+        # 失效通知的处理依赖redis-py解析器的内部接口
+        set_handler = getattr(getattr(conn, "_parser", None), "set_invalidation_push_handler", None)
+        if set_handler is None:
+            raise NotImplementedError("Redis parser does not support invalidation push handler")
+        set_handler(self.invalidate)
+        args = ["CLIENT", "TRACKING", "ON", "BCAST"]
+        for prefix in self.prefixes:
+            args += ["PREFIX", prefix]
+        await conn.send_command(*args)
+        await conn.read_response()
+        self.local.clear()
+        self.ready = True
+        while True:
+            # 没有失效通知时定期PING，及时发现断开的连接
+            if await conn.read_response(timeout=self.ping_interval, push_request=True) is None:
+                await conn.send_command("PING")
+                await conn.read_response()
+
+    def metrics(self) -> dict[str, Any]:
+        return {**self.local.stats(), "enabled": self.enabled, "ready": self.ready, "invalidations": self.invalidations}
+
+
+client_cache = ClientCache(
+    redis,
+    REDIS_CLIENT_CACHE,
+    [p for p in REDIS_CLIENT_CACHE_PREFIXES.split(",") if p],
+    REDIS_CLIENT_CACHE_SIZE,
+    REDIS_HEALTH_CHECK_INTERVAL,
+)
+register_metrics("redis_client_cache", client_cache.metrics)
@@ -1,29 +1,213 @@
-from sqlalchemy import MetaData
+import time
+import traceback
+from typing import Any, Awaitable, Callable
+from uuid import uuid4
+
+from sqlalchemy import MetaData, event
+from sqlalchemy import exc as sa_exc
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
-
-from config import DATABASE_SCHEMA, DATABASE_URL
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 
-engine = create_async_engine(
+from config import (
+    DATABASE_EXPORT_POOL_SIZE,
+    DATABASE_MAX_CONNECTIONS,
+    DATABASE_MAX_OVERFLOW,
+    DATABASE_POOL_MODE,
+    DATABASE_POOL_PRE_PING,
+    DATABASE_POOL_RECYCLE,
+    DATABASE_POOL_SIZE,
+    DATABASE_POOL_TIMEOUT,
+    DATABASE_SCHEMA,
     DATABASE_URL,
-    pool_pre_ping=True,
-    poolclass=NullPool,
+    WEB_CONCURRENCY,
 )
+from utils.metrics import register_metrics
+
+
+class PoolStats:
+    """连接池统计"""
+
+    def __init__(self):
+        self.connects = 0  # 新建连接次数
+        self.connect_failures = 0  # 新建连接失败次数
+        self.timeouts = 0  # 等待连接超时次数
+        self.acquires = 0  # 获取连接次数
+        self.wait_seconds = 0.0  # 获取连接的累计耗时
+        self.max_wait_seconds = 0.0  # 获取连接的最大耗时
+
+    def record_wait(self, seconds: float):
+        self.acquires += 1
+        self.wait_seconds += seconds
+        if seconds > self.max_wait_seconds:
+            self.max_wait_seconds = seconds
+
+
+pool_stats = PoolStats()
+
+
+class _StatsPoolMixin:
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except sa_exc.TimeoutError:
+            pool_stats.timeouts += 1
+            raise
+        except Exception:
+            pool_stats.connect_failures += 1
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - start)
+
+
+class StatsQueuePool(_StatsPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+class StatsNullPool(_StatsPoolMixin, NullPool):
+    pass
+
+
+def get_pool_size() -> tuple[int, int]:
+    """计算每个worker的连接池大小，保证所有worker的连接总数不超过 DATABASE_MAX_CONNECTIONS"""
+    pool_size, max_overflow = DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW
+    if DATABASE_MAX_CONNECTIONS > 0:
+        per_worker = max(1, DATABASE_MAX_CONNECTIONS // max(1, WEB_CONCURRENCY))
+        pool_size = min(pool_size, per_worker)
+        max_overflow = max(0, min(max_overflow, per_worker - pool_size))
+    return pool_size, max_overflow
+
+
+def get_engine_options() -> dict:
+    if DATABASE_POOL_MODE == "pgbouncer":
+        # PgBouncer 事务池模式下连接会在不同的客户端之间复用，不能使用预编译语句缓存，
+        # 并且预编译语句的名称必须唯一；连接池交给 PgBouncer 管理
+        return {
+            "poolclass": StatsNullPool,
+            "connect_args": {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+            },
+        }
+    if DATABASE_POOL_MODE == "null":
+        return {"poolclass": StatsNullPool, "pool_pre_ping": DATABASE_POOL_PRE_PING}
+
+    pool_size, max_overflow = get_pool_size()
+    return {
+        "poolclass": StatsQueuePool,
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_recycle": DATABASE_POOL_RECYCLE,
+        "pool_timeout": DATABASE_POOL_TIMEOUT,
+        "pool_pre_ping": DATABASE_POOL_PRE_PING,
+        "pool_use_lifo": True,  # 优先复用最近使用的连接，空闲连接可以被 pool_recycle 回收
+    }
+
+
+engine = create_async_engine(DATABASE_URL, **get_engine_options())
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def on_connect(dbapi_connection, connection_record):
+    pool_stats.connects += 1
+
+
+def get_export_engine_options() -> dict:
+    """数据导出使用单独的小连接池，长时间的导出不会占用接口请求的连接"""
+    options = get_engine_options()
+    if DATABASE_POOL_MODE in ("pgbouncer", "null"):
+        return {**options, "poolclass": NullPool}
+    return {
+        **options,
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_size": DATABASE_EXPORT_POOL_SIZE,
+        "max_overflow": 0,
+    }
+
+
+export_engine = create_async_engine(DATABASE_URL, **get_export_engine_options())
+
+
+def get_pool_metrics() -> dict:
+    pool = engine.pool
+    metrics = {
+        "mode": DATABASE_POOL_MODE,
+        "connects": pool_stats.connects,
+        "connect_failures": pool_stats.connect_failures,
+        "timeouts": pool_stats.timeouts,
+        "acquires": pool_stats.acquires,
+        "wait_seconds": round(pool_stats.wait_seconds, 6),
+        "max_wait_seconds": round(pool_stats.max_wait_seconds, 6),
+    }
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        metrics.update(
+            {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": pool.overflow(),
+            }
+        )
+    return metrics
+
+
+register_metrics("database", get_pool_metrics)
 
 async_session_local = sessionmaker(
     autocommit=False, autoflush=False, bind=engine, expire_on_commit=False, class_=AsyncSession
 )
+export_session_local = sessionmaker(
+    autocommit=False, autoflush=False, bind=export_engine, expire_on_commit=False, class_=AsyncSession
+)
 metadata_obj = MetaData(schema=DATABASE_SCHEMA)
 Base = declarative_base(metadata=metadata_obj)
 
 
+def after_commit(db: AsyncSession, fn: Callable[[], Awaitable[Any]]):
+    """注册在事务提交成功之后执行的回调，常用于清理缓存"""
+    db.info.setdefault("after_commit", []).append(fn)
+
+
+@event.listens_for(Session, "after_flush")
+def on_after_flush(session: Session, flush_context):
+    session.info["has_writes"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def on_orm_execute(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info["has_writes"] = True
+
+
+@event.listens_for(Session, "after_transaction_end")
+def on_transaction_end(session: Session, transaction):
+    if transaction.parent is None:
+        session.info.pop("has_writes", None)
+
+
+def has_writes(db: AsyncSession) -> bool:
+    """当前事务中是否有未提交的修改，包括还没有flush的对象和已经执行的写语句"""
+    session = db.sync_session
+    return bool(session.info.get("has_writes") or session.new or session.dirty or session.deleted)
+
+
+async def run_after_commit(db: AsyncSession):
+    for fn in db.info.pop("after_commit", []):
+        try:
+            await fn()
+        except Exception:
+            traceback.print_exc()
+
+
 async def get_db():
     async with async_session_local() as db:
         try:
             yield db
             await db.commit()
+            await run_after_commit(db)
         except Exception as e:
             raise e
         finally:
@@ -1,22 +1,31 @@
 import asyncio
 import time
 import traceback
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
 
 from colorama import Fore, Style
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
 from config import (
+    ADMIN_API_AUTO_SYNC,
+    ADMIN_TOKEN_REAPER_ENABLED,
     APPNAME,
     APPVERSION,
+    CAPTCHA_POOL_SIZE,
     CORS_ALLOW_ORIGIN,
     DATABASE_AUTO_UPGRADE,
     DEBUG,
 )
+from database.redis import client_cache, redis, run_subscriber
+from database.session import engine, export_engine
 from middlewares.depends import get_client_real_ip
 from middlewares.exception import ApiExceptionHandlingMiddleware
 from routers import adminapi, userapi
+from services.captcha import captcha_service
+from services.route import route_table
+from services.session_store import session_store
+from services.token_reaper import admin_token_reaper
 from utils.time import get_short_time
 
 
@@ -39,7 +48,36 @@ async def lifespan(app: FastAPI):
             await run_db_upgrade()
     except Exception:
         traceback.print_exc()
+    try:
+        route_table.build_routes(app)
+        if ADMIN_API_AUTO_SYNC:
+            await route_table.sync_apis(app)
+        await route_table.load()
+    except Exception:
+        traceback.print_exc()
+    subscriber = asyncio.create_task(run_subscriber())  # 接收其他worker的缓存失效广播
+    tracking = asyncio.create_task(client_cache.run())  # 接收Redis客户端缓存的失效通知
+    reaper = asyncio.create_task(admin_token_reaper.run_forever()) if ADMIN_TOKEN_REAPER_ENABLED else None
+    flusher = asyncio.create_task(session_store.run_forever())  # 将会话和最后访问时间写回数据库
+    captcha_producer = asyncio.create_task(captcha_service.run_forever()) if CAPTCHA_POOL_SIZE > 0 else None
     yield
+    if captcha_producer:
+        captcha_producer.cancel()
+    captcha_service.shutdown()
+    subscriber.cancel()
+    if reaper:
+        reaper.cancel()
+    flusher.cancel()
+    with suppress(asyncio.CancelledError):
+        await flusher  # 等待正在进行的写回结束，避免和最后一次写回同时执行
+    try:
+        await session_store.flush()  # 退出前写回剩余的数据
+    except Exception:
+        traceback.print_exc()
+    tracking.cancel()
+    await engine.dispose()
+    await export_engine.dispose()
+    await redis.aclose()
 
 
 app = FastAPI(title=APPNAME, version=APPVERSION, lifespan=lifespan, debug=DEBUG)
@@ -1,37 +1,48 @@
-from functools import lru_cache
+import traceback
 
-from fastapi import Cookie, Depends, Header, HTTPException, Request, status
-from fastapi.routing import APIRoute
+from fastapi import Cookie, Depends, Header, HTTPException, Query, Request, status
 
 from dal.admin import AdminRepo
-from dal.system import SystemRepo
+from dal.base import decode_cursor, dump_model
 from models.admin import AdminUser, AdminUserStatus, AdminUserToken, AdminUserTokenStatus
+from routers.api import ApiErrors, ApiException
 from services.encrypt import EncryptService, get_encrypt_service
+from services.permission import AdminPermissionCache, get_admin_permission_cache
+from services.rate_limit import RateLimiter, get_rate_limiter
+from services.route import RouteTable, get_route_table
+from services.session_store import DatabaseSessionStore, get_session_store
+from services.signed_token import SignedTokenService, get_signed_token_service, is_signed_token
+from services.token_cache import AdminTokenCache, get_admin_token_cache
 
 
-@lru_cache()
-def get_route_map(app):
-    route_map = {}
-    for route in app.routes:
-        if isinstance(route, APIRoute):
-            route_map[route.endpoint] = route.path
-    return route_map
-
-
-def get_current_route(request: Request) -> dict[str, str]:
+def get_current_route(request: Request, route_table: RouteTable = Depends(get_route_table)) -> tuple[str, str]:
     """获取当前的路由"""
     method = request.method
     endpoint = request.scope["endpoint"]
-    path = get_route_map(request.app).get(endpoint, request.scope["path"])
+    path = route_table.get_path(request.app, endpoint, request.scope["path"])
     return method, path
 
 
+def get_page_cursor(
+    cursor: str | None = Query(default=None, description="分页游标，传入后使用游标分页，空字符串表示第一页"),
+) -> tuple | None:
+    """解析分页游标，返回None表示使用页码分页，空tuple表示游标分页的第一页"""
+    if cursor is None:
+        return None
+    if not cursor:
+        return ()
+    c = decode_cursor(cursor)
+    if c is None:
+        raise ApiException(ApiErrors.CURSOR_INVALID)
+    return c
+
+
 async def get_auth_token(
     admin_user_token: str | None = Cookie(default=None),
     authorization: str | None = Header(default=None),
     encrypt_service: EncryptService = Depends(get_encrypt_service),
 ) -> str | None:
-    """从Cookie或Header中获取token"""
+    """从Cookie或Header中获取token，加密的token返回解密后的token ID，签名token原样返回"""
     token = None
     if admin_user_token:
         token = admin_user_token
@@ -41,6 +52,8 @@ async def get_auth_token(
             token = t
     if not token:
         return None
+    if is_signed_token(token):
+        return token
     try:
         return encrypt_service.decrypt(token)
     except Exception:
@@ -50,19 +63,53 @@ async def get_auth_token(
 async def try_current_admin_user_token(
     token: str | None = Depends(get_auth_token),
     admin_repo: AdminRepo = Depends(AdminRepo.get),
+    token_cache: AdminTokenCache = Depends(get_admin_token_cache),
+    signed_token_service: SignedTokenService = Depends(get_signed_token_service),
+    session_store: DatabaseSessionStore = Depends(get_session_store),
 ) -> AdminUserToken | None:
     if not token:
         return None
-    admin_user_token = await admin_repo.get_admin_user_token(token)
+    if is_signed_token(token):
+        admin_user_token = await get_signed_admin_user_token(token, admin_repo, token_cache, signed_token_service)
+    else:
+        admin_user_token = await session_store.get(admin_repo, token)
     if (
         not admin_user_token
         or admin_user_token.status != AdminUserTokenStatus.ACTIVE.value
         or admin_user_token.is_expired()
     ):
         return None
+    await session_store.touch(admin_user_token.id)
     return admin_user_token
 
 
+async def get_signed_admin_user_token(
+    token: str, admin_repo: AdminRepo, token_cache: AdminTokenCache, signed_token_service: SignedTokenService
+) -> AdminUserToken | None:
+    """签名token只需要检查是否已经登出，用户信息优先从缓存读取"""
+    claims = signed_token_service.verify(token)
+    if not claims:
+        return None
+    try:
+        revoked = await signed_token_service.is_revoked(claims["t"])
+    except Exception:  # Redis不可用时使用数据库中token的状态
+        traceback.print_exc()
+        admin_user_token = await admin_repo.get_admin_user_token(claims["t"])
+        if not admin_user_token or admin_user_token.status != AdminUserTokenStatus.ACTIVE.value:
+            return None
+        return admin_user_token
+    if revoked:
+        return None
+    admin_user = await token_cache.get_admin_user(claims["u"])
+    if admin_user is None:
+        user = await admin_repo.get_admin_user(claims["u"])
+        if not user:
+            return None
+        await token_cache.set_admin_user(user)
+        admin_user = dump_model(user, exclude=("password", "salt"))
+    return await admin_repo.merge_admin_user_token(signed_token_service.principal(claims, admin_user))
+
+
 async def try_current_admin_user(
     admin_user_token: AdminUserToken | None = Depends(try_current_admin_user_token),
 ) -> AdminUser | None:
@@ -78,16 +125,17 @@ async def get_current_admin_user(
     admin_user: AdminUser | None = Depends(try_current_admin_user),
     route=Depends(get_current_route),
     admin_repo: AdminRepo = Depends(AdminRepo.get),
-    system_repo: SystemRepo = Depends(SystemRepo.get),
+    route_table: RouteTable = Depends(get_route_table),
+    permission_cache: AdminPermissionCache = Depends(get_admin_permission_cache),
 ) -> AdminUser:
     if not admin_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
     if not admin_user.is_superuser:  # 不是超级管理员则检查权限
         method = route[0]
         path = route[1]
-        api = await system_repo.get_api_by_method_and_path(method, path)
-        if api:  # 只有存在该Api的时候才检查权限
-            is_granted = await admin_repo.check_admin_user_permission(admin_user.id, *api.permission_ids)
+        permission_ids = await route_table.get_permission_ids(method, path)
+        if permission_ids:  # 只有存在该Api的时候才检查权限
+            is_granted = await permission_cache.check_admin_user_permission(admin_repo, admin_user.id, *permission_ids)
             if not is_granted:
                 raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
     return admin_user
@@ -128,3 +176,26 @@ async def get_client_real_ip(
 
     # 默认：直接使用 request.client.host（无代理或代理未正确配置）
     return request.client.host
+
+
+async def check_rate_limit(rate_limiter: RateLimiter, name: str, key: str, rate: str, record: bool = True):
+    """超过限制时返回429，并通过Retry-After告诉客户端需要等待的秒数"""
+    wait = await rate_limiter.hit(name, key, rate, record)
+    if wait:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too Many Requests",
+            headers={"Retry-After": str(wait)},
+        )
+
+
+def rate_limit(name: str, rate: str):
+    """按客户端IP限流的依赖，在路由的dependencies中使用"""
+
+    async def dependency(
+        ip: str = Depends(get_client_real_ip),
+        rate_limiter: RateLimiter = Depends(get_rate_limiter),
+    ):
+        await check_rate_limit(rate_limiter, name, ip, rate)
+
+    return dependency
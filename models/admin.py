@@ -1,3 +1,4 @@
+import hmac
 from datetime import datetime
 from enum import Enum
 
@@ -7,7 +8,7 @@ from sqlalchemy.orm import relationship
 from sqlalchemy.schema import UniqueConstraint
 
 from models.base import BaseTable
-from utils.password import encrypt_password_md5, encrypt_password_sha256, encrypt_password_sha512
+from utils.password import PASSWORD_HASHERS
 from utils.uuid import uuidv4
 
 
@@ -15,6 +16,7 @@ class PasswordType(Enum):
     MD5 = "md5"
     SHA256 = "sha256"
     SHA512 = "sha512"
+    SCRYPT = "scrypt"
 
 
 class AdminUserStatus(Enum):
@@ -41,28 +43,19 @@ class AdminUser(BaseTable):
     __table_args__ = (
         Index("idx_username_trgm", "username", postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"}),
         Index("idx_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("idx_admin_user__created_at_id", "created_at", "id"),  # 游标分页
     )
 
     def auth(self, password: str) -> bool:
-        if not self.password:
-            return False
-        if self.ptype == PasswordType.MD5.value:
-            return self.password == encrypt_password_md5(password, self.salt)
-        elif self.ptype == PasswordType.SHA256.value:
-            return self.password == encrypt_password_sha256(password, self.salt)
-        elif self.ptype == PasswordType.SHA512.value:
-            return self.password == encrypt_password_sha512(password, self.salt)
-        else:
+        if not self.password or self.ptype not in PASSWORD_HASHERS:
             return False
+        return hmac.compare_digest(self.password, self.encrypt_password(password, self.salt, self.ptype))
 
     @classmethod
     def encrypt_password(cls, password: str, salt: str, ptype: str):
-        if ptype == PasswordType.MD5.value:
-            return encrypt_password_md5(password, salt)
-        elif ptype == PasswordType.SHA256.value:
-            return encrypt_password_sha256(password, salt)
-        elif ptype == PasswordType.SHA512.value:
-            return encrypt_password_sha512(password, salt)
+        hasher = PASSWORD_HASHERS.get(ptype)
+        if hasher:
+            return hasher(password, salt)
 
 
 class AdminUserTokenStatus(Enum):
@@ -75,9 +68,10 @@ class AdminUserToken(BaseTable):
     id: str = Column(String, primary_key=True, default=uuidv4)
     admin_user_id: int = Column(Integer, index=True, nullable=False)
     status: str = Column(String(32), index=True, nullable=False, default=AdminUserTokenStatus.ACTIVE.value)
-    expired_at: datetime | None = Column(DateTime(timezone=True), nullable=True)
+    expired_at: datetime | None = Column(DateTime(timezone=True), nullable=True, index=True)
     ip: str = Column(String(128), nullable=False, default="")
     user_agent: str = Column(String(512), nullable=False, default="")
+    last_seen_at: datetime | None = Column(DateTime(timezone=True), nullable=True)
 
     admin_user: AdminUser | None = relationship(
         "AdminUser", primaryjoin="AdminUser.id == foreign(AdminUserToken.admin_user_id)"
@@ -87,6 +81,18 @@ class AdminUserToken(BaseTable):
         return self.expired_at and self.expired_at < datetime.now(self.expired_at.tzinfo)
 
 
+class AdminUserTokenArchive(BaseTable):
+    """清理时归档的token"""
+
+    id: str = Column(String, primary_key=True)
+    admin_user_id: int = Column(Integer, index=True, nullable=False)
+    status: str = Column(String(32), nullable=False)
+    expired_at: datetime | None = Column(DateTime(timezone=True), nullable=True)
+    ip: str = Column(String(128), nullable=False, default="")
+    user_agent: str = Column(String(512), nullable=False, default="")
+    last_seen_at: datetime | None = Column(DateTime(timezone=True), nullable=True)
+
+
 class AdminRole(BaseTable):
     id: int = Column(Integer, primary_key=True, autoincrement=True)
     name: str = Column(String(64), nullable=False)
@@ -100,6 +106,8 @@ class AdminRole(BaseTable):
 
     __table_args__ = (  # 设置method和path的联合unique
         Index("idx_admin_role__permission_ids_gin", "permission_ids", postgresql_using="gin"),
+        Index("idx_admin_role__created_at_id", "created_at", "id"),  # 游标分页
+        Index("idx_admin_role__name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
     )
 
 
@@ -37,4 +37,5 @@ class Api(BaseTable):
             "path",
         ),
         Index("idx_api__permission_ids_gin", "permission_ids", postgresql_using="gin"),
+        Index("idx_api__created_at_id", "created_at", "id"),  # 游标分页
     )
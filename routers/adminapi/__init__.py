@@ -7,12 +7,13 @@ from database.session import get_db
 from routers.adminapi.schemas.admin import ConfigSchema
 from routers.response import R
 
-from . import admin, auth, system
+from . import admin, auth, export, system
 
 router = APIRouter()
 router.include_router(auth.router, prefix="/auth", tags=["Admin Auth"])
 router.include_router(admin.router, prefix="/admin", tags=["Admin User"])
 router.include_router(system.router, prefix="/system", tags=["System"])
+router.include_router(export.router, prefix="/export", tags=["Export"])
 
 
 @router.get("/config", response_model=R[ConfigSchema], summary="获取系统配置", description="获取系统配置")
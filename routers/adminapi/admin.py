@@ -1,14 +1,29 @@
-from fastapi import APIRouter, Depends, Query
-from pydantic import BaseModel, Field
+import asyncio
+from functools import partial
 
-from config import ADMIN_USERNAME_PATTERN
+from fastapi import APIRouter, Depends, File, Query, UploadFile
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+from config import ADMIN_IMPORT_MAX_ROWS, ADMIN_USERNAME_PATTERN
 from dal.admin import AdminRepo
+from dal.base import CountMode
 from dal.system import SystemRepo
-from middlewares.depends import get_current_admin_user
-from models.admin import AdminUser, AdminUserStatus
-from routers.adminapi.schemas.admin import AdminRoleSchema, AdminUserSchema
+from middlewares.depends import get_current_admin_user, get_page_cursor
+from models.admin import AdminRole, AdminUser, AdminUserStatus
+from routers.adminapi.schemas.admin import (
+    AdminRoleSchema,
+    AdminRoleSuggestSchema,
+    AdminUserImportSchema,
+    AdminUserSchema,
+    AdminUserSuggestSchema,
+)
 from routers.api import ApiErrors, ApiException
 from routers.response import P, R
+from services.password import PasswordHasher, get_password_hasher
+from services.permission import AdminPermissionCache, get_admin_permission_cache
+from services.search import SearchCache, get_search_cache
+from services.token_cache import AdminTokenCache, get_admin_token_cache
+from utils.export import ExportFormat, decode_rows
 from utils.string import random_str
 
 router = APIRouter()
@@ -32,11 +47,49 @@ async def find_admin_users(
     status: str = Query(default=""),
     page: int = Query(default=1, min=1),
     page_size: int = Query(default=10, min=1, max=100),
+    search: bool = Query(default=False, description="按相关度模糊搜索query，结果按相似度排序"),
+    cursor: tuple | None = Depends(get_page_cursor),
     cuser: AdminUser = Depends(get_current_admin_user),
     admin_repo: AdminRepo = Depends(AdminRepo.get),
+    search_cache: SearchCache = Depends(get_search_cache),
 ):
-    admin_users, total_count = await admin_repo.find_admin_users(query, status, page, page_size)
-    return R.success(P.from_list(total_count, page, page_size, admin_users))
+    if search and query:
+
+        async def load():
+            admin_users, total_count, has_more = await admin_repo.search_admin_users(query, status, page, page_size)
+            items = [AdminUserSchema.model_validate(u) for u in admin_users]
+            return P.from_list(total_count, page, page_size, items, has_more).model_dump(mode="json")
+
+        params = {"query": query, "status": status, "page": page, "page_size": page_size}
+        return R.success(await search_cache.get_or_load(AdminUser.__table__, params, load))
+    if cursor is not None:
+        admin_users, next, prev = await admin_repo.find_admin_users_by_cursor(query, status, cursor, page_size)
+        return R.success(P.from_cursor(page_size, admin_users, next, prev))
+    admin_users, total_count, has_more = await admin_repo.find_admin_users(
+        query, status, page, page_size, count=CountMode.CACHED
+    )
+    return R.success(P.from_list(total_count, page, page_size, admin_users, has_more))
+
+
+@router.get(
+    "/users/suggest",
+    response_model=R[list[AdminUserSuggestSchema]],
+    summary="用户自动补全",
+    description="按用户名或姓名的前缀查找用户",
+)
+async def suggest_admin_users(
+    prefix: str = Query(min_length=1, max_length=32),
+    limit: int = Query(default=10, ge=1, le=50),
+    cuser: AdminUser = Depends(get_current_admin_user),
+    admin_repo: AdminRepo = Depends(AdminRepo.get),
+    search_cache: SearchCache = Depends(get_search_cache),
+):
+    async def load():
+        admin_users = await admin_repo.suggest_admin_users(prefix, limit)
+        return [AdminUserSuggestSchema.model_validate(u).model_dump(mode="json") for u in admin_users]
+
+    params = {"suggest": prefix, "limit": limit}
+    return R.success(await search_cache.get_or_load(AdminUser.__table__, params, load))
 
 
 class CreateAdminUserForm(BaseModel):
@@ -68,14 +121,102 @@ async def create_admin_user(
         phone=req_form.phone,
         created_by=cuser.id,
     )
-    for role_id in req_form.role_ids:
-        role = await admin_repo.get_admin_role(role_id)  # 检查角色是否存在
-        if not role:
-            raise ApiException(ApiErrors.ADMIN_ROLE_NOT_FOUND)
-        await admin_repo.create_admin_user_role(admin_user.id, role.id)
+    if not await admin_repo.check_admin_roles_exist(req_form.role_ids):  # 检查角色是否存在
+        raise ApiException(ApiErrors.ADMIN_ROLE_NOT_FOUND)
+    await admin_repo.sync_admin_user_roles(admin_user.id, req_form.role_ids)
     return R.success(admin_user)
 
 
+class ImportAdminUserRow(BaseModel):
+    username: str = Field(min_length=4, max_length=32, pattern=ADMIN_USERNAME_PATTERN)
+    password: str = Field(min_length=6, max_length=64)
+    name: str = Field(min_length=1, max_length=64)
+    email: str = Field(default="", max_length=64)
+    phone: str = Field(default="", max_length=32)
+    status: AdminUserStatus = Field(default=AdminUserStatus.ACTIVE)
+    role_ids: list[int] = Field(default=[])
+
+    @field_validator("role_ids", mode="before")
+    @classmethod
+    def split_role_ids(cls, v):
+        if isinstance(v, str):  # CSV中的角色ID使用逗号或空格分隔
+            return [id for id in v.replace(",", " ").split()]
+        return v
+
+
+def encrypt_import_rows(rows: list[tuple[int, ImportAdminUserRow]]) -> list[tuple]:
+    """加密密码并转换为导入的记录，在线程池中执行"""
+    records = []
+    for line, row in rows:
+        salt = random_str(13)
+        ptype = AdminRepo.random_ptype()
+        password = AdminUser.encrypt_password(row.password, salt, ptype)
+        records.append(
+            (line, row.username, row.name, row.email, row.phone, password, salt, ptype, row.status.value, row.role_ids)
+        )
+    return records
+
+
+@router.post(
+    "/users/import",
+    response_model=R[AdminUserImportSchema],
+    summary="批量导入用户",
+    description="通过CSV或者NDJSON文件批量导入用户，字段为 username,password,name,email,phone,status,role_ids，"
+    f"有错误的行会被跳过并返回错误原因，单次最多导入{ADMIN_IMPORT_MAX_ROWS}行",
+)
+async def import_admin_users(
+    upload_file: UploadFile = File(alias="file"),
+    format: ExportFormat | None = Query(default=None, description="文件格式，默认根据文件后缀判断"),
+    cuser: AdminUser = Depends(get_current_admin_user),
+    admin_repo: AdminRepo = Depends(AdminRepo.get),
+    password_hasher: PasswordHasher = Depends(get_password_hasher),
+):
+    if format is None:
+        filename = upload_file.filename or ""
+        format = ExportFormat.CSV if filename.lower().endswith(".csv") else ExportFormat.NDJSON
+    try:
+        lines = list(decode_rows(await upload_file.read(), format))
+    except (UnicodeDecodeError, ValueError):
+        raise ApiException(ApiErrors.ADMIN_IMPORT_INVALID)
+    if len(lines) > ADMIN_IMPORT_MAX_ROWS:
+        raise ApiException(ApiErrors.ADMIN_IMPORT_INVALID)
+
+    rows: list[tuple[int, ImportAdminUserRow]] = []
+    errors: list[tuple[int, str]] = []
+    for line, data in lines:
+        if data is None:
+            errors.append((line, "格式错误"))
+            continue
+        try:
+            rows.append(
+                (line, ImportAdminUserRow.model_validate({k: v for k, v in data.items() if v not in ("", None)}))
+            )
+        except ValidationError as e:
+            errors.append((line, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())))
+
+    # 密码加密分批在批量任务的线程池中执行，不阻塞事件循环，也不占用登录时校验密码的线程
+    # 加密耗时较长，先结束当前事务归还数据库连接，写入时再开启新的事务
+    created_by = cuser.id
+    await admin_repo.db.commit()
+    chunks = await asyncio.gather(
+        *[password_hasher.run_bulk(encrypt_import_rows, rows[i : i + 100]) for i in range(0, len(rows), 100)]
+    )
+    records = [record for chunk in chunks for record in chunk]
+
+    created = 0
+    if records:
+        created, import_errors = await admin_repo.import_admin_users(records, created_by=created_by)
+        errors += import_errors
+    errors.sort()
+    return R.success(
+        {
+            "total": len(lines),
+            "created": created,
+            "errors": [{"line": line, "error": error} for line, error in errors],
+        }
+    )
+
+
 class UpdateAdminUserForm(BaseModel):
     name: str = Field(min_length=1, max_length=64)
     email: str = Field(max_length=64)
@@ -92,25 +233,28 @@ async def update_admin_user(
     req_form: UpdateAdminUserForm,
     cuser: AdminUser = Depends(get_current_admin_user),
     admin_repo: AdminRepo = Depends(AdminRepo.get),
+    token_cache: AdminTokenCache = Depends(get_admin_token_cache),
+    permission_cache: AdminPermissionCache = Depends(get_admin_permission_cache),
+    password_hasher: PasswordHasher = Depends(get_password_hasher),
 ):
     admin_user = await admin_repo.get_admin_user(id)
     if not admin_user:
         raise ApiException(ApiErrors.ADMIN_USER_NOT_FOUND)
+    if admin_user.status != req_form.status.value or admin_user.name != req_form.name:
+        admin_repo.invalidate_count(AdminUser)  # 用户列表按状态和名称筛选，缓存的总数需要失效
     admin_user.name = req_form.name
     admin_user.email = req_form.email
     admin_user.phone = req_form.phone
     admin_user.status = req_form.status.value
     if req_form.password:
-        admin_user.salt = random_str(12)
-        admin_user.password = AdminUser.encrypt_password(req_form.password, admin_user.salt, admin_user.ptype)
+        await password_hasher.set_password(admin_user, req_form.password)
 
-    await admin_repo.delete_admin_user_role_by_user_id(admin_user.id)
-    for role_id in req_form.role_ids:
-        role = await admin_repo.get_admin_role(role_id)  # 检查角色是否存在
-        if not role:
-            raise ApiException(ApiErrors.ADMIN_ROLE_NOT_FOUND)
-        await admin_repo.create_admin_user_role(admin_user.id, role.id)
+    if not await admin_repo.check_admin_roles_exist(req_form.role_ids):  # 检查角色是否存在
+        raise ApiException(ApiErrors.ADMIN_ROLE_NOT_FOUND)
+    await admin_repo.sync_admin_user_roles(admin_user.id, req_form.role_ids)
 
+    admin_repo.after_commit(partial(token_cache.invalidate_users, admin_user.id))
+    admin_repo.after_commit(partial(permission_cache.invalidate_users, admin_user.id))
     return R.success(admin_user)
 
 
@@ -142,10 +286,8 @@ async def create_admin_role(
     admin_repo: AdminRepo = Depends(AdminRepo.get),
     system_repo: SystemRepo = Depends(SystemRepo.get),
 ):
-    for permission_id in req_form.permission_ids:
-        permission = await system_repo.get_permission(permission_id)
-        if not permission:
-            raise ApiException(ApiErrors.PERMISSION_NOT_FOUND)
+    if not await system_repo.check_permissions_exist(req_form.permission_ids):
+        raise ApiException(ApiErrors.PERMISSION_NOT_FOUND)
     admin_role = await admin_repo.create_admin_role(
         req_form.name, req_form.remark, req_form.permission_ids, created_by=cuser.id
     )
@@ -165,17 +307,19 @@ async def update_admin_role(
     admin_repo: AdminRepo = Depends(AdminRepo.get),
     system_repo: SystemRepo = Depends(SystemRepo.get),
     cuser: AdminUser = Depends(get_current_admin_user),
+    token_cache: AdminTokenCache = Depends(get_admin_token_cache),
+    permission_cache: AdminPermissionCache = Depends(get_admin_permission_cache),
 ):
-    admin_role = await admin_repo.get_admin_role(id)
+    admin_role = await admin_repo.get_admin_role(id, with_for_update=True)
     if not admin_role:
         raise ApiException(ApiErrors.ADMIN_ROLE_NOT_FOUND)
-    for permission_id in req_form.permission_ids:
-        permission = await system_repo.get_permission(permission_id)
-        if not permission:
-            raise ApiException(ApiErrors.PERMISSION_NOT_FOUND)
-    admin_role.name = req_form.name
-    admin_role.remark = req_form.remark
-    admin_role.permission_ids = req_form.permission_ids
+    if not await system_repo.check_permissions_exist(req_form.permission_ids):
+        raise ApiException(ApiErrors.PERMISSION_NOT_FOUND)
+    await admin_repo.update_admin_role(admin_role, req_form.name, req_form.remark, req_form.permission_ids)
+
+    admin_user_ids = await admin_repo.find_admin_role_user_ids(admin_role.id)
+    admin_repo.after_commit(partial(token_cache.invalidate_users, *admin_user_ids))
+    admin_repo.after_commit(permission_cache.bump_role_version)
     return R.success(admin_role)
 
 
@@ -184,11 +328,49 @@ async def find_admin_roles(
     query: str = Query(default=""),
     page: int = Query(default=1, min=1),
     page_size: int = Query(default=10, min=1, max=100),
+    search: bool = Query(default=False, description="按相关度模糊搜索query，结果按相似度排序"),
+    cursor: tuple | None = Depends(get_page_cursor),
     cuser: AdminUser = Depends(get_current_admin_user),
     admin_repo: AdminRepo = Depends(AdminRepo.get),
+    search_cache: SearchCache = Depends(get_search_cache),
 ):
-    admin_roles, total_count = await admin_repo.find_admin_roles(query, page, page_size)
-    return R.success(P.from_list(total_count, page, page_size, admin_roles))
+    if search and query:
+
+        async def load():
+            admin_roles, total_count, has_more = await admin_repo.search_admin_roles(query, page, page_size)
+            items = [AdminRoleSchema.model_validate(r) for r in admin_roles]
+            return P.from_list(total_count, page, page_size, items, has_more).model_dump(mode="json")
+
+        params = {"query": query, "page": page, "page_size": page_size}
+        return R.success(await search_cache.get_or_load(AdminRole.__table__, params, load))
+    if cursor is not None:
+        admin_roles, next, prev = await admin_repo.find_admin_roles_by_cursor(query, cursor, page_size)
+        return R.success(P.from_cursor(page_size, admin_roles, next, prev))
+    admin_roles, total_count, has_more = await admin_repo.find_admin_roles(
+        query, page, page_size, count=CountMode.WINDOW
+    )
+    return R.success(P.from_list(total_count, page, page_size, admin_roles, has_more))
+
+
+@router.get(
+    "/roles/suggest",
+    response_model=R[list[AdminRoleSuggestSchema]],
+    summary="角色自动补全",
+    description="按角色名称的前缀查找角色",
+)
+async def suggest_admin_roles(
+    prefix: str = Query(min_length=1, max_length=64),
+    limit: int = Query(default=10, ge=1, le=50),
+    cuser: AdminUser = Depends(get_current_admin_user),
+    admin_repo: AdminRepo = Depends(AdminRepo.get),
+    search_cache: SearchCache = Depends(get_search_cache),
+):
+    async def load():
+        admin_roles = await admin_repo.suggest_admin_roles(prefix, limit)
+        return [AdminRoleSuggestSchema.model_validate(r).model_dump(mode="json") for r in admin_roles]
+
+    params = {"suggest": prefix, "limit": limit}
+    return R.success(await search_cache.get_or_load(AdminRole.__table__, params, load))
 
 
 @router.get("/role/{id}", response_model=R[AdminRoleSchema], summary="获取角色详情", description="通过ID获取角色详情")
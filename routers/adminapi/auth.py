@@ -1,22 +1,45 @@
-import random
 from datetime import datetime, timedelta, timezone
+from functools import partial
 
-from captcha.image import ImageCaptcha
 from fastapi import APIRouter, Depends, Header, Query, Request, Response
 from pydantic import BaseModel, Field
 from redis import asyncio as aioredis
 
-from config import ADMIN_USERNAME_PATTERN
+from config import (
+    ADMIN_TOKEN_SIGNED,
+    ADMIN_USERNAME_PATTERN,
+    RATE_LIMIT_CAPTCHA,
+    RATE_LIMIT_LOGIN,
+    RATE_LIMIT_LOGIN_USERNAME,
+    RATE_LIMIT_PASSWORD,
+)
 from dal.admin import AdminRepo
 from dal.system import SystemRepo
 from database.redis import get_redis
-from middlewares.depends import get_client_real_ip, get_current_admin_user, try_current_admin_user_token
-from models.admin import AdminUser, AdminUserStatus, AdminUserToken, AdminUserTokenStatus
+from middlewares.depends import (
+    check_rate_limit,
+    get_client_real_ip,
+    get_current_admin_user,
+    rate_limit,
+    try_current_admin_user_token,
+)
+from models.admin import AdminUser, AdminUserStatus, AdminUserToken
 from routers.adminapi.schemas.admin import AdminUserSchema, AdminUserTokenSchema
 from routers.api import ApiErrors, ApiException
 from routers.response import R
+from services.captcha import CaptchaService, get_captcha_service
 from services.encrypt import EncryptService, get_encrypt_service
-from utils.string import random_str
+from services.password import PasswordHasher, get_password_hasher
+from services.permission import (
+    AdminPermissionCache,
+    PermissionTreeCache,
+    get_admin_permission_cache,
+    get_permission_tree_cache,
+)
+from services.rate_limit import RateLimiter, get_rate_limiter
+from services.session_store import DatabaseSessionStore, get_session_store
+from services.signed_token import SignedTokenService, get_signed_token_service
+from services.token_cache import AdminTokenCache, get_admin_token_cache
 from utils.uuid import uuidv4
 
 router = APIRouter()
@@ -38,7 +61,7 @@ async def create_superuser(
     req_form: CreateSuperuserForm,
     admin_repo: AdminRepo = Depends(AdminRepo.get),
 ):
-    if await admin_repo.check_super_admin_user_exists():
+    if await admin_repo.check_super_admin_user_exists(uncached=True):  # 不能使用可能过期的缓存
         raise ApiException(ApiErrors.ADMIN_SUPERUSER_EXISTS)
     admin_user = await admin_repo.create_admin_user(
         req_form.username, req_form.name, req_form.password, is_superuser=True
@@ -46,17 +69,14 @@ async def create_superuser(
     return R.success(admin_user)
 
 
-async def generate_captcha(redis: aioredis.Redis, name: str, ex: int = 5 * 60):
-    text = random_str(random.choice([5, 6]))
-    image = ImageCaptcha(width=300, height=100)
-    img_data = image.generate(text)
+async def generate_captcha(captcha_service: CaptchaService, redis: aioredis.Redis, name: str, ex: int = 5 * 60):
+    text, img_data = await captcha_service.get()
     id = uuidv4()
 
-    async with redis.client() as conn:
-        await conn.set(f"{name}.{id}", text, ex=ex)
+    await redis.set(f"{name}.{id}", text, ex=ex)
 
     response = Response(
-        content=img_data.read(),
+        content=img_data,
         media_type="image/png",
     )
     response.set_cookie(f"{name}_id", id, expires=ex)
@@ -69,9 +89,12 @@ async def generate_captcha(redis: aioredis.Redis, name: str, ex: int = 5 * 60):
     responses={200: {"content": {"image/png": {}}, "description": "返回一张 PNG 格式的图片,大小是300x100"}},
     summary="获取登录验证码",
     description="获取登录验证码的图片内容",
+    dependencies=[Depends(rate_limit("captcha", RATE_LIMIT_CAPTCHA))],
 )
-async def get_login_captcha(redis: aioredis.Redis = Depends(get_redis)):
-    return await generate_captcha(redis, "login_captcha")
+async def get_login_captcha(
+    redis: aioredis.Redis = Depends(get_redis), captcha_service: CaptchaService = Depends(get_captcha_service)
+):
+    return await generate_captcha(captcha_service, redis, "login_captcha")
 
 
 class LoginForm(BaseModel):
@@ -87,6 +110,7 @@ class LoginForm(BaseModel):
     response_model=R[AdminUserTokenSchema],
     summary="管理员登录",
     description="管理员登录，使用用户名和密码",
+    dependencies=[Depends(rate_limit("login", RATE_LIMIT_LOGIN))],
 )
 async def login(
     req_form: LoginForm,
@@ -96,31 +120,42 @@ async def login(
     ip: str = Depends(get_client_real_ip),
     redis: aioredis.Redis = Depends(get_redis),
     encrypt_service: EncryptService = Depends(get_encrypt_service),
+    signed_token_service: SignedTokenService = Depends(get_signed_token_service),
+    session_store: DatabaseSessionStore = Depends(get_session_store),
+    password_hasher: PasswordHasher = Depends(get_password_hasher),
+    rate_limiter: RateLimiter = Depends(get_rate_limiter),
     admin_repo: AdminRepo = Depends(AdminRepo.get),
 ):
     captcha_id = req_form.captcha_id or request.cookies.get("login_captcha_id")
     if not captcha_id:
         raise ApiException(ApiErrors.ADMIN_CAPTCHA_INCORRECT)
-    async with redis.client() as conn:
-        captcha = await conn.getdel(f"login_captcha.{captcha_id}")
-        if not captcha or captcha.lower() != req_form.captcha.lower():
-            raise ApiException(ApiErrors.ADMIN_CAPTCHA_INCORRECT)
+    captcha = await redis.getdel(f"login_captcha.{captcha_id}")
+    if not captcha or captcha.lower() != req_form.captcha.lower():
+        raise ApiException(ApiErrors.ADMIN_CAPTCHA_INCORRECT)
 
+    # 同一个用户名的密码错误次数也需要限制，防止从多个IP尝试密码
+    # 只记录通过验证码之后的密码错误，避免不输入验证码就能把其他用户锁定
+    username = req_form.username.lower()
+    await check_rate_limit(rate_limiter, "login_username", username, RATE_LIMIT_LOGIN_USERNAME, record=False)
     admin_user = await admin_repo.get_admin_user_by_username(req_form.username)
     if not admin_user:
         raise ApiException(ApiErrors.ADMIN_USER_NOT_FOUND)
     if admin_user.status != AdminUserStatus.ACTIVE.value:
         raise ApiException(ApiErrors.ADMIN_USER_BANNED)
-    if not admin_user.auth(req_form.password):
+    if not await password_hasher.verify(admin_user, req_form.password):
+        await rate_limiter.hit("login_username", username, RATE_LIMIT_LOGIN_USERNAME)
         raise ApiException(ApiErrors.ADMIN_USER_PASSWORD_INCORRECT)
+    if password_hasher.needs_rehash(admin_user):  # 旧的加密方式在登录成功时升级
+        await password_hasher.set_password(admin_user, req_form.password)
 
     expired_at = datetime.now() + timedelta(days=7 if req_form.remember else 1)
-    admin_user_token = await admin_repo.create_admin_user_token(
-        admin_user.id, expired_at=expired_at, ip=ip, user_agent=user_agent
-    )
+    admin_user_token = await session_store.create(admin_repo, admin_user.id, expired_at, ip, user_agent)
 
     r = AdminUserTokenSchema.model_validate(admin_user_token)
-    r.id = encrypt_service.encrypt(admin_user_token.id)
+    if ADMIN_TOKEN_SIGNED:
+        r.id = signed_token_service.sign(admin_user_token)
+    else:
+        r.id = encrypt_service.encrypt(admin_user_token.id)
 
     response.set_cookie("admin_user_token", r.id, expires=expired_at.astimezone(timezone.utc))
 
@@ -149,18 +184,29 @@ class UpdateProfileForm(BaseModel):
 async def update_profile(
     req_form: UpdateProfileForm,
     cuser: AdminUser = Depends(get_current_admin_user),
+    admin_repo: AdminRepo = Depends(AdminRepo.get),
+    token_cache: AdminTokenCache = Depends(get_admin_token_cache),
 ):
     cuser.email = req_form.email
     cuser.phone = req_form.phone
     cuser.name = req_form.name
+    admin_repo.after_commit(partial(token_cache.invalidate_users, cuser.id))
     return R.success(cuser)
 
 
 @router.put("/logout", response_model=R[None], summary="管理员登出", description="管理员登出，清除登录状态")
-async def logout(response: Response, admin_user_token: AdminUserToken | None = Depends(try_current_admin_user_token)):
+async def logout(
+    response: Response,
+    admin_user_token: AdminUserToken | None = Depends(try_current_admin_user_token),
+    admin_repo: AdminRepo = Depends(AdminRepo.get),
+    signed_token_service: SignedTokenService = Depends(get_signed_token_service),
+    session_store: DatabaseSessionStore = Depends(get_session_store),
+):
     response.delete_cookie("admin_user_token")
     if admin_user_token:
-        admin_user_token.status = AdminUserTokenStatus.REVOKED.value
+        await session_store.revoke(admin_repo, admin_user_token)
+        # 签名token不查询数据库，需要记录到已登出的集合中
+        admin_repo.after_commit(partial(signed_token_service.revoke, admin_user_token.id, admin_user_token.expired_at))
     return R.success(None)
 
 
@@ -169,9 +215,12 @@ async def logout(response: Response, admin_user_token: AdminUserToken | None = D
     responses={200: {"content": {"image/png": {}}, "description": "返回一张 PNG 格式的图片,大小是300x100"}},
     summary="获取修改密码验证码",
     description="获取修改密码验证码的图片内容",
+    dependencies=[Depends(rate_limit("captcha", RATE_LIMIT_CAPTCHA))],
 )
-async def get_password_captcha(redis: aioredis.Redis = Depends(get_redis)):
-    return await generate_captcha(redis, "update_password_captcha")
+async def get_password_captcha(
+    redis: aioredis.Redis = Depends(get_redis), captcha_service: CaptchaService = Depends(get_captcha_service)
+):
+    return await generate_captcha(captcha_service, redis, "update_password_captcha")
 
 
 class UpdatePasswordForm(BaseModel):
@@ -180,20 +229,28 @@ class UpdatePasswordForm(BaseModel):
     captcha_id: str = Field(default="")
 
 
-@router.put("/password", response_model=R[None], summary="修改密码", description="修改当前登录账号的密码")
+@router.put(
+    "/password",
+    response_model=R[None],
+    summary="修改密码",
+    description="修改当前登录账号的密码",
+    dependencies=[Depends(rate_limit("password", RATE_LIMIT_PASSWORD))],
+)
 async def update_password(
     req_form: UpdatePasswordForm,
     request: Request,
     cuser: AdminUser = Depends(get_current_admin_user),
     redis: aioredis.Redis = Depends(get_redis),
+    admin_repo: AdminRepo = Depends(AdminRepo.get),
+    token_cache: AdminTokenCache = Depends(get_admin_token_cache),
+    password_hasher: PasswordHasher = Depends(get_password_hasher),
 ):
     captcha_id = req_form.captcha_id or request.cookies.get("update_password_captcha_id")
-    async with redis.client() as conn:
-        captcha = await conn.getdel(f"update_password_captcha.{captcha_id}")
-        if not captcha or captcha.lower() != req_form.captcha.lower():
-            raise ApiException(ApiErrors.ADMIN_CAPTCHA_INCORRECT)
-    cuser.salt = random_str(13)
-    cuser.password = AdminUser.encrypt_password(req_form.password, cuser.salt, cuser.ptype)
+    captcha = await redis.getdel(f"update_password_captcha.{captcha_id}")
+    if not captcha or captcha.lower() != req_form.captcha.lower():
+        raise ApiException(ApiErrors.ADMIN_CAPTCHA_INCORRECT)
+    await password_hasher.set_password(cuser, req_form.password)
+    admin_repo.after_commit(partial(token_cache.invalidate_users, cuser.id))
     return R.success(None)
 
 
@@ -208,15 +265,15 @@ async def check_permissions(
     cuser: AdminUser = Depends(get_current_admin_user),
     system_repo: SystemRepo = Depends(SystemRepo.get),
     admin_repo: AdminRepo = Depends(AdminRepo.get),
+    permission_cache: AdminPermissionCache = Depends(get_admin_permission_cache),
+    tree_cache: PermissionTreeCache = Depends(get_permission_tree_cache),
 ):
+    if cuser.is_superuser:  # 超级管理员拥有所有权限
+        return R.success({code: True for code in codes})
+    # 权限代码和用户的权限ID都优先从缓存读取，整个请求最多两次查询
+    permission_ids = await tree_cache.resolve_fullcodes(system_repo, codes)
+    owned_ids = await permission_cache.get_permission_ids(admin_repo, cuser.id)
     m: dict[str, bool] = {}
-    for code in codes:
-        if cuser.is_superuser:  # 超级管理员拥有所有权限
-            m[code] = True
-            continue
-        permission = await system_repo.get_permission_by_fullcode(code)
-        if permission and await admin_repo.check_admin_user_permission(cuser.id, permission.id):
-            m[code] = True
-        else:
-            m[code] = False
+    for code, permission_id in permission_ids.items():
+        m[code] = permission_id in owned_ids
     return R.success(m)
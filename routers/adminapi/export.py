@@ -0,0 +1,93 @@
+from typing import AsyncIterator, Callable
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from dal.admin import AdminRepo
+from dal.file import FileRepo
+from dal.system import SystemRepo
+from database.session import export_session_local
+from middlewares.depends import get_current_admin_user, get_current_super_admin_user
+from models.admin import AdminUser
+from routers.adminapi.schemas.admin import AdminRoleSchema, AdminUserSchema
+from routers.adminapi.schemas.file import FileSchema
+from routers.adminapi.schemas.system import ApiSchema
+from utils.export import MEDIA_TYPES, ExportFormat, encode_rows
+
+router = APIRouter()
+
+
+def export_response(
+    name: str,
+    schema: type[BaseModel],
+    fetch: Callable[[AsyncSession], AsyncIterator],
+    format: ExportFormat,
+    gzip: bool,
+) -> StreamingResponse:
+    """
+    流式导出数据，数据库连接在生成器内部从导出专用的连接池获取，
+    导出过程中逐批读取、逐行编码，不会把整张表加载到内存
+    """
+
+    async def generate():
+        async with export_session_local() as db:
+            async for obj in fetch(db):
+                yield schema.model_validate(obj).model_dump(mode="json")
+
+    filename = f"{name}.{format.value}"
+    media_type = MEDIA_TYPES[format]
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        encode_rows(generate(), list(schema.model_fields), format, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/admin/users", summary="导出用户", description="导出用户列表，支持NDJSON和CSV格式")
+async def export_admin_users(
+    query: str = Query(default=""),
+    status: str = Query(default=""),
+    format: ExportFormat = Query(default=ExportFormat.NDJSON, description="导出格式"),
+    gzip: bool = Query(default=False, description="是否使用gzip压缩"),
+    cuser: AdminUser = Depends(get_current_admin_user),
+):
+    return export_response(
+        "admin_users", AdminUserSchema, lambda db: AdminRepo(db).stream_admin_users(query, status), format, gzip
+    )
+
+
+@router.get("/admin/roles", summary="导出角色", description="导出角色列表，支持NDJSON和CSV格式")
+async def export_admin_roles(
+    query: str = Query(default=""),
+    format: ExportFormat = Query(default=ExportFormat.NDJSON, description="导出格式"),
+    gzip: bool = Query(default=False, description="是否使用gzip压缩"),
+    cuser: AdminUser = Depends(get_current_admin_user),
+):
+    return export_response(
+        "admin_roles", AdminRoleSchema, lambda db: AdminRepo(db).stream_admin_roles(query), format, gzip
+    )
+
+
+@router.get("/system/apis", summary="导出API", description="导出API和权限的对应关系，支持NDJSON和CSV格式")
+async def export_apis(
+    method: str = Query(default="", description="请求方法"),
+    path: str = Query(default="", description="请求路径"),
+    format: ExportFormat = Query(default=ExportFormat.NDJSON, description="导出格式"),
+    gzip: bool = Query(default=False, description="是否使用gzip压缩"),
+    cuser: AdminUser = Depends(get_current_super_admin_user),
+):
+    return export_response("apis", ApiSchema, lambda db: SystemRepo(db).stream_apis(method, path), format, gzip)
+
+
+@router.get("/files", summary="导出文件记录", description="导出上传文件的记录，支持NDJSON和CSV格式")
+async def export_files(
+    format: ExportFormat = Query(default=ExportFormat.NDJSON, description="导出格式"),
+    gzip: bool = Query(default=False, description="是否使用gzip压缩"),
+    cuser: AdminUser = Depends(get_current_admin_user),
+):
+    return export_response("files", FileSchema, lambda db: FileRepo(db).stream_files(), format, gzip)
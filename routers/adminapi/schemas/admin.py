@@ -24,6 +24,26 @@ class AdminUserSchema(BaseSchema):
     is_superuser: bool
 
 
+class AdminUserSuggestSchema(BaseModel):
+    id: int
+    username: str
+    name: str
+
+    class Config:
+        from_attributes = True
+
+
+class AdminUserImportErrorSchema(BaseModel):
+    line: int
+    error: str
+
+
+class AdminUserImportSchema(BaseModel):
+    total: int
+    created: int
+    errors: list[AdminUserImportErrorSchema]
+
+
 class AdminUserTokenSchema(BaseSchema):
     id: str
     admin_user_id: int
@@ -40,6 +60,14 @@ class AdminRoleSchema(BaseSchema):
     permission_ids: list[int]
 
 
+class AdminRoleSuggestSchema(BaseModel):
+    id: int
+    name: str
+
+    class Config:
+        from_attributes = True
+
+
 class ConfigSchema(BaseModel):
     onboarding: bool
     version: str
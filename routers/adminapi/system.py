@@ -1,12 +1,23 @@
+from functools import partial
+
 from fastapi import APIRouter, Depends, Query, Request
 from pydantic import BaseModel, Field
 
+from config import PERMISSION_SORT_MODE
+from dal.base import CountMode
 from dal.system import SystemRepo
-from middlewares.depends import get_current_admin_user, get_current_super_admin_user
+from middlewares.depends import get_current_admin_user, get_current_super_admin_user, get_page_cursor
 from models.admin import AdminUser
 from routers.adminapi.schemas.system import ApiSchema, PermissionSchema, RouteSchema
 from routers.api import ApiErrors, ApiException
 from routers.response import P, R
+from services.permission import (
+    PermissionTreeCache,
+    get_permission_tree_cache,
+    schedule_rebalance_permission_sort,
+)
+from services.route import RouteTable, get_route_table
+from utils.metrics import collect_metrics
 
 router = APIRouter()
 
@@ -17,30 +28,10 @@ async def find_routes(
     method: str = Query(default="", description="请求方法"),
     path: str = Query(default="", description="请求路径"),
     cuser: AdminUser = Depends(get_current_super_admin_user),
+    route_table: RouteTable = Depends(get_route_table),
 ):
-    app = request.app
-    routes = []
-    for route in app.routes:
-        if not route.path.startswith("/adminapi/"):
-            continue
-        if path and not route.path.startswith(path):
-            continue
-        for route_method in route.methods:
-            if method and method != route_method:
-                continue
-            routes.append({"path": route.path, "method": route_method})
-    return R.success(routes)
-
-
-def check_route(method: str, path: str, request: Request) -> bool:
-    """
-    检查路由是否存在
-    """
-    app = request.app
-    for route in app.routes:
-        if method in route.methods and path == route.path:
-            return True
-    return False
+    routes = route_table.find_admin_routes(request.app, method, path)
+    return R.success([{"path": p, "method": m} for m, p in routes])
 
 
 class CreateApiForm(BaseModel):
@@ -55,22 +46,22 @@ async def create_api(
     request: Request,
     system_repo: SystemRepo = Depends(SystemRepo.get),
     cuser: AdminUser = Depends(get_current_super_admin_user),
+    route_table: RouteTable = Depends(get_route_table),
 ):
-    if not check_route(req_form.method, req_form.path, request):
+    if not route_table.has_route(request.app, req_form.method, req_form.path):
         raise ApiException(ApiErrors.ROUTE_NOT_FOUND)
 
     api = await system_repo.get_api_by_method_and_path(req_form.method, req_form.path)
     if api:
         raise ApiException(ApiErrors.API_EXISTS)
 
-    for permission_id in req_form.permission_ids:
-        permission = await system_repo.get_permission(permission_id)
-        if not permission:
-            raise ApiException(ApiErrors.PERMISSION_NOT_FOUND)
+    if not await system_repo.check_permissions_exist(req_form.permission_ids):
+        raise ApiException(ApiErrors.PERMISSION_NOT_FOUND)
 
     api = await system_repo.create_api(
         req_form.method, req_form.path, created_by=cuser.id, permission_ids=req_form.permission_ids
     )
+    system_repo.after_commit(route_table.notify_changed)
 
     return R.success(api)
 
@@ -88,26 +79,24 @@ async def update_api(
     request: Request,
     system_repo: SystemRepo = Depends(SystemRepo.get),
     cuser: AdminUser = Depends(get_current_super_admin_user),
+    route_table: RouteTable = Depends(get_route_table),
 ):
-    if not check_route(req_form.method, req_form.path, request):
+    if not route_table.has_route(request.app, req_form.method, req_form.path):
         raise ApiException(ApiErrors.ROUTE_NOT_FOUND)
 
     api = await system_repo.get_api_by_method_and_path(req_form.method, req_form.path)
     if api and api.id != id:
         raise ApiException(ApiErrors.API_EXISTS)
 
-    api = await system_repo.get_api(id)
+    api = await system_repo.get_api(id, with_for_update=True)
     if not api:
         raise ApiException(ApiErrors.API_NOT_FOUND)
 
-    for permission_id in req_form.permission_ids:
-        permission = await system_repo.get_permission(permission_id)
-        if not permission:
-            raise ApiException(ApiErrors.PERMISSION_NOT_FOUND)
+    if not await system_repo.check_permissions_exist(req_form.permission_ids):
+        raise ApiException(ApiErrors.PERMISSION_NOT_FOUND)
 
-    api.method = req_form.method
-    api.path = req_form.path
-    api.permission_ids = req_form.permission_ids
+    await system_repo.update_api(api, req_form.method, req_form.path, req_form.permission_ids)
+    system_repo.after_commit(route_table.notify_changed)
 
     return R.success(api)
 
@@ -117,8 +106,10 @@ async def delete_api(
     id: int,
     system_repo: SystemRepo = Depends(SystemRepo.get),
     cuser: AdminUser = Depends(get_current_super_admin_user),
+    route_table: RouteTable = Depends(get_route_table),
 ):
     await system_repo.delete_api(id)
+    system_repo.after_commit(route_table.notify_changed)
     return R.success(None)
 
 
@@ -128,11 +119,15 @@ async def find_apis(
     path: str = Query(default="", description="请求路径"),
     page: int = Query(default=1, description="页码"),
     page_size: int = Query(default=10, description="每页条数"),
+    cursor: tuple | None = Depends(get_page_cursor),
     system_repo: SystemRepo = Depends(SystemRepo.get),
     cuser: AdminUser = Depends(get_current_super_admin_user),
 ):
-    apis, total_count = await system_repo.find_apis(method, path, page, page_size)
-    return R.success(P.from_list(total_count, page, page_size, apis))
+    if cursor is not None:
+        apis, next, prev = await system_repo.find_apis_by_cursor(method, path, cursor, page_size)
+        return R.success(P.from_cursor(page_size, apis, next, prev))
+    apis, total_count, has_more = await system_repo.find_apis(method, path, page, page_size, count=CountMode.ESTIMATE)
+    return R.success(P.from_list(total_count, page, page_size, apis, has_more))
 
 
 class CreatePermissionForm(BaseModel):
@@ -147,6 +142,7 @@ async def create_permission(
     req_form: CreatePermissionForm,
     system_repo: SystemRepo = Depends(SystemRepo.get),
     cuser: AdminUser = Depends(get_current_super_admin_user),
+    permission_tree_cache: PermissionTreeCache = Depends(get_permission_tree_cache),
 ):
     if req_form.parent_id:
         parent = await system_repo.get_permission(req_form.parent_id)
@@ -163,21 +159,10 @@ async def create_permission(
         req_form.parent_id,
         created_by=cuser.id,
     )
+    system_repo.after_commit(permission_tree_cache.bump_version)
     return R.success(permission)
 
 
-async def check_permission_child(system_repo: SystemRepo, id: int, child_id: int) -> bool:
-    """检查child_id是不是id的子权限"""
-    if id == child_id:
-        print(id, child_id)
-        return True
-    children = await system_repo.find_chilren_permissions_by_parent_r(id)
-    for child in children:
-        if await check_permission_child(system_repo, child.id, child_id):
-            return True
-    return False
-
-
 class UpdatePermissionForm(BaseModel):
     name: str = Field(description="权限名称")
     code: str = Field(description="权限代码")
@@ -191,8 +176,9 @@ async def update_permission(
     id: int,
     system_repo: SystemRepo = Depends(SystemRepo.get),
     cuser: AdminUser = Depends(get_current_super_admin_user),
+    permission_tree_cache: PermissionTreeCache = Depends(get_permission_tree_cache),
 ):
-    permission = await system_repo.get_permission(id)
+    permission = await system_repo.get_permission(id, with_for_update=True)
     if not permission:
         raise ApiException(ApiErrors.PERMISSION_NOT_FOUND)
 
@@ -201,17 +187,15 @@ async def update_permission(
         if not parent:
             raise ApiException(ApiErrors.PERMISSION_NOT_FOUND)
 
-        if await check_permission_child(system_repo, id, req_form.parent_id):
+        if await system_repo.check_permission_descendant(id, req_form.parent_id):
             raise ApiException(ApiErrors.PERMISSION_PARENT_INVALID)
 
     other = await system_repo.get_permission_by_code_and_parent(req_form.code, req_form.parent_id)
     if other and other.id != id:
         raise ApiException(ApiErrors.PERMISSION_CODE_DUPLICATED)
 
-    permission.name = req_form.name
-    permission.code = req_form.code
-    permission.parent_id = req_form.parent_id
-    permission.remark = req_form.remark
+    await system_repo.update_permission(permission, req_form.name, req_form.code, req_form.parent_id, req_form.remark)
+    system_repo.after_commit(permission_tree_cache.bump_version)
 
     return R.success(permission)
 
@@ -220,8 +204,9 @@ async def update_permission(
 async def find_permissions(
     cuser: AdminUser = Depends(get_current_admin_user),
     system_repo: SystemRepo = Depends(SystemRepo.get),
+    permission_tree_cache: PermissionTreeCache = Depends(get_permission_tree_cache),
 ):
-    permissions = await system_repo.find_chilren_permissions_by_parent_r(parent_id=0)
+    permissions = await permission_tree_cache.get_tree(system_repo)
     return R.success(permissions)
 
 
@@ -235,13 +220,17 @@ async def delete_permission(
     id: int,
     system_repo: SystemRepo = Depends(SystemRepo.get),
     cuser: AdminUser = Depends(get_current_super_admin_user),
+    route_table: RouteTable = Depends(get_route_table),
+    permission_tree_cache: PermissionTreeCache = Depends(get_permission_tree_cache),
 ):
     await system_repo.delete_permission(id)
+    system_repo.after_commit(route_table.notify_changed)  # 删除权限会修改Api的权限ID
+    system_repo.after_commit(permission_tree_cache.bump_version)
     return R.success(None)
 
 
 class UpdatePermissionSortForm(BaseModel):
-    sort: int = Field(description="排序")
+    sort: int = Field(description="排序，即移动后在同级权限中的位置，从0开始")
 
 
 @router.put("/permission/{id}/sort", response_model=R[None], summary="权限排序", description="权限排序")
@@ -250,8 +239,15 @@ async def update_permission_sort(
     req_form: UpdatePermissionSortForm,
     system_repo: SystemRepo = Depends(SystemRepo.get),
     cuser: AdminUser = Depends(get_current_super_admin_user),
+    permission_tree_cache: PermissionTreeCache = Depends(get_permission_tree_cache),
 ):
-    await system_repo.update_permission_sort(id, req_form.sort)
+    if PERMISSION_SORT_MODE == "gap":
+        permission, crowded = await system_repo.move_permission(id, req_form.sort)
+        if crowded:  # 排序值的空隙用完了，提交之后在后台重新分配
+            system_repo.after_commit(partial(schedule_rebalance_permission_sort, permission.parent_id))
+    else:
+        await system_repo.update_permission_sort(id, req_form.sort)
+    system_repo.after_commit(permission_tree_cache.bump_version)
     return R.success(None)
 
 
@@ -261,12 +257,16 @@ async def find_permission(
     system_repo: SystemRepo = Depends(SystemRepo.get),
     cuser: AdminUser = Depends(get_current_admin_user),
 ):
-    permissions = []
-    while id > 0:
-        permission = await system_repo.get_permission(id)
-        if not permission:
-            raise ApiException(ApiErrors.PERMISSION_NOT_FOUND)
-        permissions.append(permission)
-        id = permission.parent_id
-    permissions.reverse()
+    if id <= 0:
+        return R.success([])
+    permissions = await system_repo.find_permission_ancestors(id)
+    if not permissions or permissions[0].parent_id != 0:  # 权限不存在或者某个祖先权限不存在
+        raise ApiException(ApiErrors.PERMISSION_NOT_FOUND)
     return R.success(permissions)
+
+
+@router.get("/metrics", response_model=R[dict[str, dict]], summary="运行指标", description="获取数据库连接池等运行指标")
+async def get_metrics(
+    cuser: AdminUser = Depends(get_current_super_admin_user),
+):
+    return R.success(collect_metrics())
@@ -6,6 +6,9 @@ class ApiErrors(Enum):
 
     OK = 0
 
+    CURSOR_INVALID = 10
+    SERVER_BUSY = 11
+
     ADMIN_SUPERUSER_EXISTS = 1000
     ADMIN_USER_NOT_FOUND = 1001
     ADMIN_USER_PASSWORD_INCORRECT = 1002
@@ -13,6 +16,7 @@ class ApiErrors(Enum):
     ADMIN_CAPTCHA_INCORRECT = 1004
     ADMIN_USER_DUPLICATED = 1005
     ADMIN_ROLE_NOT_FOUND = 1006
+    ADMIN_IMPORT_INVALID = 1007
 
     ROUTE_NOT_FOUND = 1100
     API_EXISTS = 1101
@@ -24,11 +24,18 @@ class R(BaseModel, Generic[T]):
 
 
 class P(BaseModel, Generic[T]):
-    total: int
-    page: int
+    total: int | None = None  # 游标分页或者不统计总数时为空
+    page: int | None = None
     page_size: int
     items: list[T]
+    next: str | None = None  # 下一页的游标
+    prev: str | None = None  # 上一页的游标
+    has_more: bool | None = None  # 是否还有下一页
 
     @classmethod
-    def from_list(cls, total: int, page: int, page_size: int, items: list[T]):
-        return cls(total=total, page=page, page_size=page_size, items=items)
+    def from_list(cls, total: int | None, page: int, page_size: int, items: list[T], has_more: bool | None = None):
+        return cls(total=total, page=page, page_size=page_size, items=items, has_more=has_more)
+
+    @classmethod
+    def from_cursor(cls, page_size: int, items: list[T], next: str | None, prev: str | None):
+        return cls(page_size=page_size, items=items, next=next, prev=prev, has_more=next is not None)
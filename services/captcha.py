@@ -0,0 +1,103 @@
+import asyncio
+import multiprocessing
+import random
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any
+
+from config import CAPTCHA_POOL_SIZE, CAPTCHA_RENDER_WORKERS
+from utils.captcha import render_captcha
+from utils.metrics import register_metrics
+from utils.string import random_str
+
+
+class CaptchaService:
+    """
+    验证码图片在进程池中生成，不占用事件循环
+    pool_size大于0时由后台任务预先生成一批图片保存在内存中，请求时直接取出，每张图片只使用一次
+    """
+
+    def __init__(self, workers: int, pool_size: int):
+        self.workers = workers
+        self.pool_size = pool_size
+        self.executor: ProcessPoolExecutor | None = None
+        self.ready: deque[tuple[str, bytes]] = deque()
+        self.consumed = asyncio.Event()
+        self.pool_hits = 0
+        self.pool_misses = 0
+        self.rendered = 0
+        self.restarts = 0
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self.executor
+
+    def discard_executor(self, executor: ProcessPoolExecutor):
+        """子进程异常退出后进程池不能再使用，关闭之后在下次生成时重新创建"""
+        if self.executor is executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+            self.restarts += 1
+
+    async def render(self) -> tuple[str, bytes]:
+        text = random_str(random.choice([5, 6]))
+        for retry in range(2):
+            executor = self.get_executor()
+            try:
+                image = await asyncio.get_running_loop().run_in_executor(executor, render_captcha, text)
+                break
+            except BrokenProcessPool:
+                self.discard_executor(executor)
+                if retry:
+                    raise
+        self.rendered += 1
+        return text, image
+
+    async def get(self) -> tuple[str, bytes]:
+        """返回 (验证码, PNG图片)"""
+        if self.ready:
+            self.pool_hits += 1
+            self.consumed.set()
+            return self.ready.popleft()
+        self.pool_misses += 1
+        self.consumed.set()
+        return await self.render()
+
+    async def run_forever(self):
+        """保持预先生成的图片数量"""
+        while True:
+            try:
+                while len(self.ready) < self.pool_size:
+                    self.ready.append(await self.render())
+            except Exception:
+                traceback.print_exc()
+                await asyncio.sleep(1)
+                continue
+            self.consumed.clear()
+            await self.consumed.wait()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "ready": len(self.ready),
+            "pool_size": self.pool_size,
+            "pool_hits": self.pool_hits,
+            "pool_misses": self.pool_misses,
+            "rendered": self.rendered,
+            "restarts": self.restarts,
+        }
+
+
+captcha_service = CaptchaService(CAPTCHA_RENDER_WORKERS, CAPTCHA_POOL_SIZE)
+register_metrics("captcha", captcha_service.metrics)
+
+
+def get_captcha_service() -> CaptchaService:
+    return captcha_service
@@ -1,12 +1,22 @@
+from typing import Any
+
 from Crypto.Cipher import AES
 
-from config import SESSION_SECRET_KEY, SESSION_SECRET_NONCE
+from config import SESSION_DECRYPT_CACHE_SIZE, SESSION_SECRET_KEY, SESSION_SECRET_NONCE
+from utils.cache import TTLCache
+from utils.metrics import register_metrics
 
 
 class EncryptService:
-    def __init__(self, key: str, nonce: str):
+    """
+    加密和解密登录token，解密的结果缓存在进程内的LRU中，同一个token的重复请求不需要再次解密
+    GCM模式的cipher对象只能使用一次，每次加解密都需要重新创建
+    """
+
+    def __init__(self, key: str, nonce: str, cache_size: int):
         self.key = key.encode()
         self.nonce = nonce.encode()
+        self.cache = TTLCache(cache_size)
 
     def encrypt(self, s: str) -> str:
         if not self.key or not self.nonce:
@@ -17,12 +27,24 @@ class EncryptService:
     def decrypt(self, s: str) -> str:
         if not self.key or not self.nonce:
             return s
+        plaintext = self.cache.get(s)
+        if plaintext is not None:
+            return plaintext
         cipher = self.get_cipher()
-        return cipher.decrypt(bytes.fromhex(s)).decode()
+        plaintext = cipher.decrypt(bytes.fromhex(s)).decode()
+        self.cache.set(s, plaintext)
+        return plaintext
 
     def get_cipher(self):
         return AES.new(self.key, AES.MODE_GCM, nonce=self.nonce)
 
+    def metrics(self) -> dict[str, Any]:
+        return self.cache.stats()
+
+
+encrypt_service = EncryptService(SESSION_SECRET_KEY, SESSION_SECRET_NONCE, SESSION_DECRYPT_CACHE_SIZE)
+register_metrics("encrypt_service", encrypt_service.metrics)
+
 
 def get_encrypt_service() -> EncryptService:
-    return EncryptService(SESSION_SECRET_KEY, SESSION_SECRET_NONCE)
+    return encrypt_service
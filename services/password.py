@@ -0,0 +1,117 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from config import (
+    ADMIN_PASSWORD_BULK_WORKERS,
+    ADMIN_PASSWORD_HASH_QUEUE,
+    ADMIN_PASSWORD_HASH_WORKERS,
+    ADMIN_PASSWORD_TYPE,
+)
+from models.admin import AdminUser
+from routers.api import ApiErrors, ApiException
+from utils.metrics import register_metrics
+from utils.password import PASSWORD_HASHERS
+from utils.string import random_str
+
+
+class PasswordHasher:
+    """
+    在有限大小的线程池中计算密码哈希，避免scrypt等慢哈希阻塞事件循环
+    hashlib计算时会释放GIL，多个线程可以并行计算；排队的任务超过上限时直接返回服务繁忙
+    批量导入使用单独的线程池，不占用登录等请求的线程
+    """
+
+    def __init__(self, workers: int, max_queue: int, ptype: str, bulk_workers: int):
+        if ptype and ptype not in PASSWORD_HASHERS:
+            raise ValueError(f"Unsupported ADMIN_PASSWORD_TYPE: {ptype}")
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password")
+        self.bulk_executor = ThreadPoolExecutor(max_workers=bulk_workers, thread_name_prefix="password-bulk")
+        self.max_queue = max_queue
+        self.ptype = ptype
+        self.pending = 0
+        self.bulk_pending = 0
+        self.rejected = 0
+        self.count = 0
+        self.hash_seconds = 0.0
+        self.hash_max = 0.0
+        self.wait_seconds = 0.0
+        self.wait_max = 0.0
+
+    async def run[T](self, fn: Callable[..., T], *args) -> T:
+        """在线程池中执行fn，记录排队和执行的时间"""
+        if self.pending >= self.max_queue:
+            self.rejected += 1
+            raise ApiException(ApiErrors.SERVER_BUSY)
+        self.pending += 1
+        submitted = time.perf_counter()
+        started = 0.0
+
+        def call():
+            nonlocal started
+            started = time.perf_counter()
+            return fn(*args)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+        finally:
+            self.pending -= 1
+            finished = time.perf_counter()
+            if started:
+                self.record(started - submitted, finished - started)
+
+    async def run_bulk[T](self, fn: Callable[..., T], *args) -> T:
+        """在批量任务的线程池中执行fn，不限制排队的任务数"""
+        self.bulk_pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.bulk_executor, fn, *args)
+        finally:
+            self.bulk_pending -= 1
+
+    def record(self, wait: float, elapsed: float):
+        self.count += 1
+        self.wait_seconds += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.hash_seconds += elapsed
+        self.hash_max = max(self.hash_max, elapsed)
+
+    async def hash(self, password: str, salt: str, ptype: str) -> str:
+        return await self.run(AdminUser.encrypt_password, password, salt, ptype)
+
+    async def verify(self, admin_user: AdminUser, password: str) -> bool:
+        return await self.run(admin_user.auth, password)
+
+    def needs_rehash(self, admin_user: AdminUser) -> bool:
+        return bool(self.ptype) and admin_user.ptype != self.ptype
+
+    async def set_password(self, admin_user: AdminUser, password: str):
+        """使用新的盐和当前的加密方式设置密码"""
+        ptype = self.ptype or admin_user.ptype
+        salt = random_str(13)
+        admin_user.password = await self.hash(password, salt, ptype)
+        admin_user.salt = salt
+        admin_user.ptype = ptype
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "ptype": self.ptype,
+            "pending": self.pending,
+            "bulk_pending": self.bulk_pending,
+            "rejected": self.rejected,
+            "count": self.count,
+            "hash_avg": self.hash_seconds / self.count if self.count else 0,
+            "hash_max": self.hash_max,
+            "wait_avg": self.wait_seconds / self.count if self.count else 0,
+            "wait_max": self.wait_max,
+        }
+
+
+password_hasher = PasswordHasher(
+    ADMIN_PASSWORD_HASH_WORKERS, ADMIN_PASSWORD_HASH_QUEUE, ADMIN_PASSWORD_TYPE, ADMIN_PASSWORD_BULK_WORKERS
+)
+register_metrics("password_hasher", password_hasher.metrics)
+
+
+def get_password_hasher() -> PasswordHasher:
+    return password_hasher
@@ -0,0 +1,243 @@
+import asyncio
+import json
+import time
+import traceback
+from typing import Any
+
+from redis import asyncio as aioredis
+
+from config import ADMIN_PERMISSION_CACHE_SIZE, ADMIN_PERMISSION_CACHE_TTL
+from dal.admin import AdminRepo
+from dal.base import dump_model
+from dal.system import SystemRepo, build_permission_tree
+from database.redis import publish, redis, subscribe
+from database.session import async_session_local, run_after_commit
+from utils.cache import TTLCache
+from utils.metrics import register_metrics
+
+ROLE_VERSION_KEY = "admin_role.version"
+INVALIDATE_CHANNEL = "admin_permission.invalidate"
+LOCAL_TTL = 60  # 进程内缓存的兜底过期时间，正常情况下由广播消息清除
+VERSION_TTL = 5  # 进程内版本号的有效时间，错过广播消息时最多使用这么久的旧版本号
+TREE_VERSION_KEY = "permission.tree.version"
+TREE_CHANNEL = "permission.tree.changed"
+TREE_TTL = 24 * 3600
+
+
+class AdminPermissionCache:
+    """
+    用户有效权限的缓存，权限ID以frozenset的形式保存，检查权限只需要判断集合是否相交
+    缓存的权限带有计算时的角色版本号，角色修改后版本号增加，所有用户的权限在下次使用时重新计算
+    """
+
+    def __init__(self, redis: aioredis.Redis, maxsize: int, ttl: int):
+        self.redis = redis
+        self.ttl = ttl
+        self.role_version: int | None = None
+        self.role_version_at = 0.0
+        self.local = TTLCache(maxsize, LOCAL_TTL)
+
+    @staticmethod
+    def user_key(admin_user_id: int) -> str:
+        return f"admin_permission.{admin_user_id}"
+
+    async def get_role_version(self) -> int | None:
+        """定期从Redis重新读取角色版本号，Redis不可用时返回None"""
+        now = time.monotonic()
+        if self.role_version is None or now - self.role_version_at > VERSION_TTL:
+            try:
+                self.role_version = int(await self.redis.get(ROLE_VERSION_KEY) or 0)
+            except Exception:
+                traceback.print_exc()
+                return None
+            self.role_version_at = now
+        return self.role_version
+
+    async def get_permission_ids(self, admin_repo: AdminRepo, admin_user_id: int) -> frozenset[int]:
+        """获取用户拥有的权限ID"""
+        role_version = await self.get_role_version()
+        if role_version is None:  # 无法确认缓存是否有效时直接查询数据库
+            return frozenset(await admin_repo.find_admin_user_permission_ids(admin_user_id))
+        item = self.local.get(admin_user_id)
+        if item and item[0] == role_version:
+            return item[1]
+
+        key = self.user_key(admin_user_id)
+        try:
+            data = await self.redis.get(key)
+        except Exception:
+            traceback.print_exc()
+            data = None
+        if data:
+            cached = json.loads(data)
+            if cached["version"] == role_version:
+                ids = frozenset(cached["ids"])
+                self.local.set(admin_user_id, (role_version, ids))
+                return ids
+
+        permission_ids = await admin_repo.find_admin_user_permission_ids(admin_user_id)
+        ids = frozenset(permission_ids)
+        self.local.set(admin_user_id, (role_version, ids))
+        try:
+            await self.redis.set(key, json.dumps({"version": role_version, "ids": permission_ids}), ex=self.ttl)
+        except Exception:
+            traceback.print_exc()
+        return ids
+
+    async def check_admin_user_permission(
+        self, admin_repo: AdminRepo, admin_user_id: int, *permission_ids: int
+    ) -> bool:
+        """判断用户是否拥有任意一个权限"""
+        if not permission_ids:
+            return True
+        ids = await self.get_permission_ids(admin_repo, admin_user_id)
+        return not ids.isdisjoint(permission_ids)
+
+    async def bump_role_version(self):
+        """角色的权限修改并提交之后调用，所有用户的权限都需要重新计算"""
+        self.role_version = await self.redis.incr(ROLE_VERSION_KEY)
+        self.role_version_at = time.monotonic()
+        await publish(INVALIDATE_CHANNEL, {"role_version": self.role_version})
+
+    async def invalidate_users(self, *admin_user_ids: int):
+        """用户的角色修改并提交之后调用"""
+        if not admin_user_ids:
+            return
+        for admin_user_id in admin_user_ids:
+            self.local.pop(admin_user_id)
+        await self.redis.delete(*[self.user_key(admin_user_id) for admin_user_id in admin_user_ids])
+        await publish(INVALIDATE_CHANNEL, {"admin_user_ids": list(admin_user_ids)})
+
+    def metrics(self) -> dict[str, Any]:
+        return {**self.local.stats(), "role_version": self.role_version}
+
+
+admin_permission_cache = AdminPermissionCache(redis, ADMIN_PERMISSION_CACHE_SIZE, ADMIN_PERMISSION_CACHE_TTL)
+register_metrics("admin_permission_cache", admin_permission_cache.metrics)
+
+
+@subscribe(INVALIDATE_CHANNEL)
+async def on_invalidate(message: dict[str, Any]):
+    if "role_version" in message:
+        admin_permission_cache.role_version = max(admin_permission_cache.role_version or 0, message["role_version"])
+    for admin_user_id in message.get("admin_user_ids", []):
+        admin_permission_cache.local.pop(admin_user_id)
+
+
+def get_admin_permission_cache() -> AdminPermissionCache:
+    return admin_permission_cache
+
+
+def dump_permission_tree(permissions) -> list[dict[str, Any]]:
+    return [{**dump_model(p), "children": dump_permission_tree(p.children)} for p in permissions]
+
+
+def index_permission_tree(tree: list[dict[str, Any]], prefix: str = "", index: dict[str, int] | None = None):
+    """生成 完整权限代码 -> 权限ID 的索引"""
+    if index is None:
+        index = {}
+    for node in tree:
+        fullcode = prefix + node["code"]
+        index[fullcode] = node["id"]
+        index_permission_tree(node["children"], fullcode + ".", index)
+    return index
+
+
+class PermissionTreeCache:
+    """
+    权限树的快照缓存，快照以版本号为key保存在Redis和进程内
+    权限修改后版本号增加，重复的请求直接使用进程内的快照，不需要查询数据库
+    快照同时维护 完整权限代码 -> 权限ID 的索引
+    """
+
+    def __init__(self, redis: aioredis.Redis):
+        self.redis = redis
+        self.version: int | None = None
+        self.version_at = 0.0
+        self.snapshot_version: int | None = None
+        self.snapshot: list[dict[str, Any]] = []
+        self.fullcodes: dict[str, int] = {}
+
+    @staticmethod
+    def snapshot_key(version: int) -> str:
+        return f"permission.tree.{version}"
+
+    async def get_tree(self, system_repo: SystemRepo) -> list[dict[str, Any]]:
+        """获取完整的权限树，Redis不可用时从数据库生成，并且不作为快照保留"""
+        version = None
+        try:
+            now = time.monotonic()
+            if self.version is None or now - self.version_at > VERSION_TTL:  # 定期重新读取版本号
+                self.version = int(await self.redis.get(TREE_VERSION_KEY) or 0)
+                self.version_at = now
+            version = self.version
+            if self.snapshot_version == version:
+                return self.snapshot
+            data = await self.redis.get(self.snapshot_key(version))
+        except Exception:
+            traceback.print_exc()
+            data, version = None, None
+        if data:
+            snapshot = json.loads(data)
+        else:
+            permissions = await system_repo.find_all_permissions()
+            snapshot = dump_permission_tree(build_permission_tree(permissions))
+            if version is not None:
+                try:
+                    await self.redis.set(self.snapshot_key(version), json.dumps(snapshot), ex=TREE_TTL)
+                except Exception:
+                    traceback.print_exc()
+        self.snapshot, self.fullcodes, self.snapshot_version = snapshot, index_permission_tree(snapshot), version
+        return snapshot
+
+    async def resolve_fullcodes(self, system_repo: SystemRepo, codes: list[str]) -> dict[str, int | None]:
+        """批量将完整权限代码（如 admin.user.create）转换为权限ID，不存在的权限为None"""
+        await self.get_tree(system_repo)
+        return {code: self.fullcodes.get(code) for code in codes}
+
+    async def bump_version(self):
+        """权限修改并提交之后调用"""
+        self.version = await self.redis.incr(TREE_VERSION_KEY)
+        self.version_at = time.monotonic()
+        await publish(TREE_CHANNEL, {"version": self.version})
+
+    def metrics(self) -> dict[str, Any]:
+        return {"version": self.version, "snapshot_version": self.snapshot_version, "fullcodes": len(self.fullcodes)}
+
+
+permission_tree_cache = PermissionTreeCache(redis)
+register_metrics("permission_tree_cache", permission_tree_cache.metrics)
+
+
+@subscribe(TREE_CHANNEL)
+async def on_tree_version(message: dict[str, Any]):
+    permission_tree_cache.version = max(permission_tree_cache.version or 0, message["version"])
+
+
+def get_permission_tree_cache() -> PermissionTreeCache:
+    return permission_tree_cache
+
+
+rebalance_tasks: set[asyncio.Task] = set()
+
+
+async def rebalance_permission_sort(parent_id: int):
+    """使用新的会话检查同级权限的排序值，相邻权限之间没有空隙时重新分配"""
+    try:
+        async with async_session_local() as db:
+            system_repo = SystemRepo(db)
+            if not await system_repo.permission_sort_exhausted(parent_id):  # 其他请求已经重新分配过
+                return
+            await system_repo.rebalance_permission_sort(parent_id)
+            await db.commit()
+            await run_after_commit(db)
+        await permission_tree_cache.bump_version()
+    except Exception:
+        traceback.print_exc()
+
+
+async def schedule_rebalance_permission_sort(parent_id: int):
+    """在事务提交之后调用，在后台重新分配排序值，不增加请求的耗时"""
+    task = asyncio.create_task(rebalance_permission_sort(parent_id))
+    rebalance_tasks.add(task)  # 保持引用，避免任务执行完之前被回收
+    task.add_done_callback(rebalance_tasks.discard)
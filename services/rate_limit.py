@@ -0,0 +1,77 @@
+import math
+import time
+import traceback
+from typing import Any
+
+from redis import asyncio as aioredis
+
+from config import RATE_LIMIT_ENABLED
+from database.redis import redis
+from utils.metrics import register_metrics
+from utils.uuid import uuidv4
+
+# 滑动窗口：有序集合中保存窗口内每次请求的时间，超过限制时返回最早一次请求离开窗口还需要的毫秒数
+# ARGV[5] 为0时只检查不记录
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return tonumber(oldest[2]) + window - now
+end
+if ARGV[5] == '0' then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], window)
+return 0
+"""
+
+
+def parse_rate(rate: str) -> tuple[int, int]:
+    """解析 次数/秒数 格式的限制，例如 10/60 表示60秒内最多10次"""
+    limit, _, window = rate.partition("/")
+    return int(limit), int(window)
+
+
+class RateLimiter:
+    """基于Redis滑动窗口的限流，检查和记录在一个Lua脚本中原子执行，Redis不可用时不限流"""
+
+    def __init__(self, redis: aioredis.Redis, enabled: bool):
+        self.redis = redis
+        self.enabled = enabled
+        self.script = redis.register_script(SLIDING_WINDOW_SCRIPT)
+        self.allowed = 0
+        self.limited: dict[str, int] = {}
+
+    async def hit(self, name: str, key: str, rate: str, record: bool = True) -> int:
+        """记录一次请求，返回需要等待的秒数，0表示没有超过限制，record为False时只检查不记录"""
+        if not self.enabled:
+            return 0
+        limit, window = parse_rate(rate)
+        try:
+            wait = await self.script(
+                keys=[f"rate_limit.{name}.{key}"],
+                args=[int(time.time() * 1000), window * 1000, limit, uuidv4(), int(record)],
+            )
+        except Exception:
+            traceback.print_exc()
+            return 0
+        if wait <= 0:
+            self.allowed += 1
+            return 0
+        self.limited[name] = self.limited.get(name, 0) + 1
+        return max(1, math.ceil(wait / 1000))
+
+    def metrics(self) -> dict[str, Any]:
+        return {"enabled": self.enabled, "allowed": self.allowed, "limited": self.limited}
+
+
+rate_limiter = RateLimiter(redis, RATE_LIMIT_ENABLED)
+register_metrics("rate_limiter", rate_limiter.metrics)
+
+
+def get_rate_limiter() -> RateLimiter:
+    return rate_limiter
@@ -0,0 +1,153 @@
+import time
+import traceback
+from typing import Any, Callable
+
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
+from redis import asyncio as aioredis
+
+from dal.system import SystemRepo
+from database.redis import publish, redis, subscribe
+from database.session import async_session_local
+from utils.metrics import register_metrics
+
+ADMIN_ROUTE_PREFIX = "/adminapi/"
+VERSION_KEY = "system.api.version"
+RELOAD_CHANNEL = "system.api.reload"
+VERSION_TTL = 5  # 定期重新读取版本号的间隔，错过广播消息时最多使用这么久的旧Api表
+
+
+class RouteTable:
+    """
+    进程内的路由表：
+    - endpoint -> 路由路径，用于获取当前请求对应的路由
+    - path -> 请求方法，用于检查路由是否存在
+    - (method, path) -> Api的权限ID，用于检查非超级管理员的权限
+    Api表的数据在启动时加载，修改后通过版本号和广播通知所有worker重新加载
+    """
+
+    def __init__(self, redis: aioredis.Redis):
+        self.redis = redis
+        self.version = -1  # -1表示Api表还没有加载
+        self.version_at = 0.0  # 上次读取版本号的时间
+        self.endpoints: dict[Callable, str] = {}
+        self.methods: dict[str, frozenset[str]] = {}
+        self.admin_routes: dict[str, list[tuple[str, str]]] = {}  # 请求方法 -> 管理后台的路由，空字符串表示所有方法
+        self.apis: dict[tuple[str, str], tuple[int, ...]] = {}
+        self.stale_apis: list[tuple[str, str]] = []
+        self.synced = 0  # 自动同步新增的Api数量
+
+    def build_routes(self, app: FastAPI):
+        endpoints = {}
+        methods: dict[str, set[str]] = {}
+        admin_routes: dict[str, list[tuple[str, str]]] = {"": []}
+        for route in app.routes:
+            if not isinstance(route, APIRoute):
+                continue
+            endpoints[route.endpoint] = route.path
+            methods.setdefault(route.path, set()).update(route.methods)
+            if route.path.startswith(ADMIN_ROUTE_PREFIX):
+                for method in sorted(route.methods):
+                    admin_routes[""].append((method, route.path))
+                    admin_routes.setdefault(method, []).append((method, route.path))
+        self.endpoints = endpoints
+        self.methods = {path: frozenset(m) for path, m in methods.items()}
+        self.admin_routes = admin_routes
+
+    def ensure_routes(self, app: FastAPI):
+        if not self.endpoints:
+            self.build_routes(app)
+
+    def get_path(self, app: FastAPI, endpoint: Callable, default: str) -> str:
+        self.ensure_routes(app)
+        return self.endpoints.get(endpoint, default)
+
+    def has_route(self, app: FastAPI, method: str, path: str) -> bool:
+        """检查路由是否存在"""
+        self.ensure_routes(app)
+        return method in self.methods.get(path, ())
+
+    def find_admin_routes(self, app: FastAPI, method: str = "", path: str = "") -> list[tuple[str, str]]:
+        """查找管理后台的路由，path为路径前缀"""
+        self.ensure_routes(app)
+        routes = self.admin_routes.get(method, [])
+        if path:
+            routes = [route for route in routes if route[1].startswith(path)]
+        return routes
+
+    async def sync_apis(self, app: FastAPI):
+        """将管理后台的路由同步到Api表：新增缺少的Api（不设置权限），过期的Api只记录不删除"""
+        routes = self.find_admin_routes(app)
+        async with async_session_local() as db:
+            created, apis = await SystemRepo(db).sync_apis(routes)
+            await db.commit()
+        self.stale_apis = sorted({(api.method, api.path) for api in apis} - set(routes))
+        self.synced += len(created)
+        if created:
+            await self.notify_changed()
+
+    async def load(self):
+        """从数据库加载Api表，Redis不可用时版本号记为0，下次检查版本号时重新加载"""
+        version_at = time.monotonic()
+        try:
+            version = int(await self.redis.get(VERSION_KEY) or 0)  # 先读取版本号，加载过程中的修改会再次触发加载
+        except Exception:
+            traceback.print_exc()
+            version = 0
+        async with async_session_local() as db:
+            apis = await SystemRepo(db).find_all_apis()
+        self.apis = {(api.method, api.path): tuple(api.permission_ids) for api in apis}
+        self.version = version
+        self.version_at = version_at
+
+    async def check_version(self):
+        """重新读取版本号，有更新的版本时重新加载，避免错过广播消息之后一直使用旧的Api表"""
+        self.version_at = time.monotonic()
+        try:
+            version = int(await self.redis.get(VERSION_KEY) or 0)
+        except Exception:
+            traceback.print_exc()
+            return
+        if version > self.version:
+            await self.load()
+
+    async def get_permission_ids(self, method: str, path: str) -> tuple[int, ...] | None:
+        """获取Api需要的权限ID，Api不存在时返回None"""
+        if self.version < 0:
+            await self.load()
+        elif time.monotonic() - self.version_at > VERSION_TTL:
+            await self.check_version()
+        return self.apis.get((method, path))
+
+    async def notify_changed(self):
+        """Api表修改并提交之后调用，通知所有worker重新加载"""
+        version = await self.redis.incr(VERSION_KEY)
+        await self.load()
+        await publish(RELOAD_CHANNEL, {"version": version})
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "version": self.version,
+            "routes": len(self.endpoints),
+            "apis": len(self.apis),
+            "stale_apis": len(self.stale_apis),
+            "synced": self.synced,
+        }
+
+
+route_table = RouteTable(redis)
+register_metrics("route_table", route_table.metrics)
+
+
+@subscribe(RELOAD_CHANNEL)
+async def on_reload(message: dict[str, Any]):
+    if message["version"] > route_table.version:
+        try:
+            await route_table.load()
+        except Exception:
+            traceback.print_exc()
+            route_table.version = -1  # 加载失败，下次使用时重新加载
+
+
+def get_route_table() -> RouteTable:
+    return route_table
@@ -0,0 +1,61 @@
+import hashlib
+import json
+import traceback
+from typing import Any, Awaitable, Callable
+
+from redis import asyncio as aioredis
+from sqlalchemy import Table
+
+from config import ADMIN_SEARCH_CACHE_TTL
+from dal.base import count_version_key
+from database.redis import ClientCache, client_cache, redis
+from utils.metrics import register_metrics
+
+
+class SearchCache:
+    """
+    搜索结果的短时缓存，热门的搜索条件直接从Redis返回
+    缓存带有表的版本号，表有新增数据后版本号增加，旧的缓存自动失效；修改的数据在缓存过期后生效
+    """
+
+    def __init__(self, redis: aioredis.Redis, client_cache: ClientCache, ttl: int):
+        self.redis = redis
+        self.client_cache = client_cache
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_load(self, table: Table, params: dict[str, Any], loader: Callable[[], Awaitable[Any]]) -> Any:
+        """params是搜索条件，loader返回可以JSON序列化的结果"""
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        key = f"search.{table.name}.{digest}"
+        try:
+            version, data = await self.client_cache.mget(count_version_key(table), key)
+        except Exception:
+            traceback.print_exc()
+            return await loader()
+        version = int(version or 0)
+        if data:
+            cached = json.loads(data)
+            if cached["version"] == version:
+                self.hits += 1
+                return cached["data"]
+
+        self.misses += 1
+        result = await loader()
+        try:
+            await self.redis.set(key, json.dumps({"version": version, "data": result}), ex=self.ttl)
+        except Exception:
+            traceback.print_exc()
+        return result
+
+    def metrics(self) -> dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+search_cache = SearchCache(redis, client_cache, ADMIN_SEARCH_CACHE_TTL)
+register_metrics("search_cache", search_cache.metrics)
+
+
+def get_search_cache() -> SearchCache:
+    return search_cache
@@ -0,0 +1,232 @@
+import asyncio
+import json
+import time
+import traceback
+from datetime import datetime, timezone
+from functools import partial
+from typing import Any
+
+from redis import asyncio as aioredis
+
+from config import (
+    ADMIN_SESSION_FLUSH_BATCH,
+    ADMIN_SESSION_FLUSH_INTERVAL,
+    ADMIN_SESSION_STORE,
+    ADMIN_SESSION_TOUCH_INTERVAL,
+    ADMIN_TOKEN_CACHE_SIZE,
+)
+from dal.admin import AdminRepo
+from dal.base import dump_model, load_model
+from database.redis import redis
+from database.session import async_session_local
+from models.admin import AdminUserToken, AdminUserTokenStatus
+from services.token_cache import AdminTokenCache, admin_token_cache
+from utils.cache import TTLCache
+from utils.metrics import register_metrics
+from utils.uuid import uuidv4
+
+LAST_SEEN_KEY = "admin_session.last_seen"
+DIRTY_KEY = "admin_session.dirty"
+
+
+class DatabaseSessionStore:
+    """
+    登录会话保存在数据库，校验结果通过 AdminTokenCache 缓存
+    最后访问时间先记录在Redis，由后台任务定期批量写回数据库
+    """
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        token_cache: AdminTokenCache,
+        flush_interval: int,
+        flush_batch: int,
+        touch_interval: int,
+    ):
+        self.redis = redis
+        self.token_cache = token_cache
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.touched = TTLCache(ADMIN_TOKEN_CACHE_SIZE, touch_interval)
+        self.flushed_last_seen = 0
+
+    async def create(
+        self, admin_repo: AdminRepo, admin_user_id: int, expired_at: datetime, ip: str, user_agent: str
+    ) -> AdminUserToken:
+        return await admin_repo.create_admin_user_token(
+            admin_user_id, expired_at=expired_at, ip=ip, user_agent=user_agent
+        )
+
+    async def get(self, admin_repo: AdminRepo, token: str) -> AdminUserToken | None:
+        principal = await self.token_cache.get(token)
+        if principal:
+            return await admin_repo.merge_admin_user_token(principal)
+        admin_user_token = await admin_repo.get_admin_user_token(token)
+        if admin_user_token:
+            await self.token_cache.set(admin_user_token)
+        return admin_user_token
+
+    async def revoke(self, admin_repo: AdminRepo, admin_user_token: AdminUserToken):
+        admin_user_token.status = AdminUserTokenStatus.REVOKED.value
+        admin_repo.after_commit(partial(self.token_cache.invalidate, admin_user_token.id))
+
+    async def touch(self, token_id: str):
+        """记录最后访问时间，同一个token在每个worker中每个间隔只写一次Redis"""
+        if self.touched.get(token_id):
+            return
+        self.touched.set(token_id, True)
+        try:
+            await self.redis.zadd(LAST_SEEN_KEY, {token_id: time.time()})
+        except Exception:
+            traceback.print_exc()
+
+    async def run_forever(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                traceback.print_exc()
+
+    async def flush(self):
+        await self.flush_last_seen()
+
+    async def flush_last_seen(self):
+        """将Redis中的最后访问时间写回数据库，先重命名再读取，多个worker不会重复写入"""
+        key = f"{LAST_SEEN_KEY}.{uuidv4()}"
+        try:
+            await self.redis.rename(LAST_SEEN_KEY, key)
+        except aioredis.ResponseError:  # 没有需要写回的数据
+            return
+        try:
+            items = await self.redis.zrange(key, 0, -1, withscores=True)
+            for i in range(0, len(items), self.flush_batch):
+                last_seen = [
+                    (id, datetime.fromtimestamp(ts, timezone.utc)) for id, ts in items[i : i + self.flush_batch]
+                ]
+                async with async_session_local() as db:
+                    await AdminRepo(db).update_admin_user_token_last_seen(last_seen)
+                    await db.commit()
+        except BaseException:
+            # 写入失败时合并回原来的集合等待下次写回，已经写入的批次重复写入也没有影响
+            await self.redis.zunionstore(LAST_SEEN_KEY, [LAST_SEEN_KEY, key], aggregate="MAX")
+            await self.redis.delete(key)
+            raise
+        await self.redis.delete(key)
+        self.flushed_last_seen += len(items)
+
+    def metrics(self) -> dict[str, Any]:
+        return {"store": "database", "touched": len(self.touched), "flushed_last_seen": self.flushed_last_seen}
+
+
+class RedisSessionStore(DatabaseSessionStore):
+    """
+    登录会话以Redis为准，创建和登出只写Redis，修改过的会话ID记录在集合中，由后台任务批量写回数据库用于审计
+    Redis中没有的会话回退到数据库查询，兼容切换存储之前登录的token
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.flushed_sessions = 0
+
+    @staticmethod
+    def session_key(token: str) -> str:
+        return f"admin_session.{token}"
+
+    async def save(self, record: dict[str, Any], ttl: int | None = None):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if ttl is None:
+                pipe.set(self.session_key(record["id"]), json.dumps(record), keepttl=True, xx=True)
+            else:
+                pipe.set(self.session_key(record["id"]), json.dumps(record), ex=ttl)
+            pipe.sadd(DIRTY_KEY, record["id"])
+            await pipe.execute()
+
+    async def create(
+        self, admin_repo: AdminRepo, admin_user_id: int, expired_at: datetime, ip: str, user_agent: str
+    ) -> AdminUserToken:
+        now = datetime.now(timezone.utc)
+        admin_user_token = AdminUserToken(
+            id=uuidv4(),
+            admin_user_id=admin_user_id,
+            status=AdminUserTokenStatus.ACTIVE.value,
+            expired_at=expired_at.astimezone(timezone.utc),
+            ip=ip,
+            user_agent=user_agent,
+            created_at=now,
+            updated_at=now,
+            deleted=False,
+        )
+        await self.save(dump_model(admin_user_token), int((admin_user_token.expired_at - now).total_seconds()))
+        return admin_user_token
+
+    async def get(self, admin_repo: AdminRepo, token: str) -> AdminUserToken | None:
+        data = await self.redis.get(self.session_key(token))
+        if not data:
+            return await super().get(admin_repo, token)
+        record = json.loads(data)
+        if record["status"] != AdminUserTokenStatus.ACTIVE.value:
+            return None
+        admin_user = await self.token_cache.get_admin_user(record["admin_user_id"])
+        if admin_user is None:
+            user = await admin_repo.get_admin_user(record["admin_user_id"])
+            if not user:
+                return None
+            await self.token_cache.set_admin_user(user)
+            admin_user = dump_model(user, exclude=("password", "salt"))
+        return await admin_repo.merge_admin_user_token({"token": record, "admin_user": admin_user})
+
+    async def revoke(self, admin_repo: AdminRepo, admin_user_token: AdminUserToken):
+        data = await self.redis.get(self.session_key(admin_user_token.id))
+        if not data:
+            return await super().revoke(admin_repo, admin_user_token)
+        record = json.loads(data)
+        record["status"] = AdminUserTokenStatus.REVOKED.value
+        record["updated_at"] = datetime.now(timezone.utc).isoformat()
+        admin_repo.after_commit(partial(self.save, record))
+
+    async def flush(self):
+        await self.flush_sessions()
+        await self.flush_last_seen()
+
+    async def flush_sessions(self):
+        """将修改过的会话批量写回数据库，写入失败的会话放回集合等待下次写回"""
+        while True:
+            ids = await self.redis.spop(DIRTY_KEY, self.flush_batch)
+            if not ids:
+                return
+            try:
+                values = await self.redis.mget([self.session_key(id) for id in ids])
+                records = []
+                for value in values:
+                    if value:  # 已经过期的会话不再写回
+                        data = json.loads(value)
+                        admin_user_token = load_model(AdminUserToken, data)
+                        records.append({key: getattr(admin_user_token, key) for key in data})
+                async with async_session_local() as db:
+                    await AdminRepo(db).save_admin_user_tokens(records)
+                    await db.commit()
+            except BaseException:  # 包括退出时的取消
+                await self.redis.sadd(DIRTY_KEY, *ids)
+                raise
+            self.flushed_sessions += len(records)
+            if len(ids) < self.flush_batch:
+                return
+
+    def metrics(self) -> dict[str, Any]:
+        return {**super().metrics(), "store": "redis", "flushed_sessions": self.flushed_sessions}
+
+
+def create_session_store() -> DatabaseSessionStore:
+    store_class = RedisSessionStore if ADMIN_SESSION_STORE == "redis" else DatabaseSessionStore
+    return store_class(
+        redis, admin_token_cache, ADMIN_SESSION_FLUSH_INTERVAL, ADMIN_SESSION_FLUSH_BATCH, ADMIN_SESSION_TOUCH_INTERVAL
+    )
+
+
+session_store = create_session_store()
+register_metrics("session_store", session_store.metrics)
+
+
+def get_session_store() -> DatabaseSessionStore:
+    return session_store
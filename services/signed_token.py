@@ -0,0 +1,120 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import time
+from datetime import datetime, timezone
+from typing import Any
+
+from redis import asyncio as aioredis
+
+from config import SESSION_SIGN_KEY
+from database.redis import redis
+from models.admin import AdminUserToken, AdminUserTokenStatus
+from utils.metrics import register_metrics
+
+REVOKED_KEY = "admin_token.revoked"
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def b64decode(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+
+def is_signed_token(token: str) -> bool:
+    """签名token的格式是 payload.signature，加密token是十六进制字符串"""
+    return "." in token
+
+
+class SignedTokenService:
+    """
+    无状态的签名token，token中包含用户ID、token ID和过期时间，使用HMAC-SHA256签名
+    校验签名和过期时间不需要查询数据库，登出的token ID保存在Redis的有序集合中，分数是过期时间
+    """
+
+    def __init__(self, redis: aioredis.Redis, key: str):
+        self.redis = redis
+        self.key = key.encode()
+        self.verified = 0
+        self.rejected = 0
+        self.revoked = 0
+
+    def sign(self, admin_user_token: AdminUserToken) -> str:
+        claims = {
+            "u": admin_user_token.admin_user_id,
+            "t": admin_user_token.id,
+            "e": int(admin_user_token.expired_at.timestamp()),
+        }
+        payload = b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        return f"{payload}.{self.signature(payload)}"
+
+    def signature(self, payload: str) -> str:
+        return b64encode(hmac.new(self.key, payload.encode(), hashlib.sha256).digest())
+
+    def verify(self, token: str) -> dict[str, Any] | None:
+        """校验签名和过期时间，返回token中的信息，无效时返回None"""
+        payload, _, signature = token.partition(".")
+        if not hmac.compare_digest(signature, self.signature(payload)):
+            self.rejected += 1
+            return None
+        try:
+            claims = json.loads(b64decode(payload))
+            valid = (
+                isinstance(claims["u"], int)
+                and isinstance(claims["t"], str)
+                and isinstance(claims["e"], int)
+                and claims["e"] > time.time()
+            )
+        except (binascii.Error, ValueError, KeyError, TypeError):
+            valid = False
+        if not valid:
+            self.rejected += 1
+            return None
+        self.verified += 1
+        return claims
+
+    @staticmethod
+    def principal(claims: dict[str, Any], admin_user: dict[str, Any] | None) -> dict[str, Any]:
+        """生成和token缓存相同格式的数据"""
+        return {
+            "token": {
+                "id": claims["t"],
+                "admin_user_id": claims["u"],
+                "status": AdminUserTokenStatus.ACTIVE.value,
+                "expired_at": datetime.fromtimestamp(claims["e"], timezone.utc).isoformat(),
+            },
+            "admin_user": admin_user,
+        }
+
+    async def is_revoked(self, token_id: str) -> bool:
+        return await self.redis.zscore(REVOKED_KEY, token_id) is not None
+
+    async def revoke(self, token_id: str, expired_at: datetime | None):
+        """登出之后调用，token过期后自动从集合中删除"""
+        now = time.time()
+        exp = expired_at.timestamp() if expired_at else now
+        if exp <= now:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(REVOKED_KEY, {token_id: exp})
+            pipe.zremrangebyscore(REVOKED_KEY, "-inf", now)
+            pipe.zrange(REVOKED_KEY, -1, -1, withscores=True)
+            _, _, last = await pipe.execute()
+        if last:  # 集合在最后一个token过期后删除
+            await self.redis.expireat(REVOKED_KEY, int(last[0][1]) + 1)
+        self.revoked += 1
+
+    def metrics(self) -> dict[str, Any]:
+        return {"verified": self.verified, "rejected": self.rejected, "revoked": self.revoked}
+
+
+signed_token_service = SignedTokenService(redis, SESSION_SIGN_KEY)
+register_metrics("signed_token", signed_token_service.metrics)
+
+
+def get_signed_token_service() -> SignedTokenService:
+    return signed_token_service
@@ -0,0 +1,181 @@
+import json
+import traceback
+from datetime import datetime
+from typing import Any
+
+from redis import asyncio as aioredis
+
+from config import (
+    ADMIN_TOKEN_CACHE_ENABLED,
+    ADMIN_TOKEN_CACHE_LOCAL_TTL,
+    ADMIN_TOKEN_CACHE_SIZE,
+    ADMIN_TOKEN_CACHE_TTL,
+)
+from dal.base import dump_model
+from database.redis import publish, redis, subscribe
+from models.admin import AdminUser, AdminUserToken
+from utils.cache import TTLCache
+from utils.metrics import register_metrics
+
+INVALIDATE_CHANNEL = "admin_token.invalidate"
+
+
+class AdminTokenCache:
+    """
+    登录token校验结果的两级缓存：进程内LRU + Redis
+    缓存的内容是token的状态、过期时间以及精简的用户信息（不包含密码）
+    签名token不需要缓存token本身，只按用户ID缓存精简的用户信息
+    """
+
+    def __init__(self, redis: aioredis.Redis, enabled: bool, maxsize: int, local_ttl: int, ttl: int):
+        self.redis = redis
+        self.enabled = enabled
+        self.ttl = ttl
+        self.local = TTLCache(maxsize, local_ttl)
+        self.local_users = TTLCache(maxsize, local_ttl)
+        self.redis_hits = 0
+        self.redis_misses = 0
+
+    @staticmethod
+    def token_key(token: str) -> str:
+        return f"admin_token.{token}"
+
+    @staticmethod
+    def user_key(admin_user_id: int) -> str:
+        return f"admin_token.user.{admin_user_id}"
+
+    @staticmethod
+    def admin_user_key(admin_user_id: int) -> str:
+        return f"admin_token.admin_user.{admin_user_id}"
+
+    async def get(self, token: str) -> dict[str, Any] | None:
+        if not self.enabled:
+            return None
+        principal = self.local.get(token)
+        if principal is not None:
+            return principal
+        try:
+            data = await self.redis.get(self.token_key(token))
+        except Exception:
+            traceback.print_exc()
+            return None
+        if not data:
+            self.redis_misses += 1
+            return None
+        self.redis_hits += 1
+        principal = json.loads(data)
+        self.local.set(token, principal)
+        return principal
+
+    async def set(self, admin_user_token: AdminUserToken):
+        if not self.enabled:
+            return
+        ttl = self.ttl
+        if admin_user_token.expired_at:  # 缓存时间不超过token的有效期
+            remaining = (admin_user_token.expired_at - datetime.now(admin_user_token.expired_at.tzinfo)).total_seconds()
+            ttl = min(ttl, int(remaining))
+        if ttl <= 0:
+            return
+        admin_user = admin_user_token.admin_user
+        principal = {
+            "token": dump_model(admin_user_token),
+            "admin_user": dump_model(admin_user, exclude=("password", "salt")) if admin_user else None,
+        }
+        self.local.set(admin_user_token.id, principal)
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.set(self.token_key(admin_user_token.id), json.dumps(principal), ex=ttl)
+                pipe.sadd(self.user_key(admin_user_token.admin_user_id), admin_user_token.id)
+                pipe.expire(self.user_key(admin_user_token.admin_user_id), self.ttl)
+                await pipe.execute()
+        except Exception:
+            traceback.print_exc()
+
+    async def get_admin_user(self, admin_user_id: int) -> dict[str, Any] | None:
+        if not self.enabled:
+            return None
+        admin_user = self.local_users.get(admin_user_id)
+        if admin_user is not None:
+            return admin_user
+        try:
+            data = await self.redis.get(self.admin_user_key(admin_user_id))
+        except Exception:
+            traceback.print_exc()
+            return None
+        if not data:
+            self.redis_misses += 1
+            return None
+        self.redis_hits += 1
+        admin_user = json.loads(data)
+        self.local_users.set(admin_user_id, admin_user)
+        return admin_user
+
+    async def set_admin_user(self, admin_user: AdminUser):
+        if not self.enabled:
+            return
+        data = dump_model(admin_user, exclude=("password", "salt"))
+        self.local_users.set(admin_user.id, data)
+        try:
+            await self.redis.set(self.admin_user_key(admin_user.id), json.dumps(data), ex=self.ttl)
+        except Exception:
+            traceback.print_exc()
+
+    async def invalidate(self, *tokens: str):
+        """token状态变化后调用，例如登出"""
+        if not self.enabled or not tokens:
+            return
+        for token in tokens:
+            self.local.pop(token)
+        await self.redis.delete(*[self.token_key(token) for token in tokens])
+        await publish(INVALIDATE_CHANNEL, {"tokens": list(tokens)})
+
+    async def invalidate_users(self, *admin_user_ids: int):
+        """用户信息、密码、状态或者角色变化后调用，清除这些用户的所有token缓存"""
+        if not self.enabled or not admin_user_ids:
+            return
+        self.drop_local_users(admin_user_ids)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for admin_user_id in admin_user_ids:
+                pipe.smembers(self.user_key(admin_user_id))
+            members = await pipe.execute()
+        keys = [self.token_key(token) for tokens in members for token in tokens]
+        keys += [self.user_key(admin_user_id) for admin_user_id in admin_user_ids]
+        keys += [self.admin_user_key(admin_user_id) for admin_user_id in admin_user_ids]
+        await self.redis.delete(*keys)
+        await publish(INVALIDATE_CHANNEL, {"admin_user_ids": list(admin_user_ids)})
+
+    def drop_local_users(self, admin_user_ids):
+        admin_user_ids = set(admin_user_ids)
+        self.local.pop_if(lambda _, principal: principal["token"]["admin_user_id"] in admin_user_ids)
+        for admin_user_id in admin_user_ids:
+            self.local_users.pop(admin_user_id)
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            **self.local.stats(),
+            "users": self.local_users.stats(),
+            "redis_hits": self.redis_hits,
+            "redis_misses": self.redis_misses,
+        }
+
+
+admin_token_cache = AdminTokenCache(
+    redis,
+    ADMIN_TOKEN_CACHE_ENABLED,
+    ADMIN_TOKEN_CACHE_SIZE,
+    ADMIN_TOKEN_CACHE_LOCAL_TTL,
+    ADMIN_TOKEN_CACHE_TTL,
+)
+register_metrics("admin_token_cache", admin_token_cache.metrics)
+
+
+@subscribe(INVALIDATE_CHANNEL)
+async def on_invalidate(message: dict[str, Any]):
+    for token in message.get("tokens", []):
+        admin_token_cache.local.pop(token)
+    if message.get("admin_user_ids"):
+        admin_token_cache.drop_local_users(message["admin_user_ids"])
+
+
+def get_admin_token_cache() -> AdminTokenCache:
+    return admin_token_cache
@@ -0,0 +1,113 @@
+import asyncio
+import traceback
+from datetime import date, datetime, timedelta, timezone
+from typing import Any
+
+from redis import asyncio as aioredis
+
+from config import (
+    ADMIN_TOKEN_ARCHIVE,
+    ADMIN_TOKEN_REAPER_BATCH,
+    ADMIN_TOKEN_REAPER_INTERVAL,
+    ADMIN_TOKEN_RETENTION_DAYS,
+)
+from dal.admin import AdminRepo, month_range
+from database.redis import redis
+from database.session import async_session_local
+from utils.metrics import register_metrics
+
+LOCK_KEY = "admin_token.reaper.lock"
+PARTITION_AHEAD = 2  # 提前创建的分区月数
+
+
+def add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+class AdminTokenReaper:
+    """
+    定期清理过期和注销的token，每个事务最多删除batch条，避免长事务和大量的锁
+    所有worker都会运行，通过Redis锁保证每个周期只有一个worker执行清理
+    token表按月分区时，同时负责提前创建分区和删除超过保留时间的分区
+    """
+
+    def __init__(self, redis: aioredis.Redis, interval: int, batch: int, retention_days: int, archive: bool):
+        self.redis = redis
+        self.interval = interval
+        self.batch = batch
+        self.retention = timedelta(days=retention_days)
+        self.archive = archive
+        self.runs = 0
+        self.reaped = 0
+        self.partitions_created = 0
+        self.partitions_dropped = 0
+        self.last_run_at: datetime | None = None
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int | None:
+        """执行一次清理，返回删除的token数量，其他worker已经在本周期执行过时返回None"""
+        # 锁不主动释放，过期时间就是清理的周期
+        if not await self.redis.set(LOCK_KEY, 1, nx=True, ex=self.interval):
+            return None
+        now = datetime.now(timezone.utc)
+        before = now - self.retention
+        total = 0
+        while True:
+            async with async_session_local() as db:
+                count = await AdminRepo(db).reap_admin_user_tokens(before, self.batch, self.archive)
+                await db.commit()
+            total += count
+            if count < self.batch:
+                break
+        await self.maintain_partitions(now)
+        self.runs += 1
+        self.reaped += total
+        self.last_run_at = now
+        return total
+
+    async def maintain_partitions(self, now: datetime):
+        """创建当前和之后几个月的分区，删除整个月份都超过保留时间的分区"""
+        async with async_session_local() as db:
+            admin_repo = AdminRepo(db)
+            if not await admin_repo.is_admin_user_token_partitioned():
+                return
+            partitions = await admin_repo.find_admin_user_token_partitions()
+            current = now.date().replace(day=1)
+            for i in range(PARTITION_AHEAD + 1):
+                month = add_months(current, i)
+                if month not in partitions:
+                    await admin_repo.create_admin_user_token_partition(month)
+                    self.partitions_created += 1
+            for month, name in sorted(partitions.items()):
+                if datetime.combine(month_range(month)[1], datetime.min.time(), timezone.utc) > now - self.retention:
+                    continue
+                await admin_repo.drop_admin_user_token_partition(name, self.archive)
+                self.partitions_dropped += 1
+            await db.commit()
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "reaped": self.reaped,
+            "partitions_created": self.partitions_created,
+            "partitions_dropped": self.partitions_dropped,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+        }
+
+
+admin_token_reaper = AdminTokenReaper(
+    redis,
+    ADMIN_TOKEN_REAPER_INTERVAL,
+    ADMIN_TOKEN_REAPER_BATCH,
+    ADMIN_TOKEN_RETENTION_DAYS,
+    ADMIN_TOKEN_ARCHIVE,
+)
+register_metrics("admin_token_reaper", admin_token_reaper.metrics)
@@ -0,0 +1,48 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.redis import redis
+from database.session import engine
+
+
+def run(coro):
+    """在新的事件循环中执行协程，结束后关闭连接，连接不能跨事件循环复用"""
+
+    async def main():
+        try:
+            return await coro
+        finally:
+            await redis.connection_pool.disconnect()
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture(scope="session")
+def redis_available():
+    async def ping():
+        await redis.ping()
+
+    try:
+        run(ping())
+    except Exception:
+        pytest.skip("Redis is not available")
+
+
+@pytest.fixture(scope="session")
+def database_available():
+    from sqlalchemy import text
+
+    async def ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    try:
+        run(ping())
+    except Exception:
+        pytest.skip("Database is not available")
@@ -0,0 +1,116 @@
+import asyncio
+
+from conftest import run
+
+from dal.admin import AdminRepo
+from dal.base import repo_cache
+from database.session import async_session_local
+from utils.uuid import uuidv4
+
+
+def test_concurrent_misses_load_once(redis_available):
+    key = f"repo_cache.test:{uuidv4()}"
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.1)
+        return {"value": 1}
+
+    async def main():
+        coalesced = repo_cache.coalesced
+        results = await asyncio.gather(*[repo_cache.get_or_load(key, ("test",), 60, load) for _ in range(10)])
+        return results, repo_cache.coalesced - coalesced
+
+    results, coalesced = run(main())
+    assert calls == 1
+    assert coalesced == 9
+    assert results == [{"value": 1}] * 10
+
+
+def test_failed_load_is_retried_by_waiters(redis_available):
+    key = f"repo_cache.test:{uuidv4()}"
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.1)
+        if calls == 1:
+            raise RuntimeError("first load fails")
+        return calls
+
+    async def main():
+        return await asyncio.gather(
+            *[repo_cache.get_or_load(key, ("test",), 60, load) for _ in range(3)], return_exceptions=True
+        )
+
+    results = run(main())
+    assert isinstance(results[0], RuntimeError)
+    assert all(isinstance(r, int) for r in results[1:])
+
+
+def test_invalidate_tag(redis_available):
+    key = f"repo_cache.test:{uuidv4()}"
+    tag = f"test.{uuidv4()}"
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    async def main():
+        assert await repo_cache.get_or_load(key, (tag,), 60, load) == 1
+        assert await repo_cache.get_or_load(key, (tag,), 60, load) == 1  # 本地缓存
+        repo_cache.local.pop(key)
+        assert await repo_cache.get_or_load(key, (tag,), 60, load) == 1  # Redis缓存
+        await repo_cache.invalidate(tag)
+        assert repo_cache.local.get(key) is None
+        assert await repo_cache.get_or_load(key, (tag,), 60, load) == 2
+        repo_cache.local.pop(key)
+        await repo_cache.invalidate(tag)  # Redis中缓存的版本号已经过期
+        assert await repo_cache.get_or_load(key, (tag,), 60, load) == 3
+
+    run(main())
+    assert calls == 3
+
+
+def test_uncommitted_writes_are_not_cached(redis_available, database_available):
+    async def main():
+        async with async_session_local() as db:
+            admin_repo = AdminRepo(db)
+            role = await admin_repo.create_admin_role(f"test-{uuidv4()}", "", [], 0)
+            id, name = role.id, role.name
+            assert (await admin_repo.get_admin_role(id)).name == name
+            await db.rollback()
+        async with async_session_local() as db:
+            return await AdminRepo(db).get_admin_role(id)
+
+    assert run(main()) is None
+
+
+def test_dirty_objects_are_not_cached(redis_available, database_available):
+    async def main():
+        async with async_session_local() as db:
+            role = await AdminRepo(db).create_admin_role(f"test-{uuidv4()}", "", [], 0)
+            id, name = role.id, role.name
+            await db.commit()
+        try:
+            async with async_session_local() as db:
+                admin_repo = AdminRepo(db)
+                role = await admin_repo.get_admin_role(id)
+                role.name = "changed"
+                assert (await admin_repo.get_admin_role(id)).name == "changed"
+                await db.rollback()
+            async with async_session_local() as db:
+                return name, (await AdminRepo(db).get_admin_role(id)).name
+        finally:
+            async with async_session_local() as db:
+                await db.delete(await AdminRepo(db).get_admin_role(id, with_for_update=True))
+                await db.commit()
+            await repo_cache.invalidate("admin_role")
+
+    name, cached_name = run(main())
+    assert cached_name == name
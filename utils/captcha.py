@@ -0,0 +1,7 @@
+from captcha.image import ImageCaptcha
+
+
+def render_captcha(text: str) -> bytes:
+    """生成验证码的PNG图片，在进程池中执行，只依赖captcha库"""
+    image = ImageCaptcha(width=300, height=100)
+    return image.generate(text).read()
@@ -0,0 +1,71 @@
+import csv
+import io
+import json
+import zlib
+from enum import Enum
+from typing import Any, AsyncIterator, Iterator
+
+CHUNK_SIZE = 64 * 1024  # 缓冲区超过该大小时输出一次
+
+
+class ExportFormat(Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv; charset=utf-8",
+}
+
+
+async def encode_rows(
+    rows: AsyncIterator[dict[str, Any]], fields: list[str], format: ExportFormat, compress: bool = False
+) -> AsyncIterator[bytes]:
+    """将数据逐行编码为NDJSON或者CSV，可选gzip压缩，内存中最多只保留一个缓冲区的数据"""
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 表示gzip格式
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if format == ExportFormat.CSV:
+        writer.writerow(fields)
+
+    def flush() -> bytes:
+        data = buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+        return compressor.compress(data) if compressor else data
+
+    async for row in rows:
+        if format == ExportFormat.CSV:
+            writer.writerow([json.dumps(row[f]) if isinstance(row[f], (list, dict)) else row[f] for f in fields])
+        else:
+            buf.write(json.dumps(row, ensure_ascii=False))
+            buf.write("\n")
+        if buf.tell() >= CHUNK_SIZE:
+            chunk = flush()
+            if chunk:
+                yield chunk
+
+    chunk = flush()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def decode_rows(content: bytes, format: ExportFormat) -> Iterator[tuple[int, dict[str, Any] | None]]:
+    """逐行解析NDJSON或者CSV，返回 (行号, 数据)，无法解析的行数据为None"""
+    text = content.decode("utf-8-sig")
+    if format == ExportFormat.CSV:
+        reader = csv.DictReader(io.StringIO(text))
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line, data in enumerate(text.splitlines(), start=1):
+        if not data.strip():
+            continue
+        try:
+            row = json.loads(data)
+        except ValueError:
+            row = None
+        yield line, row if isinstance(row, dict) else None
@@ -0,0 +1,12 @@
+from typing import Any, Callable
+
+_collectors: dict[str, Callable[[], dict[str, Any]]] = {}
+
+
+def register_metrics(name: str, collector: Callable[[], dict[str, Any]]):
+    """注册一组运行指标，collector在每次采集时调用"""
+    _collectors[name] = collector
+
+
+def collect_metrics() -> dict[str, dict[str, Any]]:
+    return {name: collector() for name, collector in _collectors.items()}
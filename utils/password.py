@@ -1,4 +1,5 @@
 import hashlib
+from typing import Callable
 
 
 def encrypt_password_md5(password: str, salt: str) -> str:
@@ -26,3 +27,19 @@ def encrypt_password_sha512(password: str, salt: str) -> str:
     sha256 = hashlib.sha512()
     sha256.update(m.encode("utf-8"))
     return sha256.hexdigest()
+
+
+def encrypt_password_scrypt(password: str, salt: str) -> str:
+    """scrypt是内存密集型的哈希算法，单次计算约需要16MB内存，需要在线程池中执行"""
+    if not password:
+        return ""
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt.encode("utf-8"), n=2**14, r=8, p=1, dklen=64).hex()
+
+
+# 密码加密方式 -> 加密函数
+PASSWORD_HASHERS: dict[str, Callable[[str, str], str]] = {
+    "md5": encrypt_password_md5,
+    "sha256": encrypt_password_sha256,
+    "sha512": encrypt_password_sha512,
+    "scrypt": encrypt_password_scrypt,
+}